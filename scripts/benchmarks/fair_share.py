@@ -0,0 +1,122 @@
+# Simulation of the waiting time of the tasks of "small" users while one "heavy" user has a big queue.
+#
+# One worker dispatches tasks with `get_incomplete_task_without_error_database`, the heavy user queues all its
+# tasks at the start, and each of the small users queues a new task every `--interval` dispatches.
+# The waiting time is measured in dispatched tasks (how many tasks were given to the worker before it).
+#
+#   python3 scripts/benchmarks/fair_share.py --heavy-tasks 300 --small-users 5
+#
+# With `--fifo` the fair share tags are removed before each dispatch, which gives the old "priority + FIFO" order.
+# Uses the database from the `DATABASE_URI` environment variable, only tasks of the `benchmark_fair_share` flow
+# are created and removed by this script.
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from sqlalchemy import delete, select  # noqa
+
+from visionatrix import database  # noqa
+from visionatrix.pydantic_models import WorkerDetailsRequest  # noqa
+from visionatrix.tasks_engine import get_incomplete_task_without_error_database  # noqa
+
+FLOW_NAME = "benchmark_fair_share"
+WORKER_DETAILS = WorkerDetailsRequest.model_validate(
+    {
+        "worker_version": "benchmark",
+        "system": {"hostname": "benchmark", "os": os.name, "version": sys.version, "embedded_python": False},
+        "devices": [{"name": "benchmark", "type": "cpu"}],
+    }
+)
+
+
+def reset_fair_share() -> None:
+    with database.SESSION() as session:
+        session.execute(delete(database.FairShareTag))
+        session.commit()
+
+
+def cleanup() -> None:
+    with database.SESSION() as session:
+        tasks_ids = select(database.TaskDetails.task_id).filter(database.TaskDetails.name == FLOW_NAME)
+        session.execute(delete(database.TaskLock).where(database.TaskLock.task_id.in_(tasks_ids)))
+        session.execute(delete(database.TaskDetails).where(database.TaskDetails.name == FLOW_NAME))
+        session.execute(delete(database.Worker).where(database.Worker.worker_id.like("admin:benchmark:%")))
+        session.commit()
+
+
+def create_tasks(user_id: str, count: int) -> list[int]:
+    with database.SESSION() as session:
+        tasks_queue = [database.TaskQueue() for _ in range(count)]
+        session.add_all(tasks_queue)
+        session.flush()
+        session.add_all(
+            [
+                database.TaskDetails(
+                    task_id=i.id,
+                    user_id=user_id,
+                    name=FLOW_NAME,
+                    priority=0,
+                    progress=0.0,
+                    error="",
+                    input_params={},
+                    outputs=[],
+                    input_files=[],
+                    flow_comfy={},
+                    group_scope=1,
+                )
+                for i in tasks_queue
+            ]
+        )
+        session.commit()
+        return [i.id for i in tasks_queue]
+
+
+def percentile(values: list[int], p: float) -> int:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(heavy_tasks: int, small_users: int, interval: int, fifo: bool) -> dict[str, list[int]]:
+    cleanup()
+    reset_fair_share()
+    create_tasks("heavy", heavy_tasks)
+    queued_at: dict[int, tuple[str, int]] = {}
+    waits: dict[str, list[int]] = {"heavy": [], "small": []}
+    dispatched = 0
+    while True:
+        if dispatched % interval == 0 and dispatched < heavy_tasks:
+            for i in range(small_users):
+                for task_id in create_tasks(f"small_{i}", 1):
+                    queued_at[task_id] = ("small", dispatched)
+        if fifo:
+            reset_fair_share()
+        task = get_incomplete_task_without_error_database("admin", WORKER_DETAILS, [FLOW_NAME], "")
+        if not task:
+            break
+        kind, queued_dispatched = queued_at.get(task["task_id"], ("heavy", 0))
+        waits[kind].append(dispatched - queued_dispatched)
+        dispatched += 1
+    cleanup()
+    return waits
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--heavy-tasks", type=int, default=300, help="Number of tasks queued by the heavy user")
+    parser.add_argument("--small-users", type=int, default=5, help="Number of small users")
+    parser.add_argument("--interval", type=int, default=20, help="Small users queue a task every N dispatches")
+    parser.add_argument("--fifo", action="store_true", help="Disable fair share to compare with")
+    args = parser.parse_args()
+
+    database.init_database_engine()
+    waits_results = run(args.heavy_tasks, args.small_users, args.interval, args.fifo)
+    print(f"{'user':>6} {'tasks':>6} {'p50 wait':>9} {'p99 wait':>9} {'max wait':>9}")
+    for user_kind, user_waits in waits_results.items():
+        print(
+            f"{user_kind:>6} {len(user_waits):>6} {percentile(user_waits, 0.5):>9} "
+            f"{percentile(user_waits, 0.99):>9} {max(user_waits):>9}"
+        )
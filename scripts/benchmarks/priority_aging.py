@@ -0,0 +1,142 @@
+# Simulation of the waiting time of low priority tasks under a sustained load of higher priority tasks.
+#
+# One worker dispatches tasks with `get_incomplete_task_without_error_database`, each task "takes" `--duration`
+# simulated seconds. Time is simulated by moving `created_at` of the queued tasks back after each dispatch,
+# and the aging is applied after each dispatch.
+# High priority tasks arrive slightly faster than the worker can process them, so without aging the low priority
+# tasks wait until the end of the simulation.
+#
+#   python3 scripts/benchmarks/priority_aging.py --aging "0:60"
+#   python3 scripts/benchmarks/priority_aging.py --aging ""
+#
+# Uses the database from the `DATABASE_URI` environment variable, only tasks of the `benchmark_priority_aging` flow
+# are created and removed by this script.
+
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from sqlalchemy import delete, select, update  # noqa
+
+from visionatrix import database, options  # noqa
+from visionatrix.pydantic_models import WorkerDetailsRequest  # noqa
+from visionatrix.tasks_engine import (  # noqa
+    age_queued_tasks_database,
+    get_incomplete_task_without_error_database,
+)
+
+FLOW_NAME = "benchmark_priority_aging"
+WORKER_DETAILS = WorkerDetailsRequest.model_validate(
+    {
+        "worker_version": "benchmark",
+        "system": {"hostname": "benchmark", "os": os.name, "version": sys.version, "embedded_python": False},
+        "devices": [{"name": "benchmark", "type": "cpu"}],
+    }
+)
+
+
+def cleanup() -> None:
+    with database.SESSION() as session:
+        tasks_ids = select(database.TaskDetails.task_id).filter(database.TaskDetails.name == FLOW_NAME)
+        session.execute(delete(database.TaskLock).where(database.TaskLock.task_id.in_(tasks_ids)))
+        session.execute(delete(database.TaskDetails).where(database.TaskDetails.name == FLOW_NAME))
+        session.execute(delete(database.Worker).where(database.Worker.worker_id.like("admin:benchmark:%")))
+        session.commit()
+
+
+def create_task(priority: int) -> int:
+    with database.SESSION() as session:
+        task_queue = database.TaskQueue()
+        session.add(task_queue)
+        session.flush()
+        session.add(
+            database.TaskDetails(
+                task_id=task_queue.id,
+                user_id="admin",
+                name=FLOW_NAME,
+                priority=priority,
+                progress=0.0,
+                error="",
+                input_params={},
+                outputs=[],
+                input_files=[],
+                flow_comfy={},
+                group_scope=1,
+                created_at=datetime.now(timezone.utc),
+            )
+        )
+        session.commit()
+        return task_queue.id
+
+
+def advance_time(seconds: float) -> None:
+    with database.SESSION() as session:
+        query = select(database.TaskDetails.task_id, database.TaskDetails.created_at).filter(
+            database.TaskDetails.name == FLOW_NAME, database.TaskDetails.state == "queued"
+        )
+        for task_id, created_at in session.execute(query).all():
+            session.execute(
+                update(database.TaskDetails)
+                .where(database.TaskDetails.task_id == task_id)
+                .values(created_at=created_at - timedelta(seconds=seconds))
+            )
+        session.commit()
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(steps: int, duration: float, high_every: int, low_every: int) -> dict[str, tuple[list[float], int]]:
+    cleanup()
+    queued_at: dict[int, tuple[str, float]] = {}
+    waits: dict[str, list[float]] = {"high": [], "low": []}
+    for step in range(steps):
+        now = step * duration
+        # `high_every` high priority tasks per `high_every - 1` dispatches: the queue never drains
+        if step % (high_every - 1) == 0:
+            for _ in range(high_every):
+                queued_at[create_task(10)] = ("high", now)
+        if step % low_every == 0:
+            queued_at[create_task(0)] = ("low", now)
+        task = get_incomplete_task_without_error_database("admin", WORKER_DETAILS, [FLOW_NAME], "")
+        kind, created = queued_at.pop(task["task_id"])
+        waits[kind].append(now - created)
+        advance_time(duration)
+        age_queued_tasks_database()  # the Server applies the aging every few seconds
+    cleanup()
+    unserved = {"high": 0, "low": 0}
+    for kind, _ in queued_at.values():
+        unserved[kind] += 1
+    return {k: (v, unserved[k]) for k, v in waits.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--aging", type=str, default="0:60", help="Value of TASKS_PRIORITY_AGING to test")
+    parser.add_argument("--steps", type=int, default=500, help="Number of dispatched tasks")
+    parser.add_argument("--duration", type=float, default=10.0, help="Simulated execution time of each task")
+    parser.add_argument("--high-every", type=int, default=10, help="High priority tasks arrive N per N-1 dispatches")
+    parser.add_argument("--low-every", type=int, default=10, help="Low priority task arrives every N dispatches")
+    args = parser.parse_args()
+
+    options.TASKS_PRIORITY_AGING = {
+        int(level): float(seconds) for level, seconds in (i.split(":") for i in args.aging.split(";") if i.strip())
+    }
+    database.init_database_engine()
+    results = run(args.steps, args.duration, args.high_every, args.low_every)
+    print(f"TASKS_PRIORITY_AGING={args.aging!r}, simulated seconds: {args.steps * args.duration:.0f}")
+    print(f"{'priority':>8} {'served':>7} {'unserved':>9} {'p50 wait':>9} {'p99 wait':>9} {'max wait':>9}")
+    for priority_kind, (priority_waits, unserved_count) in results.items():
+        if not priority_waits:
+            print(f"{priority_kind:>8} {0:>7} {unserved_count:>9} {'-':>9} {'-':>9} {'-':>9}")
+            continue
+        print(
+            f"{priority_kind:>8} {len(priority_waits):>7} {unserved_count:>9} {percentile(priority_waits, 0.5):>9.0f} "
+            f"{percentile(priority_waits, 0.99):>9.0f} {max(priority_waits):>9.0f}"
+        )
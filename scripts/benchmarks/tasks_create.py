@@ -0,0 +1,75 @@
+# Benchmark of the tasks creation.
+#
+# Creates tasks of the flow on the running Visionatrix instance with a single `/api/tasks/create` request (`count`),
+# with a single `/api/tasks/create-batch` request, and with concurrent `/api/tasks/create` requests of one task each.
+# Prints the time of the first two requests and the latency of the concurrent ones:
+#
+#   python3 scripts/benchmarks/tasks_create.py --flow sdxl_lighting --tasks 1000 --input-params '{"prompt": "cat"}'
+#
+# Created tasks are removed from the queue before any worker executes them, so stop the workers before the run.
+
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+
+def create_tasks(client: httpx.Client, flow: str, count: int, input_params: dict) -> float:
+    start_time = time.perf_counter()
+    r = client.put(
+        "/api/tasks/create",
+        data={"name": flow, "count": count, "input_params": json.dumps(input_params), "group_scope": 255},
+    )
+    r.raise_for_status()
+    return time.perf_counter() - start_time
+
+
+def create_tasks_batch(client: httpx.Client, flow: str, count: int, input_params: dict) -> float:
+    tasks = [{"name": flow, "input_params": input_params, "group_scope": 255} for _ in range(count)]
+    start_time = time.perf_counter()
+    r = client.put("/api/tasks/create-batch", json=tasks)
+    r.raise_for_status()
+    return time.perf_counter() - start_time
+
+
+def create_tasks_concurrently(
+    client: httpx.Client, flow: str, count: int, input_params: dict, concurrency: int
+) -> list[float]:
+    """Returns sorted latencies of the requests."""
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return sorted(executor.map(lambda _: create_tasks(client, flow, 1, input_params), range(count)))
+
+
+def cleanup(client: httpx.Client, flow: str) -> None:
+    client.delete("/api/tasks/clear", params={"name": flow, "group_scope": 255})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", type=str, default="http://127.0.0.1:8288", help="URL of the Visionatrix instance")
+    parser.add_argument("--auth", type=str, default="admin:admin", help="Credentials in the 'user:password' format")
+    parser.add_argument("--flow", type=str, required=True, help="Name of the installed flow to create tasks from")
+    parser.add_argument("--tasks", type=int, default=1000, help="Number of tasks to create")
+    parser.add_argument("--input-params", type=str, default="{}", help="Input parameters of the tasks as JSON")
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of concurrent single task requests")
+    args = parser.parse_args()
+
+    with httpx.Client(base_url=args.server, auth=tuple(args.auth.split(":", 1)), timeout=600.0) as http_client:
+        cleanup(http_client, args.flow)
+        create_time = create_tasks(http_client, args.flow, args.tasks, json.loads(args.input_params))
+        cleanup(http_client, args.flow)
+        create_batch_time = create_tasks_batch(http_client, args.flow, args.tasks, json.loads(args.input_params))
+        cleanup(http_client, args.flow)
+        latencies = create_tasks_concurrently(
+            http_client, args.flow, args.tasks, json.loads(args.input_params), args.concurrency
+        )
+        cleanup(http_client, args.flow)
+    print(f"flow: {args.flow}, tasks: {args.tasks}")
+    print(f"/create: {create_time:.3f} s, /create-batch: {create_batch_time:.3f} s")
+    print(
+        f"concurrent /create ({args.concurrency}): p50 {statistics.median(latencies):.3f} s,"
+        f" p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]:.3f} s"
+    )
@@ -0,0 +1,53 @@
+# Benchmark of the latency of the worker requests to the Server.
+#
+# Sends the same small requests that the worker sends on each progress update to the running Visionatrix Server,
+# first opening a new connection for each request (as `httpx.get` does), and then with one pooled client
+# (optionally over HTTP/2, requires `httpx[http2]`). Prints the latency of the requests:
+#
+#   python3 scripts/benchmarks/worker_requests.py --server https://vix.example.com --requests 200 --http2
+#
+# Requests go to `/api/settings/get`, so nothing is changed on the Server.
+
+import argparse
+import statistics
+import time
+
+import httpx
+
+
+def measure(send_request, count: int) -> list[float]:
+    """Returns sorted latencies of the requests."""
+    latencies = []
+    for _ in range(count):
+        start_time = time.perf_counter()
+        send_request().raise_for_status()
+        latencies.append(time.perf_counter() - start_time)
+    return sorted(latencies)
+
+
+def print_latencies(title: str, latencies: list[float]) -> None:
+    print(
+        f"{title}: p50 {statistics.median(latencies) * 1000:.1f} ms,"
+        f" p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", type=str, default="http://127.0.0.1:8288", help="URL of the Visionatrix Server")
+    parser.add_argument("--auth", type=str, default="admin:admin", help="Credentials in the 'user:password' format")
+    parser.add_argument("--requests", type=int, default=200, help="Number of requests of each kind")
+    parser.add_argument("--http2", action="store_true", help="Also measure the pooled client over HTTP/2")
+    args = parser.parse_args()
+
+    url = args.server.rstrip("/") + "/api/settings/get"
+    auth = tuple(args.auth.split(":", 1))
+    params = {"key": "huggingface_auth_token"}
+    print_latencies(
+        "new connection per request", measure(lambda: httpx.get(url, params=params, auth=auth), args.requests)
+    )
+    with httpx.Client(auth=auth) as client:
+        print_latencies("pooled client", measure(lambda: client.get(url, params=params), args.requests))
+    if args.http2:
+        with httpx.Client(auth=auth, http2=True) as client:
+            print_latencies("pooled client, HTTP/2", measure(lambda: client.get(url, params=params), args.requests))
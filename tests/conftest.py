@@ -0,0 +1,106 @@
+import os
+import tempfile
+import time
+
+import pytest
+
+TESTS_DIR = tempfile.mkdtemp(prefix="vix_tests_")
+os.environ.setdefault("TASKS_FILES_DIR", os.path.join(TESTS_DIR, "tasks_files"))
+os.environ.setdefault("FLOWS_DIR", os.path.join(TESTS_DIR, "flows"))
+for directory in ("input", "output"):
+    os.makedirs(os.path.join(os.environ["TASKS_FILES_DIR"], directory), exist_ok=True)
+os.makedirs(os.environ["FLOWS_DIR"], exist_ok=True)
+
+from visionatrix import (  # noqa: E402 pylint: disable=wrong-import-position
+    database,
+    flows,
+    options,
+    tasks_engine,
+    tasks_engine_etc,
+    workers_heartbeats,
+)
+from visionatrix.pydantic_models import (  # noqa: E402 pylint: disable=wrong-import-position
+    AIResourceModel,
+    Flow,
+    UserInfo,
+    WorkerDetailsRequest,
+)
+
+
+@pytest.fixture()
+def db(tmp_path, monkeypatch):
+    """Empty SQLite database with all migrations applied, used in the DEFAULT mode."""
+    monkeypatch.setattr(options, "DATABASE_URI", f"sqlite:///{tmp_path / 'tasks_history.db'}")
+    monkeypatch.setattr(options, "VIX_MODE", "DEFAULT")
+    monkeypatch.setattr(database, "SESSION", None)
+    monkeypatch.setattr(database, "SESSION_ASYNC", None)
+    # no flows are installed, and the list of the available flows should not be downloaded
+    monkeypatch.setitem(flows.CACHE_INSTALLED_FLOWS, "update_time", time.time() + 3600)
+    monkeypatch.setitem(flows.CACHE_INSTALLED_FLOWS, "flows", {})
+    monkeypatch.setitem(flows.CACHE_INSTALLED_FLOWS, "flows_comfy", {})
+    database.init_database_engine()
+    yield database
+    for worker_cache in (
+        workers_heartbeats.WORKERS_HEARTBEATS,
+        workers_heartbeats.WORKERS_TASKS_TO_GIVE,
+        workers_heartbeats.WORKERS_MEMORY,
+    ):
+        worker_cache.clear()
+    database.SESSION.kw["bind"].dispose()
+
+
+def add_task(name: str = "flow", user_id: str = "admin", priority: int = 0, group_scope: int = 1, **kwargs) -> int:
+    """Puts the new task in the queue and returns its ID."""
+    task_details = tasks_engine_etc.init_new_task_details(
+        tasks_engine.create_new_tasks(1)[0], name, kwargs.pop("input_params", {}), UserInfo(user_id=user_id)
+    )
+    task_details.update({"priority": priority, "group_scope": group_scope, **kwargs})
+    tasks_engine.put_tasks_in_queue([task_details])
+    return task_details["task_id"]
+
+
+def install_flow(name: str = "flow", models: tuple[str, ...] = (), **kwargs) -> Flow:
+    """Adds the flow to the installed flows of the test, `models` are the names of its models."""
+    flow = Flow(
+        name=name,
+        display_name=name,
+        author="tests",
+        models=[AIResourceModel(name=i, save_path=i, url=f"https://example.com/{i}", hash="") for i in models],
+        **{"input_params": [], **kwargs},
+    )
+    flows.CACHE_INSTALLED_FLOWS["flows"][name] = flow
+    return flow
+
+
+def worker_details(hostname: str = "worker") -> WorkerDetailsRequest:
+    return WorkerDetailsRequest.model_validate(
+        {
+            "worker_version": "1.0.0",
+            "pytorch_version": "2.4.1",
+            "system": {"hostname": hostname, "os": "posix", "version": "3.12", "embedded_python": False},
+            "ram_total": 32 * 1024**3,
+            "ram_free": 16 * 1024**3,
+            "devices": [
+                {
+                    "name": "gpu",
+                    "type": "cuda",
+                    "index": 0,
+                    "vram_total": 24 * 1024**3,
+                    "vram_free": 20 * 1024**3,
+                    "torch_vram_total": 24 * 1024**3,
+                    "torch_vram_free": 20 * 1024**3,
+                }
+            ],
+        }
+    )
+
+
+def claim_task(tasks: list[str] | None = None, hostname: str = "worker", user_id: str = "admin", **kwargs) -> dict:
+    return tasks_engine.get_incomplete_task_without_error_database(
+        user_id, worker_details(hostname), tasks or ["flow"], "", **kwargs
+    )
+
+
+def get_task_row(task_id: int) -> database.TaskDetails | None:
+    with database.SESSION() as session:
+        return session.get(database.TaskDetails, task_id)
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from visionatrix import prompt_validation
+from visionatrix.pydantic_models import Flow
+
+
+class CheckpointLoader:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"ckpt_name": (["model1.safetensors", "model2.safetensors"],)}}
+
+
+class TextEncode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"text": ("STRING", {"multiline": True}), "clip": ("CLIP",)}}
+
+
+class Sampler:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "model": ("MODEL",),
+                "seed": ("INT", {"min": 0, "max": 2**32}),
+                "cfg": ("FLOAT", {"min": 0.0, "max": 100.0}),
+                "positive": ("CONDITIONING",),
+            }
+        }
+
+
+class LoadImage:
+    VALIDATE_INPUTS = True
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"image": ("STRING",)}}
+
+
+def flow_comfy(text="cat", seed=1, cfg=7.0, ckpt_name="model1.safetensors", image="1_0_image.png") -> dict:
+    return {
+        "1": {"class_type": "CheckpointLoader", "inputs": {"ckpt_name": ckpt_name}},
+        "2": {"class_type": "TextEncode", "inputs": {"text": text, "clip": ["1", 1]}},
+        "3": {"class_type": "Sampler", "inputs": {"model": ["1", 0], "seed": seed, "cfg": cfg, "positive": ["2", 0]}},
+        "4": {"class_type": "LoadImage", "inputs": {"image": image}},
+    }
+
+
+@pytest.fixture()
+def validations(monkeypatch) -> list[dict]:
+    """ComfyUI nodes of the test prompts, returns the prompts passed to the ComfyUI validation."""
+    validated_prompts = []
+
+    def validate_prompt(prompt: dict) -> tuple[bool, dict, list, list]:
+        validated_prompts.append(prompt)
+        return prompt["1"]["inputs"]["ckpt_name"] != "missing.safetensors", {}, ["3"], []
+
+    node_classes = {i.__name__: i for i in (CheckpointLoader, TextEncode, Sampler, LoadImage)}
+    monkeypatch.setattr(prompt_validation, "get_node_class_mappings", lambda: node_classes)
+    monkeypatch.setattr(prompt_validation, "VALIDATE_PROMPT", validate_prompt)
+    monkeypatch.setattr(prompt_validation, "VALIDATION_PLANS_CACHE", {})
+    monkeypatch.setattr(prompt_validation, "VALIDATION_RESULTS_CACHE", {})
+    return validated_prompts
+
+
+def validate(prompt: dict, version: str = "1.0", input_files_names: list[str] | None = None) -> tuple:
+    flow = Flow(name="flow", display_name="flow", author="tests", models=[], input_params=[], version=version)
+    return asyncio.run(
+        prompt_validation.validate_prompt_async(flow, prompt, input_files_names or [prompt["4"]["inputs"]["image"]])
+    )
+
+
+def test_cache_hit_ignores_text_and_numbers(validations):
+    assert validate(flow_comfy())[0]
+    assert validate(flow_comfy(text="dog", seed=2, cfg=8.5)) == (True, None, ["3"], [])
+    assert len(validations) == 1
+
+
+def test_input_files_are_replaced_by_index(validations):
+    validate(flow_comfy(image="1_0_image.png"))
+    validate(flow_comfy(image="2_0_image.png"))
+    assert len(validations) == 1
+    validate(flow_comfy(image="other.png"), input_files_names=["1_0_image.png"])  # not an input file of the task
+    assert len(validations) == 2
+
+
+@pytest.mark.parametrize(
+    ("prompt", "version"),
+    [
+        (flow_comfy(ckpt_name="model2.safetensors"), "1.0"),  # combo values are checked by ComfyUI
+        (flow_comfy(seed=-1), "1.0"),  # out of the limits
+        (flow_comfy(cfg=101.0), "1.0"),
+        (flow_comfy(), "1.1"),
+        ({**flow_comfy(), "2": {"class_type": "TextEncode", "inputs": {"text": "cat", "clip": ["1", 2]}}}, "1.0"),
+    ],
+    ids=["combo", "min", "max", "flow_version", "link"],
+)
+def test_cache_key_invalidation(validations, prompt, version):
+    validate(flow_comfy())
+    validate(prompt, version)
+    assert len(validations) == 2
+
+
+def test_nodes_with_validate_inputs_keep_all_values(validations):
+    validate(flow_comfy(image="1.png"), input_files_names=["2.png"])
+    validate(flow_comfy(image="3.png"), input_files_names=["2.png"])
+    assert len(validations) == 2
+
+
+def test_invalid_prompts_are_not_cached(validations):
+    assert not validate(flow_comfy(ckpt_name="missing.safetensors"))[0]
+    assert not validate(flow_comfy(ckpt_name="missing.safetensors"))[0]
+    assert len(validations) == 2
+
+
+def test_cached_results_expire(validations, monkeypatch):
+    validate(flow_comfy())
+    monkeypatch.setattr(prompt_validation, "SECONDS_TO_CACHE_PROMPT_VALIDATION", -1)
+    validate(flow_comfy())
+    assert len(validations) == 2
@@ -0,0 +1,96 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from visionatrix import database, metrics, options, results_cache
+
+pytestmark = pytest.mark.usefixtures("cache")
+
+
+@pytest.fixture()
+def cache(db, monkeypatch):
+    monkeypatch.setattr(options, "TASKS_RESULTS_CACHE_SIZE", 1.0)
+    monkeypatch.setattr(metrics, "METRICS", {})
+    return db
+
+
+def finished_task(task_id: int, seed: int = 1, image: bytes = b"input", result: bytes = b"result") -> dict:
+    input_file = f"{task_id}_0_image.png"
+    with open(os.path.join(options.TASKS_FILES_DIR, "input", input_file), "wb") as f:
+        f.write(image)
+    with open(os.path.join(options.TASKS_FILES_DIR, "output", f"{task_id}_3_00001_.png"), "wb") as f:
+        f.write(result)
+    return {
+        "task_id": task_id,
+        "name": "flow",
+        "user_id": "admin",
+        "flow_comfy": {
+            "1": {"class_type": "LoadImage", "inputs": {"image": input_file}},
+            "2": {"class_type": "KSampler", "inputs": {"image": ["1", 0], "seed": seed}},
+            "3": {"class_type": "SaveImage", "inputs": {"images": ["2", 0], "filename_prefix": f"{task_id}_3"}},
+        },
+        "input_files": [{"file_name": input_file, "file_size": len(image)}],
+        "outputs": [{"comfy_node_id": 3, "type": "image", "file_size": len(result)}],
+    }
+
+
+def get_cache_entry(session, cache_key: str) -> database.TasksResultsCache:
+    return session.execute(
+        select(database.TasksResultsCache).filter(database.TasksResultsCache.cache_key == cache_key)
+    ).scalar_one()
+
+
+def get_last_used_at(cache_key: str) -> datetime:
+    with database.SESSION() as session:
+        return get_cache_entry(session, cache_key).last_used_at
+
+
+def test_results_cache_hit():
+    results_cache.add_task_results_to_cache(finished_task(1))
+    task = finished_task(2, result=b"")
+    assert results_cache.fill_task_from_results_cache(task)
+    assert task["progress"] == 100.0 and task["state"] == "finished"
+    with open(os.path.join(options.TASKS_FILES_DIR, "output", "2_3_00001_.png"), "rb") as f:
+        assert f.read() == b"result"
+    assert metrics.get_metrics()["results_cache_hits"] == 1
+
+
+@pytest.mark.parametrize("task_kwargs", [{"seed": 2}, {"image": b"other"}], ids=["seed", "input_file"])
+def test_results_cache_miss(task_kwargs):
+    results_cache.add_task_results_to_cache(finished_task(1))
+    task = finished_task(2, **task_kwargs)
+    assert not results_cache.fill_task_from_results_cache(task)
+    assert "progress" not in task
+    assert metrics.get_metrics()["results_cache_misses"] == 1
+
+
+def test_results_cache_disabled(monkeypatch):
+    results_cache.add_task_results_to_cache(finished_task(1))
+    monkeypatch.setattr(options, "TASKS_RESULTS_CACHE_SIZE", 0.0)
+    assert not results_cache.fill_task_from_results_cache(finished_task(2))
+
+
+def test_adding_cached_results_does_not_mark_them_used():
+    task = finished_task(1)
+    results_cache.add_task_results_to_cache(task)
+    cache_key = results_cache.get_results_cache_key(task)
+    used_at = datetime.utcnow() - timedelta(hours=1)
+    with database.SESSION() as session:
+        get_cache_entry(session, cache_key).last_used_at = used_at
+        session.commit()
+    results_cache.add_task_results_to_cache(finished_task(2))
+    assert get_last_used_at(cache_key).replace(tzinfo=None) == used_at
+    assert results_cache.fill_task_from_results_cache(finished_task(3))
+    assert get_last_used_at(cache_key).replace(tzinfo=None) > used_at
+
+
+def test_results_cache_eviction(monkeypatch):
+    monkeypatch.setattr(options, "TASKS_RESULTS_CACHE_SIZE", 10 / 1024**3)  # 10 bytes
+    first_task = finished_task(1, seed=1, result=b"123456")
+    results_cache.add_task_results_to_cache(first_task)
+    results_cache.add_task_results_to_cache(finished_task(2, seed=2, result=b"123456"))
+    assert not os.path.exists(results_cache.get_results_cache_dir(results_cache.get_results_cache_key(first_task)))
+    assert not results_cache.fill_task_from_results_cache(finished_task(3, seed=1))
+    assert results_cache.fill_task_from_results_cache(finished_task(4, seed=2))
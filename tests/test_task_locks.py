@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+
+import pytest
+from conftest import add_task, claim_task, get_task_row, worker_details
+from sqlalchemy import select, update
+
+from visionatrix import database, tasks_engine, tasks_worker
+
+pytestmark = pytest.mark.usefixtures("db")
+
+
+def expire_lock(task_id: int) -> None:
+    with database.SESSION() as session:
+        session.execute(
+            update(database.TaskLock)
+            .where(database.TaskLock.task_id == task_id)
+            .values(expires_at=datetime.utcnow() - timedelta(seconds=1))
+        )
+        session.commit()
+
+
+def get_lock(task_id: int) -> database.TaskLock | None:
+    with database.SESSION() as session:
+        return session.execute(select(database.TaskLock).filter(database.TaskLock.task_id == task_id)).scalar()
+
+
+def update_progress(task_id: int, progress: float, hostname: str = "worker", error: str = "") -> bool:
+    return tasks_engine.update_task_progress_database(task_id, progress, error, 1.0, "admin", worker_details(hostname))
+
+
+def test_claim_records_lock_owner():
+    task_id = add_task()
+    assert claim_task()["task_id"] == task_id
+    lock = get_lock(task_id)
+    assert lock.worker_id == "admin:worker:[gpu]:0"
+    assert lock.expires_at > datetime.utcnow()
+    assert get_task_row(task_id).state == "running"
+    assert claim_task(hostname="other") == {}
+
+
+def test_progress_extends_lease():
+    task_id = add_task()
+    claim_task()
+    expires_at = get_lock(task_id).expires_at
+    assert update_progress(task_id, 10.0)
+    assert get_lock(task_id).expires_at >= expires_at
+    assert tasks_engine.get_task(task_id)["progress"] == 10.0
+
+
+def test_expired_lease_is_reaped():
+    task_id = add_task()
+    claim_task()
+    tasks_engine.reap_expired_task_locks_database()
+    assert get_lock(task_id) is not None
+    expire_lock(task_id)
+    tasks_engine.reap_expired_task_locks_database()
+    assert get_lock(task_id) is None
+    assert get_task_row(task_id).state == "queued"
+    assert claim_task(hostname="other")["task_id"] == task_id
+
+
+def test_stale_worker_updates_are_rejected():
+    task_id = add_task()
+    claim_task(hostname="stale")
+    expire_lock(task_id)
+    tasks_engine.reap_expired_task_locks_database()
+    claim_task(hostname="new")
+    for progress, error in ((50.0, ""), (100.0, ""), (50.0, "Out of memory")):
+        assert not update_progress(task_id, progress, hostname="stale", error=error)
+    task = get_task_row(task_id)
+    assert (task.progress, task.error, task.state) == (0.0, "", "running")
+    assert get_lock(task_id).worker_id == "admin:new:[gpu]:0"
+    assert update_progress(task_id, 100.0, hostname="new")
+    assert get_task_row(task_id).state == "finished"
+
+
+def test_final_update_of_released_task_is_rejected():
+    task_id = add_task()
+    claim_task()
+    tasks_engine.remove_task_lock_database(task_id)
+    assert not update_progress(task_id, 0.0, error="Failed")
+    assert tasks_engine.get_task(task_id)["error"] == ""
+
+
+def test_prefetched_tasks_leases_are_extended_without_changes():
+    task_ids = [add_task(), add_task(), add_task()]
+    claim_task()
+    claim_task(hostname="other")
+    claim_task()
+    expire_lock(task_ids[0])
+    tasks_engine.remove_task_lock_database(task_ids[2])
+    task = get_task_row(task_ids[0])
+    assert tasks_engine.extend_tasks_locks_database(task_ids, "admin", worker_details()) == [task_ids[0]]
+    assert get_lock(task_ids[0]).expires_at > datetime.utcnow()
+    assert get_task_row(task_ids[0]).updated_at == task.updated_at  # the task itself is not changed
+
+
+def test_prefetched_tasks_without_locks_are_removed(monkeypatch):
+    task_ids = [add_task(), add_task()]
+    for _ in task_ids:
+        claim_task()
+    monkeypatch.setattr(tasks_worker, "PREFETCHED_TASKS", [{"task_id": i} for i in task_ids])
+    tasks_engine.remove_task_lock_database(task_ids[1])
+    monkeypatch.setattr(
+        tasks_worker,
+        "extend_tasks_locks",
+        lambda i: tasks_engine.extend_tasks_locks_database(i, "admin", worker_details()),
+    )
+    tasks_worker.extend_prefetched_tasks_locks()
+    assert [i["task_id"] for i in tasks_worker.PREFETCHED_TASKS] == [task_ids[0]]
+    assert get_lock(task_ids[0]) is not None
+    assert get_lock(task_ids[1]) is None
@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+
+import pytest
+from conftest import add_task, claim_task, worker_details
+from sqlalchemy import select, update
+
+from visionatrix import database, options, tasks_engine
+
+pytestmark = pytest.mark.usefixtures("db")
+
+
+def move_to_past(seconds: float) -> None:
+    """Makes all tasks and tombstones look as if they were changed `seconds` earlier."""
+    delta = timedelta(seconds=seconds)
+    with database.SESSION() as session:
+        for task in session.execute(select(database.TaskDetails)).scalars().all():
+            session.execute(  # explicit `updated_at`, as it is set to the current time on each update otherwise
+                update(database.TaskDetails)
+                .where(database.TaskDetails.task_id == task.task_id)
+                .values(
+                    created_at=task.created_at - delta,
+                    updated_at=task.updated_at - delta if task.updated_at else None,
+                )
+            )
+        for tombstone in session.execute(select(database.TaskTombstone)).scalars():
+            tombstone.deleted_at -= delta
+        session.commit()
+
+
+def get_tombstones() -> list[int]:
+    with database.SESSION() as session:
+        return list(session.execute(select(database.TaskTombstone.task_id).order_by("task_id")).scalars())
+
+
+def test_all_tasks_without_since():
+    task_ids = [add_task(), add_task()]
+    add_task(user_id="other")
+    tasks_engine.remove_task_by_id_database([add_task()])
+    changes = tasks_engine.get_tasks_changes("admin", None)
+    assert changes.reset
+    assert list(changes.tasks) == task_ids
+    assert not changes.removed_tasks
+
+
+def test_only_changed_tasks_after_since():
+    updated_task_id = add_task()
+    add_task()
+    move_to_past(3600)
+    since = datetime.utcnow()
+    claim_task()
+    tasks_engine.update_task_progress_database(updated_task_id, 50.0, "", 1.0, "admin", worker_details())
+    new_task_id = add_task()
+    changes = tasks_engine.get_tasks_changes("admin", since)
+    assert not changes.reset
+    assert list(changes.tasks) == [updated_task_id, new_task_id]
+    assert changes.tasks[updated_task_id].progress == 50.0
+    assert changes.cursor >= since
+    assert not tasks_engine.get_tasks_changes("admin", changes.cursor + timedelta(seconds=10)).tasks
+
+
+def test_removed_tasks_are_reported():
+    parent_task_id = add_task()
+    child_task_id = add_task(parent_task_id=parent_task_id)
+    other_flow_task_id = add_task(name="other_flow")
+    other_group_task_id = add_task(group_scope=2)
+    other_user_task_id = add_task(user_id="other")
+    kept_task_id = add_task()
+    since = datetime.utcnow()
+    assert tasks_engine.remove_task_by_id_database([parent_task_id])
+    assert tasks_engine.remove_unfinished_task_by_id(other_flow_task_id)
+    assert tasks_engine.remove_unfinished_tasks_by_name_and_group("flow", "admin", 2)
+    assert tasks_engine.remove_task_by_id_database([other_user_task_id])
+
+    changes = tasks_engine.get_tasks_changes("admin", since, "flow", 1)
+    assert changes.removed_tasks == [parent_task_id, child_task_id]
+    assert kept_task_id not in changes.removed_tasks
+    assert tasks_engine.get_tasks_changes("admin", since, None, 0).removed_tasks == [
+        parent_task_id,
+        child_task_id,
+        other_flow_task_id,
+        other_group_task_id,
+    ]
+    assert tasks_engine.get_tasks_changes("other", since).removed_tasks == [other_user_task_id]
+
+    move_to_past(3600)
+    assert not tasks_engine.get_tasks_changes("admin", datetime.utcnow(), None, 0).removed_tasks
+
+
+def test_finished_tasks_removal_is_reported():
+    task_id = add_task()
+    claim_task()
+    tasks_engine.update_task_progress_database(task_id, 100.0, "", 1.0, "admin", worker_details())
+    since = datetime.utcnow()
+    assert tasks_engine.remove_finished_tasks_by_name_and_group("flow", "admin", 1)
+    assert tasks_engine.get_tasks_changes("admin", since).removed_tasks == [task_id]
+
+
+def test_reset_when_since_is_too_old(monkeypatch):
+    monkeypatch.setattr(options, "TASKS_TOMBSTONES_MAX_AGE", 60.0)
+    task_id = add_task()
+    tasks_engine.remove_task_by_id_database([add_task()])
+    changes = tasks_engine.get_tasks_changes("admin", datetime.utcnow() - timedelta(seconds=120))
+    assert changes.reset
+    assert list(changes.tasks) == [task_id]
+    assert not changes.removed_tasks
+    assert not tasks_engine.get_tasks_changes("admin", datetime.utcnow() - timedelta(seconds=30)).reset
+
+
+def test_expired_tombstones_are_removed(monkeypatch):
+    monkeypatch.setattr(options, "TASKS_TOMBSTONES_MAX_AGE", 60.0)
+    expired_task_id = add_task()
+    task_id = add_task()
+    tasks_engine.remove_task_by_id_database([expired_task_id])
+    assert get_tombstones() == [expired_task_id]
+    move_to_past(120)
+    tasks_engine.remove_task_by_id_database([task_id])
+    assert get_tombstones() == [task_id]
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from conftest import add_task, claim_task, get_task_row, install_flow
+from sqlalchemy import select, update
+
+from visionatrix import database, db_queries, options, tasks_engine
+
+pytestmark = pytest.mark.usefixtures("db")
+
+
+def claim_all(tasks: list[str] | None = None, **kwargs) -> list[dict]:
+    r = []
+    while task := claim_task(tasks, **kwargs):
+        r.append(task)
+    return r
+
+
+def test_higher_priority_first_then_fifo():
+    low = [add_task(priority=1) for _ in range(2)]
+    high = add_task(priority=5)
+    assert [i["task_id"] for i in claim_all()] == [high, *low]
+
+
+def test_fair_share_between_users():
+    heavy = [add_task(user_id="heavy") for _ in range(6)]
+    small = [add_task(user_id="small") for _ in range(2)]
+    order = [i["task_id"] for i in claim_all()]
+    assert order[:4] == [heavy[0], small[0], heavy[1], small[1]]
+    assert order[4:] == heavy[2:]
+
+
+def test_fair_share_weights():
+    db_queries.set_global_setting("fair_share_weights", '{"heavy": 3}', False)
+    db_queries.FAIR_SHARE_WEIGHTS_CACHE["update_time"] = 0.0
+    try:
+        for _ in range(9):
+            add_task(user_id="heavy")
+        for _ in range(3):
+            add_task(user_id="small")
+        order = [i["user_id"] for i in claim_all()]
+        assert order[:8].count("small") == 2
+    finally:
+        db_queries.FAIR_SHARE_WEIGHTS_CACHE["update_time"] = 0.0
+
+
+def test_fair_share_key_includes_group_scope():
+    scope_one = [add_task(group_scope=1) for _ in range(3)]
+    scope_two = add_task(group_scope=2)
+    assert [i["task_id"] for i in claim_all()][:2] == [scope_one[0], scope_two]
+
+
+def test_fair_share_tags_are_kept_in_database():
+    add_task(user_id="heavy")
+    add_task(user_id="heavy")
+    claim_task()
+    with database.SESSION() as session:
+        tags = session.execute(select(database.FairShareTag)).scalars().all()
+    assert [(i.user_id, i.group_scope, i.finish_tag) for i in tags] == [("heavy", 1, 1.0)]
+    small = add_task(user_id="small")
+    assert claim_task()["task_id"] == small  # another Server instance sees the same tags
+
+
+def test_model_affinity():
+    install_flow("flow_a", models=("model_1", "model_2"))
+    install_flow("flow_b", models=("model_3",))
+    flow_a = add_task("flow_a")
+    flow_b = add_task("flow_b")
+    tasks = ["flow_a", "flow_b"]
+    assert claim_task(tasks, loaded_models=["model_3"])["task_id"] == flow_b
+    assert claim_task(tasks, loaded_models=["model_3"])["task_id"] == flow_a
+    high = add_task("flow_a", priority=5)
+    add_task("flow_b")
+    assert claim_task(tasks, loaded_models=["model_3"])["task_id"] == high  # priority goes before the affinity
+
+
+def wait_in_queue(seconds: float) -> None:
+    """Moves `created_at` of the queued tasks back, as if they waited in the queue for `seconds` more."""
+    with database.SESSION() as session:
+        query = select(database.TaskDetails.task_id, database.TaskDetails.created_at).filter(
+            database.TaskDetails.state == "queued"
+        )
+        for task_id, created_at in session.execute(query).all():
+            session.execute(
+                update(database.TaskDetails)
+                .where(database.TaskDetails.task_id == task_id)
+                .values(created_at=created_at - timedelta(seconds=seconds))
+            )
+        session.commit()
+
+
+def test_priority_aging(monkeypatch):
+    monkeypatch.setattr(options, "TASKS_PRIORITY_AGING", {0: 60, 14: 60})
+    low = add_task(priority=0, created_at=datetime.now(timezone.utc))
+    almost_max = add_task(priority=14, created_at=datetime.now(timezone.utc))
+    tasks_engine.age_queued_tasks_database()
+    assert (get_task_row(low).aged_priority, get_task_row(almost_max).aged_priority) == (0, 14)
+    wait_in_queue(150)
+    updated_at = get_task_row(low).updated_at
+    tasks_engine.age_queued_tasks_database()
+    assert (get_task_row(low).aged_priority, get_task_row(almost_max).aged_priority) == (2, 15)
+    assert (get_task_row(low).priority, get_task_row(low).updated_at) == (0, updated_at)
+    high = add_task(priority=2)
+    assert [claim_task()["task_id"] for _ in range(3)] == [almost_max, low, high]
+
+
+def test_priority_aging_wait_bound(monkeypatch):
+    """Under a constant overload of priority 10 tasks, priority 0 tasks wait at most about 10 aging intervals."""
+    aging_interval, duration = 60, 10
+    monkeypatch.setattr(options, "TASKS_PRIORITY_AGING", {0: aging_interval})
+    low_queued_at, low_waits = {}, []
+    for step in range(200):
+        now = step * duration
+        if step % 9 == 0:  # 10 high priority tasks per 9 dispatches: the queue never drains
+            for _ in range(10):
+                add_task(priority=10, created_at=datetime.now(timezone.utc))
+        if step % 10 == 0:
+            low_queued_at[add_task(priority=0, created_at=datetime.now(timezone.utc))] = now
+        task_id = claim_task()["task_id"]
+        if task_id in low_queued_at:
+            low_waits.append(now - low_queued_at.pop(task_id))
+        wait_in_queue(duration)
+        tasks_engine.age_queued_tasks_database()
+    max_wait = aging_interval * 10 + aging_interval
+    assert len(low_waits) >= 10
+    assert sorted(low_waits)[int(len(low_waits) * 0.99)] <= max_wait
+    assert all(200 * duration - i <= max_wait for i in low_queued_at.values())
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from conftest import add_task, worker_details
+
+from visionatrix import options, tasks_events
+from visionatrix.pydantic_models import UserInfo
+from visionatrix.routes.tasks_internal import get_next_task
+
+
+def worker_request(disconnected: bool = False):
+    async def is_disconnected() -> bool:
+        return disconnected
+
+    return SimpleNamespace(scope={"user_info": UserInfo(user_id="admin")}, is_disconnected=is_disconnected)
+
+
+async def get_next_task_after(seconds: float, wait_timeout: float, request=None):
+    """Asks for the next task, the result and the time the request took."""
+    start_time = time.monotonic()
+    r = await get_next_task(
+        request or worker_request(),
+        worker_details=worker_details(),
+        tasks_names=["flow"],
+        last_task_name="",
+        wait_timeout=wait_timeout,
+        loaded_models=[],
+    )
+    return r, time.monotonic() - start_time - seconds
+
+
+def test_wait_for_queued_tasks():
+    queued_version = tasks_events.get_queued_version()
+    assert not tasks_events.wait_for_queued_tasks(queued_version, 0.05)
+    threading.Timer(0.1, tasks_events.notify_tasks_queued).start()
+    assert tasks_events.wait_for_queued_tasks(queued_version, 5.0)
+    # notification between taking the version and waiting is not missed
+    assert tasks_events.wait_for_queued_tasks(queued_version, 0.0)
+
+
+def test_wait_for_queued_tasks_async():
+    async def main():
+        queued_version = tasks_events.get_queued_version()
+        assert not await tasks_events.wait_for_queued_tasks_async(queued_version, 0.05)
+        threading.Timer(0.1, tasks_events.notify_tasks_queued).start()  # from another thread
+        assert await tasks_events.wait_for_queued_tasks_async(queued_version, 5.0)
+        assert await tasks_events.wait_for_queued_tasks_async(queued_version, 0.0)
+        assert not tasks_events.QUEUED_ASYNC_WAITERS
+
+    asyncio.run(main())
+
+
+@pytest.mark.usefixtures("db")
+def test_parked_request_is_woken_up_by_new_task(monkeypatch):
+    monkeypatch.setattr(options, "TASKS_NEXT_RECHECK_INTERVAL", 30.0)  # only the notification can wake it up
+
+    async def main():
+        waiting = asyncio.create_task(get_next_task_after(0.3, 10.0))
+        await asyncio.sleep(0.3)
+        task_id = await asyncio.to_thread(add_task)
+        r, delay = await waiting
+        assert r["task_id"] == task_id
+        assert delay < 1.0
+
+    asyncio.run(main())
+
+
+@pytest.mark.usefixtures("db")
+def test_parked_request_times_out(monkeypatch):
+    monkeypatch.setattr(options, "TASKS_NEXT_RECHECK_INTERVAL", 0.1)
+
+    async def main():
+        r, delay = await get_next_task_after(0.3, 0.3)
+        assert r.status_code == 204
+        assert -0.1 < delay < 1.0
+        r, delay = await get_next_task_after(0.0, 10.0, worker_request(disconnected=True))
+        assert r.status_code == 204
+        assert delay < 1.0
+
+    asyncio.run(main())
+
+
+@pytest.mark.usefixtures("db")
+def test_task_is_returned_without_waiting():
+    async def main():
+        task_id = add_task()
+        r, delay = await get_next_task_after(0.0, 10.0)
+        assert r["task_id"] == task_id
+        assert delay < 1.0
+
+    asyncio.run(main())
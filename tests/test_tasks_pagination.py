@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+import pytest
+from conftest import add_task
+from sqlalchemy import text, update
+
+from visionatrix import database, tasks_engine, tasks_engine_etc
+
+pytestmark = pytest.mark.usefixtures("db")
+
+
+def set_task_values(task_ids: list[int], **values) -> None:
+    with database.SESSION() as session:
+        session.execute(update(database.TaskDetails).where(database.TaskDetails.task_id.in_(task_ids)).values(**values))
+        session.commit()
+
+
+def get_pages(get_tasks, page_size: int, order_by: str = "task_id") -> list[list[int]]:
+    pages, cursor = [], None
+    while tasks := get_tasks(user_id="admin", cursor=cursor, limit=page_size, order_by=order_by):
+        pages.append(list(tasks))
+        last_task = tasks[pages[-1][-1]]
+        if order_by.lstrip("-") == "updated_at":
+            cursor = (last_task.updated_at or last_task.created_at, last_task.task_id)
+        else:
+            cursor = (last_task.task_id,)
+    return pages
+
+
+def test_pages_by_task_id():
+    task_ids = [add_task() for _ in range(7)]
+    add_task(user_id="other")
+    assert get_pages(tasks_engine.get_tasks, 3) == [task_ids[:3], task_ids[3:6], task_ids[6:]]
+    assert get_pages(tasks_engine.get_tasks_short, 4, "-task_id") == [task_ids[:2:-1], task_ids[2::-1]]
+
+
+def test_pages_by_updated_at():
+    task_ids = [add_task() for _ in range(6)]
+    now = datetime.utcnow()
+    set_task_values(task_ids, created_at=now - timedelta(minutes=10))
+    set_task_values(task_ids[:2], updated_at=now - timedelta(minutes=1))  # same time, ordered by ID
+    set_task_values(task_ids[2:3], updated_at=now - timedelta(minutes=5))
+    set_task_values(task_ids[3:4], updated_at=None)  # never updated, its creation time is used
+    expected = [task_ids[3], task_ids[2], task_ids[0], task_ids[1]]
+    set_task_values(task_ids[4:], updated_at=now)
+    expected += task_ids[4:]
+    for page_size in (1, 2, 4):
+        pages = get_pages(tasks_engine.get_tasks, page_size, "updated_at")
+        assert [i for page in pages for i in page] == expected
+        pages = get_pages(tasks_engine.get_tasks_short, page_size, "-updated_at")
+        assert [i for page in pages for i in page] == expected[::-1]
+
+
+def test_filters():
+    task_ids = [add_task(name="flow1") for _ in range(3)] + [add_task(name="flow2") for _ in range(3)]
+    child_task_id = add_task(name="flow2")
+    other_group_task_id = add_task(group_scope=2)
+    set_task_values(task_ids[:2] + task_ids[3:4], progress=100.0, state="finished")
+    set_task_values([child_task_id], parent_task_id=task_ids[0])
+    assert list(tasks_engine.get_tasks(user_id="admin", name="flow2", finished=True)) == task_ids[3:4]
+    assert list(tasks_engine.get_tasks(user_id="admin", finished=False, only_parent=True)) == [
+        task_ids[2],
+        *task_ids[4:],
+    ]
+    assert list(tasks_engine.get_tasks_short("admin", state="finished", order_by="-task_id")) == [
+        task_ids[3],
+        task_ids[1],
+        task_ids[0],
+    ]
+    assert list(tasks_engine.get_tasks(user_id="admin", group_scope=2)) == [other_group_task_id]
+    tasks = tasks_engine.get_tasks(user_id="admin", limit=1, fetch_child=True, only_parent=True)
+    assert list(tasks) == task_ids[:1]
+    assert [i.task_id for i in tasks[task_ids[0]].child_tasks] == [child_task_id]
+
+
+def test_pages_by_updated_at_use_index():
+    query = tasks_engine_etc.get_tasks_query(
+        None, 1, None, "admin", cursor=(datetime.utcnow(), 1), limit=10, order_by="updated_at"
+    )
+    with database.SESSION() as session:
+        compiled = query.compile(session.bind, compile_kwargs={"literal_binds": True})
+        plan = session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+    assert any("ix_tasks_details_user_group_changed" in i[-1] for i in plan), plan
+    assert not any("TEMP B-TREE FOR ORDER BY" in i[-1] for i in plan), plan
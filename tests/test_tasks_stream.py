@@ -0,0 +1,76 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+from conftest import add_task, claim_task, worker_details
+
+from visionatrix import tasks_engine
+from visionatrix.routes import tasks_stream
+
+pytestmark = pytest.mark.usefixtures("db")
+
+progress_stream = getattr(tasks_stream, "__progress_stream")
+
+
+def parse_event(message: str) -> tuple[str, dict]:
+    fields = dict(line.split(": ", 1) for line in message.strip().splitlines())
+    return fields["event"], json.loads(fields["data"])
+
+
+async def next_event(stream, timeout: float = 5.0) -> tuple[str, dict]:
+    while True:
+        message = await asyncio.wait_for(anext(stream), timeout)
+        if not message.startswith(":"):  # keep-alive comments
+            return parse_event(message)
+
+
+def update_progress(task_id: int, progress: float) -> bool:
+    return tasks_engine.update_task_progress_database(task_id, progress, "", 1.0, "admin", worker_details())
+
+
+def test_progress_events_are_streamed():
+    async def main():
+        task_id = add_task()
+        other_user_task_id = add_task(user_id="other")
+        claim_task()
+        claim_task(user_id="other")
+        stream = progress_stream("admin", None, 1, None, None)
+        first_event = asyncio.create_task(next_event(stream))
+        await asyncio.sleep(0.1)  # the stream subscribes to the events on the first read
+        await asyncio.to_thread(update_progress, other_user_task_id, 50.0)
+        await asyncio.to_thread(update_progress, task_id, 50.0)
+        assert await first_event == (
+            "progress",
+            {
+                "task_id": task_id,
+                "parent_task_id": None,
+                "progress": 50.0,
+                "error": "",
+                "execution_time": 1.0,
+                "state": "running",
+            },
+        )
+        await asyncio.to_thread(update_progress, task_id, 100.0)
+        event, data = await next_event(stream)
+        assert (event, data["progress"], data["state"]) == ("progress", 100.0, "finished")
+        await stream.aclose()
+
+    asyncio.run(main())
+
+
+def test_changes_since_are_sent_first():
+    async def main():
+        since = datetime.utcnow()
+        finished = add_task()
+        removed = add_task()
+        claim_task()
+        update_progress(finished, 100.0)
+        tasks_engine.remove_task_by_id_database([removed])
+        stream = progress_stream("admin", None, 1, None, since)
+        events = [await next_event(stream), await next_event(stream)]
+        await stream.aclose()
+        assert ("progress", finished, "finished") in [(e, d["task_id"], d.get("state")) for e, d in events]
+        assert ("removed", {"task_id": removed}) in events
+
+    asyncio.run(main())
@@ -0,0 +1,159 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from sqlalchemy import select
+
+from visionatrix import database, db_queries, metrics, webhooks
+
+retry_delivery = getattr(webhooks, "__retry_delivery")
+
+
+class SentPayloads(list):
+    statuses: list[int]
+
+    def __init__(self):
+        super().__init__()
+        self.statuses = []
+
+    def connect(self) -> None:
+        """Adds the client of the webhook, the dispatcher closes all clients when it exits."""
+        transport = httpx.MockTransport(self.__handler)
+        webhooks.WEBHOOK_CLIENTS["http://hook"] = httpx.AsyncClient(transport=transport)
+
+    def __handler(self, request: httpx.Request) -> httpx.Response:
+        assert request.url == "http://hook/task-progress"
+        self.append(httpx.Response(200, content=request.content).json())
+        return httpx.Response(self.statuses.pop(0) if self.statuses else 200)
+
+
+@pytest.fixture()
+def sent(monkeypatch) -> SentPayloads:
+    """Payloads received by the "http://hook" webhook, it answers with the statuses from the `sent.statuses`."""
+    monkeypatch.setattr(webhooks, "WEBHOOKS_PENDING", {})
+    monkeypatch.setattr(webhooks, "WEBHOOKS_IN_FLIGHT", set())
+    monkeypatch.setattr(webhooks, "WEBHOOK_CLIENTS", {})
+    monkeypatch.setattr(webhooks, "WEBHOOKS_RETRY_CHECK_INTERVAL", 0.05)
+    monkeypatch.setattr(metrics, "METRICS", {})
+    payloads = SentPayloads()
+    payloads.connect()
+    return payloads
+
+
+def enqueue(task_id: int, progress: float, error: str = "") -> None:
+    webhooks.enqueue_task_webhook("http://hook", None, task_id, progress, 1.0, error)
+
+
+def run_dispatcher(until, timeout: float = 5.0) -> None:
+    """Runs the `webhooks_dispatcher` until the `until()` is true."""
+
+    async def wait_until():
+        while not until():
+            await asyncio.sleep(0.01)
+
+    async def main():
+        exit_event = threading.Event()
+        dispatcher = asyncio.create_task(webhooks.webhooks_dispatcher(exit_event))
+        try:
+            await asyncio.wait_for(wait_until(), timeout)
+        finally:
+            exit_event.set()
+            await asyncio.wait_for(dispatcher, timeout)
+
+    asyncio.run(main())
+
+
+def get_deliveries() -> list[database.WebhookDelivery]:
+    with database.SESSION() as session:
+        return list(session.execute(select(database.WebhookDelivery)).scalars())
+
+
+@pytest.mark.usefixtures("sent")
+def test_only_latest_update_of_task_is_queued():
+    for progress in (10.0, 20.0, 30.0):
+        enqueue(1, progress)
+    enqueue(2, 10.0)
+    assert {k: v[2]["progress"] for k, v in webhooks.WEBHOOKS_PENDING.items()} == {1: 30.0, 2: 10.0}
+    assert metrics.get_metrics()["webhooks_coalesced"] == 2
+
+
+@pytest.mark.usefixtures("sent")
+def test_final_updates_are_queued_when_queue_is_full(monkeypatch):
+    monkeypatch.setattr(webhooks, "WEBHOOKS_QUEUE_SIZE", 1)
+    enqueue(1, 10.0)
+    enqueue(2, 10.0)
+    enqueue(3, 100.0)
+    enqueue(4, 20.0, "error")
+    enqueue(1, 20.0)
+    assert {k: v[2]["progress"] for k, v in webhooks.WEBHOOKS_PENDING.items()} == {1: 20.0, 3: 100.0, 4: 20.0}
+    assert metrics.get_metrics()["webhooks_dropped"] == 1
+
+
+@pytest.mark.usefixtures("db")
+def test_dispatcher_sends_latest_updates(sent):
+    enqueue(1, 10.0)
+    enqueue(1, 50.0)
+    enqueue(2, 100.0)
+    run_dispatcher(lambda: len(sent) == 2)
+    assert sorted((i["task_id"], i["progress"]) for i in sent) == [(1, 50.0), (2, 100.0)]
+    assert not webhooks.WEBHOOKS_PENDING
+    assert not webhooks.WEBHOOKS_IN_FLIGHT
+    assert not webhooks.WEBHOOK_CLIENTS  # closed when the dispatcher exits
+    assert metrics.get_metrics()["webhooks_delivered"] == 2
+
+
+@pytest.mark.usefixtures("db")
+def test_failed_final_update_is_retried(sent, monkeypatch):
+    monkeypatch.setattr(webhooks, "WEBHOOK_RETRY_BACKOFF", 0.0)
+    sent.statuses = [503, 500, 429]
+    enqueue(1, 50.0)
+    run_dispatcher(lambda: len(sent) == 1 and not webhooks.WEBHOOKS_IN_FLIGHT)
+    assert not get_deliveries()  # not final updates are not retried
+
+    sent.connect()
+    enqueue(1, 100.0)
+    run_dispatcher(lambda: len(sent) == 4 and not get_deliveries())
+    assert [i["progress"] for i in sent] == [50.0, 100.0, 100.0, 100.0]
+    assert metrics.get_metrics()["webhooks_retries"] == 2
+    assert metrics.get_metrics()["webhooks_failed"] == 3
+
+
+@pytest.mark.usefixtures("db")
+def test_retry_backoff(sent, monkeypatch):
+    monkeypatch.setattr(webhooks, "WEBHOOK_MAX_ATTEMPTS", 5)
+    db_queries.add_webhook_delivery(1, "http://hook", None, {"task_id": 1, "progress": 100.0}, datetime.utcnow())
+    delivery = db_queries.claim_webhook_deliveries(10, 30.0)[0]
+    assert not db_queries.claim_webhook_deliveries(10, 30.0)  # already claimed
+
+    sent.statuses = [503, 503, 503]
+    for attempts, backoff in ((1, 10.0), (3, 40.0)):
+        asyncio.run(retry_delivery({**delivery, "attempts": attempts}))
+        saved_delivery = get_deliveries()[0]
+        assert saved_delivery.attempts == attempts + 1
+        expected_attempt_at = datetime.utcnow() + timedelta(seconds=backoff)
+        assert abs(saved_delivery.next_attempt_at - expected_attempt_at) < timedelta(seconds=1)
+
+    asyncio.run(retry_delivery({**delivery, "attempts": 4}))  # the last attempt
+    assert not get_deliveries()
+    assert metrics.get_metrics()["webhooks_abandoned"] == 1
+
+
+@pytest.mark.usefixtures("db")
+def test_retry_backoff_is_limited(sent, monkeypatch):
+    monkeypatch.setattr(webhooks, "WEBHOOK_MAX_ATTEMPTS", 100)
+    db_queries.add_webhook_delivery(1, "http://hook", None, {"task_id": 1, "progress": 100.0}, datetime.utcnow())
+    delivery = db_queries.claim_webhook_deliveries(10, 30.0)[0]
+    sent.statuses = [503]
+    asyncio.run(retry_delivery({**delivery, "attempts": 20}))
+    expected_attempt_at = datetime.utcnow() + timedelta(seconds=webhooks.WEBHOOK_RETRY_MAX_BACKOFF)
+    assert abs(get_deliveries()[0].next_attempt_at - expected_attempt_at) < timedelta(seconds=1)
+
+
+@pytest.mark.usefixtures("db")
+def test_delivered_retry_is_removed(sent):
+    db_queries.add_webhook_delivery(1, "http://hook", None, {"task_id": 1, "progress": 100.0}, datetime.utcnow())
+    asyncio.run(retry_delivery(db_queries.claim_webhook_deliveries(10, 30.0)[0]))
+    assert sent == [{"task_id": 1, "progress": 100.0}]
+    assert not get_deliveries()
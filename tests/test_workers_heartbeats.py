@@ -0,0 +1,81 @@
+import pytest
+from conftest import add_task, claim_task, worker_details
+from sqlalchemy import select, update
+
+from visionatrix import database, db_queries, options, tasks_engine, workers_heartbeats
+
+WORKER_ID = "admin:worker:[gpu]:0"
+
+
+def get_worker_row() -> database.Worker | None:
+    with database.SESSION() as session:
+        return session.execute(select(database.Worker).filter(database.Worker.worker_id == WORKER_ID)).scalar()
+
+
+def claim_with_ram_free(ram_free: int, tasks: list[str] | None = None) -> dict:
+    return tasks_engine.get_incomplete_task_without_error_database(
+        "admin", worker_details().model_copy(update={"ram_free": ram_free}), tasks or ["flow"], ""
+    )
+
+
+@pytest.mark.usefixtures("db")
+def test_worker_is_registered_on_first_request():
+    assert get_worker_row() is None
+    claim_task()
+    worker = get_worker_row()
+    assert (worker.device_name, worker.vram_total, worker.tasks_to_give) == ("gpu", 24 * 1024**3, [])
+    assert WORKER_ID not in workers_heartbeats.WORKERS_HEARTBEATS  # written with the registration
+
+
+@pytest.mark.usefixtures("db")
+def test_heartbeats_are_flushed_periodically():
+    claim_with_ram_free(1000)
+    claim_with_ram_free(2000)
+    task_id = add_task()
+    claim_with_ram_free(3000)
+    tasks_engine.update_task_progress_database(
+        task_id, 50.0, "", 1.0, "admin", worker_details().model_copy(update={"ram_free": 4000})
+    )
+    assert get_worker_row().ram_free == 1000  # requests within the interval do not write the worker row
+    assert workers_heartbeats.WORKERS_HEARTBEATS[WORKER_ID]["ram_free"] == 4000
+    db_queries.flush_workers_heartbeats()
+    assert get_worker_row().ram_free == 4000
+    assert not workers_heartbeats.WORKERS_HEARTBEATS
+
+
+def test_failed_flush_keeps_newer_heartbeats():
+    workers_heartbeats.record_worker_heartbeat("worker1", {"ram_free": 1})
+    workers_heartbeats.record_worker_heartbeat("worker2", {"ram_free": 1})
+    heartbeats = workers_heartbeats.pop_workers_heartbeats()
+    workers_heartbeats.record_worker_heartbeat("worker2", {"ram_free": 2})
+    workers_heartbeats.restore_workers_heartbeats(heartbeats)
+    assert workers_heartbeats.pop_workers_heartbeats() == {"worker1": {"ram_free": 1}, "worker2": {"ram_free": 2}}
+
+
+@pytest.mark.usefixtures("db")
+def test_tasks_to_give_cache(monkeypatch):
+    claim_task()
+    add_task(name="flow1")
+    with database.SESSION() as session:  # changed outside of this process
+        session.execute(
+            update(database.Worker).where(database.Worker.worker_id == WORKER_ID).values(tasks_to_give=["flow2"])
+        )
+        session.commit()
+    assert claim_task(["flow1", "flow2"])  # cached value is used until the interval passes
+    add_task(name="flow1")
+    monkeypatch.setattr(options, "WORKERS_HEARTBEAT_INTERVAL", 0.0)
+    assert not claim_task(["flow1", "flow2"])
+    assert db_queries.set_worker_tasks_to_give(None, WORKER_ID, [])
+    monkeypatch.setattr(options, "WORKERS_HEARTBEAT_INTERVAL", 30.0)
+    assert claim_task(["flow1", "flow2"])  # changed through the API: the cache is updated immediately
+
+
+@pytest.mark.parametrize("seen_seconds_ago", [1.0, workers_heartbeats.WORKERS_MEMORY_TTL + 1.0])
+def test_max_workers_memory(monkeypatch, seen_seconds_ago):
+    now = workers_heartbeats.time.monotonic()
+    workers_heartbeats.set_worker_memory("worker1", 8 * 1024**3)
+    monkeypatch.setattr(workers_heartbeats.time, "monotonic", lambda: now + seen_seconds_ago)
+    workers_heartbeats.set_worker_memory("worker2", 4 * 1024**3)
+    expected = 8 * 1024**3 if seen_seconds_ago < workers_heartbeats.WORKERS_MEMORY_TTL else 4 * 1024**3
+    assert workers_heartbeats.get_max_workers_memory() == expected
+    workers_heartbeats.WORKERS_MEMORY.clear()
@@ -1,3 +1,4 @@
+import asyncio
 import fnmatch
 import logging
 import os
@@ -13,15 +14,17 @@ from pillow_heif import register_heif_opener
 from starlette.requests import HTTPConnection
 from starlette.types import ASGIApp, Receive, Scope, Send
 
-from . import comfyui, database, options
-from .routes import flows, other, settings, tasks, workers
-from .tasks_engine import (
+from . import comfyui, database, options, prompt_validation
+from .routes import flows, other, settings, tasks, tasks_internal, tasks_stream, workers
+from .tasks_engine_async import start_tasks_engine
+from .tasks_events import notify_tasks_queued
+from .tasks_worker import (
     background_prompt_executor,
     remove_active_task_lock,
     task_progress_callback,
 )
-from .tasks_engine_async import start_tasks_engine
 from .user_backends import perform_auth
+from .webhooks import webhooks_dispatcher
 
 LOGGER = logging.getLogger("visionatrix")
 EXIT_EVENT = threading.Event()
@@ -73,12 +76,13 @@ class VixAuthMiddleware:
 async def lifespan(app: FastAPI):
     register_heif_opener()
     logging.getLogger("uvicorn.access").setLevel(logging.getLogger().getEffectiveLevel())
-    tasks.VALIDATE_PROMPT, comfy_queue = comfyui.load(task_progress_callback)
+    prompt_validation.VALIDATE_PROMPT, comfy_queue = comfyui.load(task_progress_callback)
     await start_tasks_engine(comfy_queue, EXIT_EVENT)
     if options.UI_DIR:
         app.mount("/", StaticFiles(directory=options.UI_DIR, html=True), name="client")
     yield
     EXIT_EVENT.set()
+    notify_tasks_queued()  # wake up the local worker, if it is waiting for a new task
     comfyui.interrupt_processing()
 
 
@@ -95,6 +99,8 @@ API_ROUTER = APIRouter(prefix="/api")
 API_ROUTER.include_router(flows.ROUTER)
 API_ROUTER.include_router(settings.ROUTER)
 API_ROUTER.include_router(tasks.ROUTER)
+API_ROUTER.include_router(tasks_internal.ROUTER)
+API_ROUTER.include_router(tasks_stream.ROUTER)
 API_ROUTER.include_router(workers.ROUTER)
 API_ROUTER.include_router(other.ROUTER)
 APP.include_router(API_ROUTER)
@@ -137,6 +143,8 @@ def run_vix(*args, **kwargs) -> None:
     else:
         register_heif_opener()
         _, comfy_queue = comfyui.load(task_progress_callback)
+        if not options.VIX_SERVER:  # tasks are updated directly in the Database, webhooks are sent by us
+            threading.Thread(target=asyncio.run, args=(webhooks_dispatcher(EXIT_EVENT),), daemon=True).start()
 
         try:
             background_prompt_executor(comfy_queue, EXIT_EVENT)
@@ -12,6 +12,9 @@ import logging
 import os
 import re
 import sys
+import threading
+import time
+import types
 import typing
 from importlib.metadata import PackageNotFoundError, version
 from pathlib import Path
@@ -21,6 +24,7 @@ import torch
 from psutil import virtual_memory
 
 from . import _version, options
+from .pydantic_models import WorkerDetailsRequest
 
 LOGGER = logging.getLogger("visionatrix")
 
@@ -31,6 +35,14 @@ SYSTEM_DETAILS = {
     "embedded_python": options.PYTHON_EMBEDED,
 }
 
+WORKER_DETAILS_SAMPLE_INTERVAL = 1.0
+"""Interval (in seconds) at which the memory usage in the worker details is updated."""
+WORKER_DETAILS_LOCK = threading.Lock()
+WORKER_DETAILS: types.MappingProxyType | None = None
+WORKER_DETAILS_REQUEST: tuple[types.MappingProxyType, WorkerDetailsRequest] | None = None
+WORKER_STATIC_DETAILS: dict | None = None
+WORKER_DETAILS_SAMPLER: threading.Thread | None = None
+
 if torch.version.cuda is not None:
     TORCH_VERSION = f"{torch.__version__} (CUDA {torch.version.cuda})"
 elif torch.version.hip is not None:
@@ -202,34 +214,87 @@ def soft_empty_cache(force: bool = False) -> None:
     comfy.model_management.soft_empty_cache(force)
 
 
-def torch_device_info() -> dict:
-    """1:1 copy of code from ComfyUI server.py file."""
+def get_worker_details() -> types.MappingProxyType:
+    """Returns the latest snapshot of the worker details, refreshed in the background every
+    WORKER_DETAILS_SAMPLE_INTERVAL seconds. The snapshot is shared, so it is read-only: use
+    `get_worker_details_request().model_dump()` to get the details as a dictionary."""
+    global WORKER_DETAILS_SAMPLER
+    if WORKER_DETAILS is None:
+        with WORKER_DETAILS_LOCK:
+            if WORKER_DETAILS is None:
+                __sample_worker_details()
+            if WORKER_DETAILS_SAMPLER is None:
+                WORKER_DETAILS_SAMPLER = threading.Thread(target=__worker_details_sampler, daemon=True)
+                WORKER_DETAILS_SAMPLER.start()
+    return WORKER_DETAILS
+
+
+def get_worker_details_request() -> WorkerDetailsRequest:
+    """Returns the snapshot of the worker details as the request model, validated once per snapshot."""
+    global WORKER_DETAILS_REQUEST
+    worker_details = get_worker_details()
+    cached = WORKER_DETAILS_REQUEST
+    if cached is None or cached[0] is not worker_details:
+        cached = (worker_details, WorkerDetailsRequest.model_validate(worker_details))
+        WORKER_DETAILS_REQUEST = cached
+    return cached[1]
+
+
+def __worker_details_sampler() -> None:
+    while True:
+        time.sleep(WORKER_DETAILS_SAMPLE_INTERVAL)
+        try:
+            __sample_worker_details()
+        except Exception:
+            LOGGER.exception("Failed to update the worker details.")
+
+
+def __sample_worker_details() -> None:
+    """Queries only the memory usage (free memory and memory reserved by torch), the other details do not change
+    while the worker is running."""
+    global WORKER_DETAILS, WORKER_STATIC_DETAILS
     import comfy  # noqa
 
-    device = comfy.model_management.get_torch_device()
-    device_name = comfy.model_management.get_torch_device_name(device)
-    vram_total, torch_vram_total = comfy.model_management.get_total_memory(device, torch_total_too=True)
+    if WORKER_STATIC_DETAILS is None:
+        device = comfy.model_management.get_torch_device()
+        WORKER_STATIC_DETAILS = {
+            "worker_version": _version.__version__,
+            "pytorch_version": TORCH_VERSION,
+            "system": SYSTEM_DETAILS,
+            "ram_total": virtual_memory().total,
+            "device": device,
+            "device_name": comfy.model_management.get_torch_device_name(device),
+            "vram_total": comfy.model_management.get_total_memory(device),
+        }
+    device = WORKER_STATIC_DETAILS["device"]
+    if device.type == "cuda":
+        # the same value as `get_total_memory(torch_total_too=True)` returns, without asking the driver for the total
+        torch_vram_total = torch.cuda.memory_reserved(device)
+    else:
+        _, torch_vram_total = comfy.model_management.get_total_memory(device, torch_total_too=True)
     vram_free, torch_vram_free = comfy.model_management.get_free_memory(device, torch_free_too=True)
-    return {
-        "name": device_name,
-        "type": device.type,
-        "index": 0 if device.index is None else device.index,
-        "vram_total": vram_total,
-        "vram_free": vram_free,
-        "torch_vram_total": torch_vram_total,
-        "torch_vram_free": torch_vram_free,
-    }
-
-
-def get_worker_details() -> dict:
-    return {
-        "worker_version": _version.__version__,
-        "pytorch_version": TORCH_VERSION,
-        "system": SYSTEM_DETAILS,
-        "ram_total": virtual_memory().total,
-        "ram_free": virtual_memory().available,
-        "devices": [torch_device_info()],
-    }
+    WORKER_DETAILS = types.MappingProxyType(
+        {
+            "worker_version": WORKER_STATIC_DETAILS["worker_version"],
+            "pytorch_version": WORKER_STATIC_DETAILS["pytorch_version"],
+            "system": types.MappingProxyType(WORKER_STATIC_DETAILS["system"]),
+            "ram_total": WORKER_STATIC_DETAILS["ram_total"],
+            "ram_free": virtual_memory().available,
+            "devices": (
+                types.MappingProxyType(
+                    {
+                        "name": WORKER_STATIC_DETAILS["device_name"],
+                        "type": device.type,
+                        "index": 0 if device.index is None else device.index,
+                        "vram_total": WORKER_STATIC_DETAILS["vram_total"],
+                        "vram_free": vram_free,
+                        "torch_vram_total": torch_vram_total,
+                        "torch_vram_free": torch_vram_free,
+                    }
+                ),
+            ),
+        }
+    )
 
 
 def need_directml_flag() -> bool:
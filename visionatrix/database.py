@@ -19,6 +19,8 @@ from sqlalchemy import (
     String,
     UniqueConstraint,
     create_engine,
+    func,
+    text,
 )
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
@@ -51,17 +53,24 @@ class TaskDetails(Base):
     task_id = Column(Integer, ForeignKey("tasks_queue.id"), nullable=False, unique=True)
     user_id = Column(String, nullable=False, index=True)
     priority = Column(Integer, nullable=True, default=0, index=True)
+    aged_priority = Column(
+        Integer,
+        nullable=False,
+        default=lambda context: context.get_current_parameters().get("priority") or 0,
+        comment="priority increased by the time spent in the queue, see TASKS_PRIORITY_AGING",
+    )
     worker_id = Column(String, ForeignKey("workers.worker_id"), nullable=True, default=None, index=True)
     progress = Column(Float, default=0.0, index=True)
     error = Column(String, default="")
+    state = Column(String, default="queued", nullable=False, comment="queued, running, finished or failed")
     name = Column(String, default="", nullable=False)
     input_params = Column(JSON, default={})
     outputs = Column(JSON, default=[])
     input_files = Column(JSON, default=[])
     flow_comfy = Column(JSON, default={}, nullable=False)
     task_queue = relationship("TaskQueue")
-    created_at = Column(DateTime, default=datetime.now(timezone.utc), nullable=False)
-    updated_at = Column(DateTime, nullable=True, default=None, index=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False, index=True)
+    updated_at = Column(DateTime, nullable=True, default=None, onupdate=lambda: datetime.now(timezone.utc), index=True)
     finished_at = Column(DateTime, nullable=True, default=None)
     execution_time = Column(Float, default=0.0)
     group_scope = Column(Integer, default=1, index=True)
@@ -70,8 +79,38 @@ class TaskDetails(Base):
     parent_task_id = Column(Integer, nullable=True, index=True)
     parent_task_node_id = Column(Integer, nullable=True)
     translated_input_params = Column(JSON, default=None)
+    max_execution_time = Column(Float, nullable=True, default=None, comment="task is interrupted and failed after it")
 
-    __table_args__ = (Index("ix_parent_task", "parent_task_id", "parent_task_node_id"),)
+    __table_args__ = (
+        Index("ix_parent_task", "parent_task_id", "parent_task_node_id"),
+        Index("ix_tasks_details_user_group_task", "user_id", "group_scope", "task_id"),
+        Index(
+            "ix_tasks_details_user_group_changed",
+            "user_id",
+            "group_scope",
+            func.coalesce(updated_at, created_at),
+            "task_id",
+        ),
+        Index(
+            "ix_tasks_details_queued",
+            "name",
+            "aged_priority",
+            sqlite_where=text("state = 'queued'"),
+            postgresql_where=text("state = 'queued'"),
+        ),
+    )
+
+
+class TaskTombstone(Base):
+    __tablename__ = "task_tombstones"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(Integer, nullable=False)
+    user_id = Column(String, nullable=False)
+    name = Column(String, nullable=False)
+    group_scope = Column(Integer, default=1)
+    deleted_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False, index=True)
+
+    __table_args__ = (Index("ix_task_tombstones_user_deleted", "user_id", "deleted_at"),)
 
 
 class TaskLock(Base):
@@ -79,6 +118,8 @@ class TaskLock(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     task_id = Column(Integer, ForeignKey("tasks_queue.id"), nullable=False, unique=True)
     locked_at = Column(DateTime, default=datetime.now(timezone.utc), nullable=False)
+    expires_at = Column(DateTime, nullable=True, comment="end of the lease, extended by the progress updates")
+    worker_id = Column(String, nullable=True, comment="worker that holds the lock, only it can update the task")
     task_queue = relationship("TaskQueue", backref="lock")
 
 
@@ -147,6 +188,46 @@ class FlowsInstallStatus(Base):
     finished_at = Column(DateTime, nullable=True, default=None)
 
 
+class FlowsMemoryUsage(Base):
+    __tablename__ = "flows_memory_usage"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, nullable=False, unique=True)
+    vram_peak = Column(BigInteger, nullable=False, comment="maximum of the measured peaks of VRAM usage in bytes")
+    updated_at = Column(DateTime, default=datetime.now(timezone.utc), nullable=False)
+
+
+class TasksResultsCache(Base):
+    __tablename__ = "tasks_results_cache"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    cache_key = Column(String, nullable=False, unique=True, comment="hash of the prepared flow and the input files")
+    outputs = Column(JSON, default=[], nullable=False)
+    size = Column(BigInteger, nullable=False, comment="size of the cached result files in bytes")
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    last_used_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False, index=True)
+
+
+class FairShareTag(Base):
+    __tablename__ = "fair_share_tags"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String, nullable=False)
+    group_scope = Column(Integer, nullable=False)
+    start_tag = Column(Float, nullable=False, comment="start tag of the last task dispatched to the user")
+    finish_tag = Column(Float, nullable=False, comment="start tag of the next task of the user")
+    __table_args__ = (UniqueConstraint("user_id", "group_scope", name="fair_share_tags_user_group_uc"),)
+
+
+class WebhookDelivery(Base):
+    __tablename__ = "webhook_deliveries"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(Integer, nullable=False)
+    url = Column(String, nullable=False)
+    headers = Column(JSON, nullable=True)
+    payload = Column(JSON, nullable=False)
+    attempts = Column(Integer, default=1, nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    next_attempt_at = Column(DateTime, nullable=False, index=True)
+
+
 def init_database_engine() -> None:
     global SESSION, SESSION_ASYNC
     if SESSION is not None:
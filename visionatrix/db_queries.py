@@ -1,13 +1,41 @@
+import json
 import logging
+import time
 from datetime import datetime, timedelta, timezone
 
 from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
 
-from . import database
+from . import database, options
 from .pydantic_models import FlowProgressInstall, WorkerDetails
+from .workers_heartbeats import (
+    pop_workers_heartbeats,
+    restore_workers_heartbeats,
+    set_worker_tasks_to_give_cache,
+)
 
 LOGGER = logging.getLogger("visionatrix")
 
+SECONDS_TO_CACHE_FLOWS_VRAM_PEAKS = 60
+FLOWS_VRAM_PEAKS_CACHE: dict = {"update_time": 0.0, "vram_peaks": {}}
+SECONDS_TO_CACHE_FAIR_SHARE_WEIGHTS = 30
+FAIR_SHARE_WEIGHTS_CACHE: dict = {"update_time": 0.0, "weights": {}}
+SECONDS_TO_CACHE_FLOWS_MAX_EXECUTION_TIME = 60
+FLOWS_MAX_EXECUTION_TIME_CACHE: dict[str, tuple[float, float]] = {}
+"""Max execution time of the flows tasks with the time it was calculated, keyed by the flow name."""
+FLOWS_EXECUTION_TIME_HISTORY_SIZE = 200
+FLOWS_EXECUTION_TIME_MIN_HISTORY_SIZE = 20
+FLOWS_MIN_MAX_EXECUTION_TIME = 60.0
+WEBHOOK_DELIVERY_COLUMNS = (
+    database.WebhookDelivery.id,
+    database.WebhookDelivery.task_id,
+    database.WebhookDelivery.url,
+    database.WebhookDelivery.headers,
+    database.WebhookDelivery.payload,
+    database.WebhookDelivery.attempts,
+    database.WebhookDelivery.next_attempt_at,
+)
+
 
 def __get_worker_query(user_id: str | None, worker_id: str):
     query = select(database.Worker).filter(database.Worker.worker_id == worker_id)
@@ -192,13 +220,203 @@ def set_worker_tasks_to_give(user_id: str | None, worker_id: str, tasks_to_give:
                 query = query.where(database.Worker.user_id == user_id)
             result = session.execute(query.values(tasks_to_give=tasks_to_give))
             session.commit()
-            return result.rowcount > 0
+            if result.rowcount > 0:
+                set_worker_tasks_to_give_cache(worker_id, tasks_to_give)
+                return True
+            return False
         except Exception as e:
             session.rollback()
             LOGGER.exception("Failed to update tasks for worker(`%s`, `%s`): %s", user_id, worker_id, e)
             return False
 
 
+def flush_workers_heartbeats() -> None:
+    heartbeats = pop_workers_heartbeats()
+    if not heartbeats:
+        return
+    with database.SESSION() as session:
+        try:
+            for worker_id, worker_info_values in heartbeats.items():
+                session.execute(
+                    update(database.Worker).where(database.Worker.worker_id == worker_id).values(**worker_info_values)
+                )
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            restore_workers_heartbeats(heartbeats)
+            LOGGER.exception("Failed to flush workers heartbeats: %s", e)
+
+
+def get_fair_share_weights() -> dict[str, float]:
+    """Returns the users weights from the `fair_share_weights` global setting, JSON like `{"user_id": 2.0}`."""
+    if time.monotonic() < FAIR_SHARE_WEIGHTS_CACHE["update_time"] + SECONDS_TO_CACHE_FAIR_SHARE_WEIGHTS:
+        return FAIR_SHARE_WEIGHTS_CACHE["weights"]
+    try:
+        weights = parse_fair_share_weights(get_global_setting("fair_share_weights", True))
+    except Exception:
+        return FAIR_SHARE_WEIGHTS_CACHE["weights"]
+    FAIR_SHARE_WEIGHTS_CACHE.update({"update_time": time.monotonic(), "weights": weights})
+    return weights
+
+
+def parse_fair_share_weights(value: str) -> dict[str, float]:
+    if not value:
+        return {}
+    try:
+        return {k: float(v) for k, v in json.loads(value).items() if float(v) > 0}
+    except (ValueError, TypeError, AttributeError):
+        LOGGER.warning("Invalid value of the `fair_share_weights` setting: %s", value)
+        return {}
+
+
+def get_flows_vram_peaks() -> dict[str, int]:
+    if time.monotonic() < FLOWS_VRAM_PEAKS_CACHE["update_time"] + SECONDS_TO_CACHE_FLOWS_VRAM_PEAKS:
+        return FLOWS_VRAM_PEAKS_CACHE["vram_peaks"]
+    with database.SESSION() as session:
+        try:
+            query = select(database.FlowsMemoryUsage.name, database.FlowsMemoryUsage.vram_peak)
+            vram_peaks = dict(session.execute(query).tuples().all())
+        except Exception:
+            LOGGER.exception("Failed to retrieve flows VRAM usage.")
+            return FLOWS_VRAM_PEAKS_CACHE["vram_peaks"]
+    FLOWS_VRAM_PEAKS_CACHE.update({"update_time": time.monotonic(), "vram_peaks": vram_peaks})
+    return vram_peaks
+
+
+def set_flow_vram_peak(name: str, vram_peak: int) -> None:
+    """Remembers the measured VRAM usage of the flow, if it is bigger than the previously measured ones."""
+    with database.SESSION() as session:
+        try:
+            query = select(database.FlowsMemoryUsage).filter(database.FlowsMemoryUsage.name == name)
+            flow_memory_usage = (session.execute(query)).scalar()
+            if flow_memory_usage is None:
+                session.add(
+                    database.FlowsMemoryUsage(name=name, vram_peak=vram_peak, updated_at=datetime.now(timezone.utc))
+                )
+            elif flow_memory_usage.vram_peak < vram_peak:
+                flow_memory_usage.vram_peak = vram_peak
+                flow_memory_usage.updated_at = datetime.now(timezone.utc)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            LOGGER.exception("Failed to update VRAM usage of `%s`: %s", name, e)
+
+
+def get_flow_max_execution_time(name: str) -> float:
+    """Returns the max execution time for the tasks of the flow based on its history, or 0 if there is no limit."""
+    if not options.TASKS_MAX_EXECUTION_TIME_FACTOR:
+        return 0.0
+    cached = FLOWS_MAX_EXECUTION_TIME_CACHE.get(name)
+    if cached is not None and time.monotonic() < cached[0] + SECONDS_TO_CACHE_FLOWS_MAX_EXECUTION_TIME:
+        return cached[1]
+    with database.SESSION() as session:
+        try:
+            execution_times = session.execute(get_flow_execution_times_query(name)).scalars().all()
+        except Exception:
+            LOGGER.exception("Failed to retrieve execution times of `%s`.", name)
+            return cached[1] if cached is not None else 0.0
+    max_execution_time = calculate_max_execution_time(execution_times)
+    FLOWS_MAX_EXECUTION_TIME_CACHE[name] = (time.monotonic(), max_execution_time)
+    return max_execution_time
+
+
+def get_flow_execution_times_query(name: str):
+    return (
+        select(database.TaskDetails.execution_time)
+        .filter(
+            database.TaskDetails.name == name,
+            database.TaskDetails.state == "finished",
+            database.TaskDetails.execution_time > 0.0,
+        )
+        .order_by(database.TaskDetails.task_id.desc())
+        .limit(FLOWS_EXECUTION_TIME_HISTORY_SIZE)
+    )
+
+
+def calculate_max_execution_time(execution_times: list[float]) -> float:
+    if len(execution_times) < FLOWS_EXECUTION_TIME_MIN_HISTORY_SIZE:
+        return 0.0
+    p99_execution_time = sorted(execution_times)[int(0.99 * (len(execution_times) - 1))]
+    return max(p99_execution_time * options.TASKS_MAX_EXECUTION_TIME_FACTOR, FLOWS_MIN_MAX_EXECUTION_TIME)
+
+
+def get_results_cache_entry(cache_key: str, touch: bool = True) -> list[dict] | None:
+    """Returns the outputs of the cached results, or None if there are no such results.
+
+    The results are marked as used, unless `touch` is False (checking if the results are already cached)."""
+    with database.SESSION() as session:
+        try:
+            query = select(database.TasksResultsCache).filter(
+                database.TasksResultsCache.cache_key == cache_key,
+                database.TasksResultsCache.last_used_at >= get_results_cache_min_used_at(),
+            )
+            cache_entry = session.execute(query).scalar()
+            if cache_entry is None:
+                return None
+            outputs = cache_entry.outputs
+            if touch:
+                cache_entry.last_used_at = datetime.now(timezone.utc)
+                session.commit()
+            return outputs
+        except Exception as e:
+            session.rollback()
+            LOGGER.exception("Failed to retrieve results cache entry `%s`: %s", cache_key, e)
+            return None
+
+
+def add_results_cache_entry(cache_key: str, outputs: list[dict], size: int) -> list[str]:
+    """Adds the results to the cache and evicts the old ones. Returns the keys of the results to remove from disk."""
+    with database.SESSION() as session:
+        try:
+            session.add(database.TasksResultsCache(cache_key=cache_key, outputs=outputs, size=size))
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            return []  # already added by another process
+        except Exception as e:
+            session.rollback()
+            LOGGER.exception("Failed to add results cache entry `%s`: %s", cache_key, e)
+            return [cache_key]
+        try:
+            query = select(
+                database.TasksResultsCache.cache_key,
+                database.TasksResultsCache.size,
+                database.TasksResultsCache.last_used_at,
+            ).order_by(database.TasksResultsCache.last_used_at.desc())
+            cache_keys_to_evict = get_results_cache_keys_to_evict(session.execute(query).all())
+            if cache_keys_to_evict:
+                session.execute(
+                    delete(database.TasksResultsCache).where(
+                        database.TasksResultsCache.cache_key.in_(cache_keys_to_evict)
+                    )
+                )
+                session.commit()
+            return cache_keys_to_evict
+        except Exception as e:
+            session.rollback()
+            LOGGER.exception("Failed to evict results cache entries: %s", e)
+            return []
+
+
+def get_results_cache_min_used_at() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(seconds=options.TASKS_RESULTS_CACHE_MAX_AGE)
+
+
+def get_results_cache_keys_to_evict(cache_entries: list) -> list[str]:
+    """Selects entries not used for `TASKS_RESULTS_CACHE_MAX_AGE` and the least recently used entries that
+    do not fit into `TASKS_RESULTS_CACHE_SIZE`. Expects (cache_key, size, last_used_at) sorted by `last_used_at` desc.
+    """
+    max_size = options.TASKS_RESULTS_CACHE_SIZE * 1024**3
+    min_used_at = get_results_cache_min_used_at().replace(tzinfo=None)
+    total_size = 0
+    r = []
+    for cache_key, size, last_used_at in cache_entries:
+        total_size += size
+        if total_size > max_size or last_used_at.replace(tzinfo=None) < min_used_at:
+            r.append(cache_key)
+    return r
+
+
 def get_flows_progress_install() -> list[FlowProgressInstall]:
     session = database.SESSION()
     try:
@@ -364,3 +582,78 @@ def flows_installation_in_progress() -> list[str]:
         raise
     finally:
         session.close()
+
+
+def get_due_webhook_deliveries_query(limit: int):
+    return (
+        select(*WEBHOOK_DELIVERY_COLUMNS)
+        .where(database.WebhookDelivery.next_attempt_at <= datetime.utcnow())
+        .order_by(database.WebhookDelivery.next_attempt_at)
+        .limit(limit)
+    )
+
+
+def get_claim_webhook_delivery_query(delivery: dict, lease: float):
+    """Postpones the delivery, unless another process has already done it."""
+    return (
+        update(database.WebhookDelivery)
+        .where(
+            database.WebhookDelivery.id == delivery["id"],
+            database.WebhookDelivery.next_attempt_at == delivery["next_attempt_at"],
+        )
+        .values(next_attempt_at=datetime.utcnow() + timedelta(seconds=lease))
+    )
+
+
+def get_finish_webhook_delivery_query(delivery_id: int, attempts: int, next_attempt_at: datetime | None):
+    if next_attempt_at is None:
+        return delete(database.WebhookDelivery).where(database.WebhookDelivery.id == delivery_id)
+    return (
+        update(database.WebhookDelivery)
+        .where(database.WebhookDelivery.id == delivery_id)
+        .values(attempts=attempts, next_attempt_at=next_attempt_at)
+    )
+
+
+def add_webhook_delivery(
+    task_id: int, url: str, headers: dict | None, payload: dict, next_attempt_at: datetime
+) -> None:
+    with database.SESSION() as session:
+        try:
+            session.add(
+                database.WebhookDelivery(
+                    task_id=task_id, url=url, headers=headers, payload=payload, next_attempt_at=next_attempt_at
+                )
+            )
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            LOGGER.exception("Failed to save webhook delivery of the task %s: %s", task_id, e)
+
+
+def claim_webhook_deliveries(limit: int, lease: float) -> list[dict]:
+    """Returns the deliveries to retry now and postpones them for `lease` seconds, so other processes skip them."""
+    with database.SESSION() as session:
+        try:
+            claimed = []
+            for row in session.execute(get_due_webhook_deliveries_query(limit)).all():
+                delivery = dict(zip((i.key for i in WEBHOOK_DELIVERY_COLUMNS), row, strict=True))
+                if session.execute(get_claim_webhook_delivery_query(delivery, lease)).rowcount == 1:
+                    claimed.append(delivery)
+            session.commit()
+            return claimed
+        except Exception as e:
+            session.rollback()
+            LOGGER.exception("Failed to claim webhook deliveries: %s", e)
+            return []
+
+
+def finish_webhook_delivery(delivery_id: int, attempts: int, next_attempt_at: datetime | None) -> None:
+    """Removes the delivery when `next_attempt_at` is None, otherwise schedules the next attempt."""
+    with database.SESSION() as session:
+        try:
+            session.execute(get_finish_webhook_delivery_query(delivery_id, attempts, next_attempt_at))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            LOGGER.exception("Failed to update webhook delivery %s: %s", delivery_id, e)
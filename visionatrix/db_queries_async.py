@@ -1,10 +1,36 @@
 import logging
+import time
+from datetime import datetime, timezone
 
 from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
 
-from . import database
-from .db_queries import __get_worker_query, __get_workers_query
+from . import database, options
+from .db_queries import (
+    FAIR_SHARE_WEIGHTS_CACHE,
+    FLOWS_MAX_EXECUTION_TIME_CACHE,
+    FLOWS_VRAM_PEAKS_CACHE,
+    SECONDS_TO_CACHE_FAIR_SHARE_WEIGHTS,
+    SECONDS_TO_CACHE_FLOWS_MAX_EXECUTION_TIME,
+    SECONDS_TO_CACHE_FLOWS_VRAM_PEAKS,
+    WEBHOOK_DELIVERY_COLUMNS,
+    __get_worker_query,
+    __get_workers_query,
+    calculate_max_execution_time,
+    get_claim_webhook_delivery_query,
+    get_due_webhook_deliveries_query,
+    get_finish_webhook_delivery_query,
+    get_flow_execution_times_query,
+    get_results_cache_keys_to_evict,
+    get_results_cache_min_used_at,
+    parse_fair_share_weights,
+)
 from .pydantic_models import FlowProgressInstall, WorkerDetails
+from .workers_heartbeats import (
+    pop_workers_heartbeats,
+    restore_workers_heartbeats,
+    set_worker_tasks_to_give_cache,
+)
 
 LOGGER = logging.getLogger("visionatrix")
 
@@ -165,15 +191,155 @@ async def set_worker_tasks_to_give_async(user_id: str | None, worker_id: str, ta
             query = update(database.Worker).where(database.Worker.worker_id == worker_id)
             if user_id is not None:
                 query = query.where(database.Worker.user_id == user_id)
-            result = session.execute(query.values(tasks_to_give=tasks_to_give))
+            result = await session.execute(query.values(tasks_to_give=tasks_to_give))
             await session.commit()
-            return result.rowcount > 0
+            if result.rowcount > 0:
+                set_worker_tasks_to_give_cache(worker_id, tasks_to_give)
+                return True
+            return False
         except Exception as e:
             await session.rollback()
             LOGGER.exception("Failed to update tasks for worker(`%s`, `%s`): %s", user_id, worker_id, e)
             return False
 
 
+async def flush_workers_heartbeats_async() -> None:
+    heartbeats = pop_workers_heartbeats()
+    if not heartbeats:
+        return
+    async with database.SESSION_ASYNC() as session:
+        try:
+            for worker_id, worker_info_values in heartbeats.items():
+                await session.execute(
+                    update(database.Worker).where(database.Worker.worker_id == worker_id).values(**worker_info_values)
+                )
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            restore_workers_heartbeats(heartbeats)
+            LOGGER.exception("Failed to flush workers heartbeats: %s", e)
+
+
+async def get_fair_share_weights_async() -> dict[str, float]:
+    """Returns the users weights from the `fair_share_weights` global setting, JSON like `{"user_id": 2.0}`."""
+    if time.monotonic() < FAIR_SHARE_WEIGHTS_CACHE["update_time"] + SECONDS_TO_CACHE_FAIR_SHARE_WEIGHTS:
+        return FAIR_SHARE_WEIGHTS_CACHE["weights"]
+    try:
+        weights = parse_fair_share_weights(await get_global_setting_async("fair_share_weights", True))
+    except Exception:
+        return FAIR_SHARE_WEIGHTS_CACHE["weights"]
+    FAIR_SHARE_WEIGHTS_CACHE.update({"update_time": time.monotonic(), "weights": weights})
+    return weights
+
+
+async def get_flows_vram_peaks_async() -> dict[str, int]:
+    if time.monotonic() < FLOWS_VRAM_PEAKS_CACHE["update_time"] + SECONDS_TO_CACHE_FLOWS_VRAM_PEAKS:
+        return FLOWS_VRAM_PEAKS_CACHE["vram_peaks"]
+    async with database.SESSION_ASYNC() as session:
+        try:
+            query = select(database.FlowsMemoryUsage.name, database.FlowsMemoryUsage.vram_peak)
+            vram_peaks = dict((await session.execute(query)).tuples().all())
+        except Exception:
+            LOGGER.exception("Failed to retrieve flows VRAM usage.")
+            return FLOWS_VRAM_PEAKS_CACHE["vram_peaks"]
+    FLOWS_VRAM_PEAKS_CACHE.update({"update_time": time.monotonic(), "vram_peaks": vram_peaks})
+    return vram_peaks
+
+
+async def set_flow_vram_peak_async(name: str, vram_peak: int) -> None:
+    """Remembers the measured VRAM usage of the flow, if it is bigger than the previously measured ones."""
+    async with database.SESSION_ASYNC() as session:
+        try:
+            query = select(database.FlowsMemoryUsage).filter(database.FlowsMemoryUsage.name == name)
+            flow_memory_usage = (await session.execute(query)).scalar()
+            if flow_memory_usage is None:
+                session.add(
+                    database.FlowsMemoryUsage(name=name, vram_peak=vram_peak, updated_at=datetime.now(timezone.utc))
+                )
+            elif flow_memory_usage.vram_peak < vram_peak:
+                flow_memory_usage.vram_peak = vram_peak
+                flow_memory_usage.updated_at = datetime.now(timezone.utc)
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            LOGGER.exception("Failed to update VRAM usage of `%s`: %s", name, e)
+
+
+async def get_flow_max_execution_time_async(name: str) -> float:
+    if not options.TASKS_MAX_EXECUTION_TIME_FACTOR:
+        return 0.0
+    cached = FLOWS_MAX_EXECUTION_TIME_CACHE.get(name)
+    if cached is not None and time.monotonic() < cached[0] + SECONDS_TO_CACHE_FLOWS_MAX_EXECUTION_TIME:
+        return cached[1]
+    async with database.SESSION_ASYNC() as session:
+        try:
+            execution_times = (await session.execute(get_flow_execution_times_query(name))).scalars().all()
+        except Exception:
+            LOGGER.exception("Failed to retrieve execution times of `%s`.", name)
+            return cached[1] if cached is not None else 0.0
+    max_execution_time = calculate_max_execution_time(execution_times)
+    FLOWS_MAX_EXECUTION_TIME_CACHE[name] = (time.monotonic(), max_execution_time)
+    return max_execution_time
+
+
+async def get_results_cache_entry_async(cache_key: str, touch: bool = True) -> list[dict] | None:
+    """Returns the outputs of the cached results, or None if there are no such results.
+
+    The results are marked as used, unless `touch` is False (checking if the results are already cached)."""
+    async with database.SESSION_ASYNC() as session:
+        try:
+            query = select(database.TasksResultsCache).filter(
+                database.TasksResultsCache.cache_key == cache_key,
+                database.TasksResultsCache.last_used_at >= get_results_cache_min_used_at(),
+            )
+            cache_entry = (await session.execute(query)).scalar()
+            if cache_entry is None:
+                return None
+            outputs = cache_entry.outputs
+            if touch:
+                cache_entry.last_used_at = datetime.now(timezone.utc)
+                await session.commit()
+            return outputs
+        except Exception as e:
+            await session.rollback()
+            LOGGER.exception("Failed to retrieve results cache entry `%s`: %s", cache_key, e)
+            return None
+
+
+async def add_results_cache_entry_async(cache_key: str, outputs: list[dict], size: int) -> list[str]:
+    """Adds the results to the cache and evicts the old ones. Returns the keys of the results to remove from disk."""
+    async with database.SESSION_ASYNC() as session:
+        try:
+            session.add(database.TasksResultsCache(cache_key=cache_key, outputs=outputs, size=size))
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
+            return []  # already added by another process
+        except Exception as e:
+            await session.rollback()
+            LOGGER.exception("Failed to add results cache entry `%s`: %s", cache_key, e)
+            return [cache_key]
+        try:
+            query = select(
+                database.TasksResultsCache.cache_key,
+                database.TasksResultsCache.size,
+                database.TasksResultsCache.last_used_at,
+            ).order_by(database.TasksResultsCache.last_used_at.desc())
+            cache_keys_to_evict = get_results_cache_keys_to_evict((await session.execute(query)).all())
+            if cache_keys_to_evict:
+                await session.execute(
+                    delete(database.TasksResultsCache).where(
+                        database.TasksResultsCache.cache_key.in_(cache_keys_to_evict)
+                    )
+                )
+                await session.commit()
+            return cache_keys_to_evict
+        except Exception as e:
+            await session.rollback()
+            LOGGER.exception("Failed to evict results cache entries: %s", e)
+            return []
+
+
 async def get_flows_progress_install_async() -> list[FlowProgressInstall]:
     async with database.SESSION_ASYNC() as session:
         try:
@@ -196,3 +362,47 @@ async def delete_flows_progress_install_async(name: str) -> bool:
             await session.rollback()
             LOGGER.exception("Failed to delete flow installation progress for `%s`", name)
             raise
+
+
+async def add_webhook_delivery_async(
+    task_id: int, url: str, headers: dict | None, payload: dict, next_attempt_at: datetime
+) -> None:
+    async with database.SESSION_ASYNC() as session:
+        try:
+            session.add(
+                database.WebhookDelivery(
+                    task_id=task_id, url=url, headers=headers, payload=payload, next_attempt_at=next_attempt_at
+                )
+            )
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            LOGGER.exception("Failed to save webhook delivery of the task %s: %s", task_id, e)
+
+
+async def claim_webhook_deliveries_async(limit: int, lease: float) -> list[dict]:
+    """Returns the deliveries to retry now and postpones them for `lease` seconds, so other processes skip them."""
+    async with database.SESSION_ASYNC() as session:
+        try:
+            claimed = []
+            for row in (await session.execute(get_due_webhook_deliveries_query(limit))).all():
+                delivery = dict(zip((i.key for i in WEBHOOK_DELIVERY_COLUMNS), row, strict=True))
+                if (await session.execute(get_claim_webhook_delivery_query(delivery, lease))).rowcount == 1:
+                    claimed.append(delivery)
+            await session.commit()
+            return claimed
+        except Exception as e:
+            await session.rollback()
+            LOGGER.exception("Failed to claim webhook deliveries: %s", e)
+            return []
+
+
+async def finish_webhook_delivery_async(delivery_id: int, attempts: int, next_attempt_at: datetime | None) -> None:
+    """Removes the delivery when `next_attempt_at` is None, otherwise schedules the next attempt."""
+    async with database.SESSION_ASYNC() as session:
+        try:
+            await session.execute(get_finish_webhook_delivery_query(delivery_id, attempts, next_attempt_at))
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            LOGGER.exception("Failed to update webhook delivery %s: %s", delivery_id, e)
@@ -1,4 +1,8 @@
+import builtins
+import hashlib
 import logging
+import os
+import shutil
 import string
 
 IMAGE_EXTENSIONS = [
@@ -89,3 +93,19 @@ def is_english(input_string: str) -> bool:
             english_word_count += 1
 
     return english_word_count / len(words) > 0.90  # Check if more than 90% of the words are in English
+
+
+def link_or_copy_file(src: str, dst: str) -> None:
+    """Hard links are used, so tasks that share the same files do not take extra space."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def get_file_hash(file_path: str) -> str:
+    file_hash = hashlib.sha256()
+    with builtins.open(file_path, mode="rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
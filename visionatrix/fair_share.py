@@ -0,0 +1,56 @@
+"""Weighted fair sharing of the workers between the users, implemented as Start-time Fair Queuing.
+
+Each dispatched task advances the "finish tag" of its user (in its group scope) by `1 / weight`. Within the same
+priority, tasks of the users with the smallest finish tag are dispatched first, so a user who queued hundreds of tasks
+can not delay the tasks of the other users by more than one task per each of theirs (adjusted by the weights).
+
+The tags are kept in the `fair_share_tags` table, so they are shared by all Server instances(processes) and survive
+the restart. Only users ahead of the virtual time (the start tag of the last dispatched task) have a row, users
+without it are treated as having the virtual time, so the table stays as small as the number of backlogged users.
+"""
+
+from sqlalchemy import and_, case, delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import aliased
+
+from . import database
+
+
+def get_virtual_time():
+    fair_share_tags = aliased(database.FairShareTag)  # not correlated with the updated table
+    return select(func.coalesce(func.max(fair_share_tags.start_tag), 0.0)).scalar_subquery()
+
+
+def order_by_fair_share(query):
+    """Orders the tasks of the `query` by the finish tags of their users.
+
+    The sort key comes from the joined table, so it can not use an index: the queued tasks of the requested flows
+    (selected with `ix_tasks_details_queued`) are sorted in memory."""
+    return query.outerjoin(
+        database.FairShareTag,
+        and_(
+            database.FairShareTag.user_id == database.TaskDetails.user_id,
+            database.FairShareTag.group_scope == database.TaskDetails.group_scope,
+        ),
+    ).order_by(func.coalesce(database.FairShareTag.finish_tag, get_virtual_time()))
+
+
+def get_record_task_dispatched_query(dialect_name: str, user_id: str, group_scope: int, weight: float):
+    """Advances the finish tag of the user to `max(virtual time, finish tag) + 1 / weight`."""
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    virtual_time = get_virtual_time()
+    query = insert(database.FairShareTag).values(
+        user_id=user_id, group_scope=group_scope, start_tag=virtual_time, finish_tag=virtual_time + 1.0 / weight
+    )
+    start_tag = case(
+        (database.FairShareTag.finish_tag > virtual_time, database.FairShareTag.finish_tag), else_=virtual_time
+    )
+    return query.on_conflict_do_update(
+        index_elements=["user_id", "group_scope"],
+        set_={"start_tag": start_tag, "finish_tag": start_tag + 1.0 / weight},
+    )
+
+
+def get_remove_passed_tags_query():
+    """Removes the tags of the users that are not ahead of the virtual time, they are equal to having no tag."""
+    return delete(database.FairShareTag).where(database.FairShareTag.finish_tag <= get_virtual_time())
@@ -21,11 +21,12 @@ from packaging.version import Version, parse
 
 from . import _version, comfyui_class_info, db_queries, options
 from .comfyui import get_node_class_mappings
-from .etc import is_english
+from .etc import is_english, link_or_copy_file
 from .models import install_model
 from .models_map import get_flow_models
 from .nodes_helpers import get_node_value, set_node_value
 from .pydantic_models import Flow
+from .worker_client import server_request
 
 SECONDS_TO_CACHE_INSTALLED_FLOWS = 10
 SECONDS_TO_CACHE_AVAILABLE_FLOWS = 3 * 60
@@ -219,12 +220,7 @@ def install_custom_flow(
         elif options.VIX_MODE == "DEFAULT":
             hf_auth_token = db_queries.get_global_setting("huggingface_auth_token", True)
         else:
-            r = httpx.get(
-                options.VIX_SERVER.rstrip("/") + "/setting",
-                params={"key": "huggingface_auth_token"},
-                auth=options.worker_auth(),
-                timeout=float(options.WORKER_NET_TIMEOUT),
-            )
+            r = server_request("GET", "/api/settings/get", params={"key": "huggingface_auth_token"})
             if not httpx.codes.is_error(r.status_code):
                 hf_auth_token = r.text
         if not hf_auth_token:
@@ -327,7 +323,7 @@ def prepare_flow_comfy_files_params(
                     raise RuntimeError(
                         f"Bad flow, file from task_id=`{v['task_id']}`, index=`{v['input_index']}` not found."
                     )
-                shutil.copy(input_file, result_path)
+                link_or_copy_file(input_file, result_path)
             elif "node_id" in v:
                 input_file = ""
                 result_prefix = f"{v['task_id']}_{v['node_id']}_"
@@ -339,7 +335,7 @@ def prepare_flow_comfy_files_params(
                     raise RuntimeError(
                         f"Bad flow, file from task_id=`{v['task_id']}`, node_id={v['node_id']} not found."
                     )
-                shutil.copy(input_file, result_path)
+                link_or_copy_file(input_file, result_path)
             else:
                 raise RuntimeError("Bad flow, `input_index` or `node_id` should be present.")
         else:
@@ -0,0 +1,16 @@
+"""Counters of the current process, exposed by the `/api/other/metrics` endpoint."""
+
+import threading
+
+METRICS_LOCK = threading.Lock()
+METRICS: dict[str, float] = {}
+
+
+def increment_metric(name: str, value: float = 1.0) -> None:
+    with METRICS_LOCK:
+        METRICS[name] = METRICS.get(name, 0.0) + value
+
+
+def get_metrics() -> dict[str, float]:
+    with METRICS_LOCK:
+        return METRICS.copy()
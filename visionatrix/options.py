@@ -36,6 +36,19 @@ WORKER_AUTH = environ.get("WORKER_AUTH", "admin:admin")
 """Only for WORKER in the `Worker to Server` mode."""
 WORKER_NET_TIMEOUT = environ.get("WORKER_NET_TIMEOUT", "15.0")
 """Only for WORKER in the `Worker to Server` mode."""
+WORKER_HTTP2 = int(environ.get("WORKER_HTTP2", "0")) == 1
+"""Only for WORKER in the `Worker to Server` mode. If set to '1', requests to the Server use HTTP/2 when it supports it.
+
+Requires the `h2` package (`pip install httpx[http2]`)."""
+WORKER_PREFETCH_TASKS = int(environ.get("WORKER_PREFETCH_TASKS", "0"))
+"""Only for WORKER in the `Worker to Server` mode. How many tasks to claim in advance while executing the current one.
+
+Input files of the prefetched tasks are downloaded in the background, so the next task can start immediately."""
+WORKER_PROGRESS_MAX_RATE = float(environ.get("WORKER_PROGRESS_MAX_RATE", "2.0"))
+"""Maximum number of progress updates per second that the worker sends for the executing task.
+
+Changes of the progress between the updates are coalesced. Errors, interruption and completion of the task
+are sent immediately. Set to '0' to send each change."""
 VIX_SERVER_WORKERS = environ.get("VIX_SERVER_WORKERS", "1")
 """Only for SERVER mode. How many Server instances should be spawned(using uvicorn)."""
 VIX_SERVER_FULL_MODELS = environ.get("VIX_SERVER_FULL_MODELS", "0")
@@ -71,6 +84,71 @@ MIN_PAUSE_INTERVAL = float(environ.get("MIN_PAUSE_INTERVAL", "0.1"))
 MAX_PAUSE_INTERVAL = float(environ.get("MAX_PAUSE_INTERVAL", "1.0"))
 """Maximum wait time (in seconds) between polling for the next task. Increased in steps when no tasks are available."""
 
+WORKER_LONG_POLL_TIMEOUT = float(environ.get("WORKER_LONG_POLL_TIMEOUT", "10.0"))
+"""Maximum time (in seconds) the worker waits for a new task in a single request before asking again.
+
+While waiting, the request is parked on the Server (or locally in the `DEFAULT` mode) and returns as soon as
+a suitable task is queued. Set to '0' to disable long polling and poll with MIN_PAUSE_INTERVAL/MAX_PAUSE_INTERVAL."""
+TASKS_NEXT_RECHECK_INTERVAL = float(environ.get("TASKS_NEXT_RECHECK_INTERVAL", "3.0"))
+"""Interval (in seconds) at which parked `/api/tasks/next` requests and `/api/tasks/progress-stream` streams
+re-check the database.
+
+Needed only to notice tasks that were created or updated by other Server instances(processes)."""
+TASK_LOCK_LEASE = float(environ.get("TASK_LOCK_LEASE", "30.0"))
+"""Time (in seconds) for which the worker holds the lock of the task it is processing without reporting the progress.
+
+Workers extend the lease while the task is running. When the lease expires (e.g. the worker crashed), the task
+is unlocked and returned to the queue. Should have the same value on the Server and on the Workers."""
+WORKERS_HEARTBEAT_INTERVAL = float(environ.get("WORKERS_HEARTBEAT_INTERVAL", "5.0"))
+"""Interval (in seconds) at which the workers information received with requests is written to the database.
+
+The workers `tasks_to_give` are cached for the same time."""
+
+TASKS_PRIORITY_AGING = {
+    int(level): float(seconds)
+    for level, seconds in (i.split(":") for i in environ.get("TASKS_PRIORITY_AGING", "").split(";") if i.strip())
+}
+"""Priority aging of the queued tasks, as 'priority:seconds' pairs separated by ';'. Disabled by default.
+
+Tasks with the specified priority get +1 to their priority for each 'seconds' waited in the queue, up to the
+maximum priority(15), so that low priority tasks are not starved by a constant flow of higher priority tasks.
+The increase is applied to the queued tasks every few seconds by the Server, the set priority is not changed.
+
+Example:
+    TASKS_PRIORITY_AGING=0:300;1:300;5:120
+"""
+
+TASKS_PREEMPTION_PRIORITY = int(environ.get("TASKS_PREEMPTION_PRIORITY", "0"))
+"""Priority(1-15) from which the queued tasks preempt the running tasks with lower priority. Disabled by default.
+
+When such task is not taken by any worker for TASKS_PREEMPTION_DELAY seconds, the running task with a lower priority
+that has done the least work is returned to the queue, and its worker interrupts it on the next progress update.
+With the `--cache-lru` ComfyUI option, results of the already executed nodes of the preempted task are reused
+when the same worker executes it again."""
+TASKS_PREEMPTION_DELAY = float(environ.get("TASKS_PREEMPTION_DELAY", "10.0"))
+"""Time (in seconds) for which a task should stay in the queue before it preempts the running tasks."""
+
+TASKS_MAX_EXECUTION_TIME_FACTOR = float(environ.get("TASKS_MAX_EXECUTION_TIME_FACTOR", "0"))
+"""Multiplier of the p99 execution time of the flow, used as the max execution time of its tasks. Disabled by default.
+
+Applies to the tasks created without `max_execution_time`, once the flow has enough finished tasks.
+When the max execution time passes, the worker interrupts the task and marks it as failed.
+The execution time depends on the input parameters (e.g. the number of steps or the image size),
+so set it (e.g. to '3.0') only when the tasks of each flow take a similar time."""
+
+TASKS_RESULTS_CACHE_SIZE = float(environ.get("TASKS_RESULTS_CACHE_SIZE", "0"))
+"""Maximum size (in GB) of the results cache. Disabled by default.
+
+When enabled, a new task with the same flow, input parameters, input files and seed as an already finished task
+of the same user is completed immediately with the results of that task. Least recently used results are evicted."""
+TASKS_RESULTS_CACHE_MAX_AGE = float(environ.get("TASKS_RESULTS_CACHE_MAX_AGE", "604800"))
+"""Time (in seconds) after which the results that were not used are removed from the cache. Defaults to 7 days."""
+
+TASKS_TOMBSTONES_MAX_AGE = float(environ.get("TASKS_TOMBSTONES_MAX_AGE", "86400"))
+"""Time (in seconds) for which the IDs of the removed tasks are kept for the `/api/tasks/progress-changes` feed.
+
+Clients that did not ask for the changes for longer get the full list of the tasks. Defaults to 1 day."""
+
 GC_COLLECT_INTERVAL = float(environ.get("GC_COLLECT_INTERVAL", "10.0"))
 """Internal variable. Interval in seconds (float) that determines how long
 after the task is executed the GPU memory release and garbage collection procedure will be called.
@@ -97,7 +175,9 @@ NODES_TIMING = int(environ.get("NODES_TIMING", "0")) == 1
 """If set to '1', logs the execution time of each workflow node for performance analysis."""
 
 GPU_MEM_TRACKING = int(environ.get("GPU_MEM_TRACKING", "0")) == 1
-"""If set to '1', logs the maximum GPU memory consumption for the flow."""
+"""If set to '1', logs the maximum GPU memory consumption for the flow.
+
+Measured values are reported to the Server and used to give the flow's tasks only to the workers with enough VRAM."""
 
 
 def init_dirs_values(backend: str | None, flows: str | None, models: str | None, tasks_files: str | None) -> None:
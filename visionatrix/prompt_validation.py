@@ -0,0 +1,158 @@
+"""Validation of the prepared ComfyUI prompts with a cache of the results.
+
+Prompts of the same flow differ only in the input values, so the result of the ComfyUI validation is cached by the
+structure of the prompt and the values ComfyUI really checks. Free text inputs and numbers are not part of the key:
+the text is always valid, and numbers are checked against their limits before the cached result is used.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import typing
+
+from .comfyui import get_node_class_mappings
+from .metrics import increment_metric
+from .pydantic_models import Flow
+
+LOGGER = logging.getLogger("visionatrix")
+
+VALIDATE_PROMPT: typing.Callable[[dict], tuple[bool, dict, list, list]] | None = None
+
+SECONDS_TO_CACHE_PROMPT_VALIDATION = 300
+"""Cached results expire, as validation of the combo inputs depends on the installed models."""
+PROMPT_VALIDATION_CACHE_MAX_SIZE = 1000
+
+VALIDATION_PLANS_CACHE: dict[str, tuple[float, dict[str, dict[str, tuple | None]]]] = {}
+"""Structure key -> (time, inputs not included in the validation key: None for text, (min, max) for numbers)."""
+VALIDATION_RESULTS_CACHE: dict[str, tuple[float, list]] = {}
+"""Validation key -> (time, output nodes) of the valid prompts."""
+
+
+async def validate_prompt_async(
+    flow: Flow, flow_comfy: dict, input_files_names: list[str]
+) -> tuple[bool, dict | None, list, list]:
+    """Returns the result of the ComfyUI validation of the prepared prompt, using the cached result when possible.
+
+    ComfyUI validation runs in a thread, so it does not block the event loop.
+    """
+    structure_key = get_prompt_structure_key(flow, flow_comfy)
+    validation_plan = __get_cached(VALIDATION_PLANS_CACHE, structure_key)
+    if validation_plan is None:
+        validation_plan = await asyncio.to_thread(get_validation_plan, flow_comfy)
+        __set_cached(VALIDATION_PLANS_CACHE, structure_key, validation_plan)
+    validation_key, limits_passed = get_prompt_validation_key(
+        structure_key, validation_plan, flow_comfy, input_files_names
+    )
+    if limits_passed and (outputs := __get_cached(VALIDATION_RESULTS_CACHE, validation_key)) is not None:
+        increment_metric("prompt_validation_cache_hits")
+        return True, None, list(outputs), []
+    increment_metric("prompt_validation_cache_misses")
+    flow_validation = await asyncio.to_thread(VALIDATE_PROMPT, flow_comfy)
+    if flow_validation[0]:
+        __set_cached(VALIDATION_RESULTS_CACHE, validation_key, list(flow_validation[2]))
+    return flow_validation
+
+
+def get_prompt_structure_key(flow: Flow, flow_comfy: dict) -> str:
+    """Hash of the flow version, the nodes and the links between them."""
+    structure = [
+        [
+            node_id,
+            node_details.get("class_type"),
+            sorted(node_details.get("inputs", {})),
+            {k: v for k, v in node_details.get("inputs", {}).items() if __is_link(v)},
+        ]
+        for node_id, node_details in sorted(flow_comfy.items())
+    ]
+    data = json.dumps([flow.name, flow.version, structure], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def get_validation_plan(flow_comfy: dict) -> dict[str, dict[str, tuple | None]]:
+    """Finds the inputs which values ComfyUI checks only by type and limits.
+
+    Nodes with `VALIDATE_INPUTS` are skipped, as they can check the values in any way.
+    """
+    nodes_class_mappings = get_node_class_mappings()
+    validation_plan = {}
+    for node_id, node_details in flow_comfy.items():
+        node_class = nodes_class_mappings.get(node_details.get("class_type"))
+        if node_class is None or hasattr(node_class, "VALIDATE_INPUTS"):
+            continue
+        try:
+            input_types = node_class.INPUT_TYPES()
+        except Exception as e:
+            LOGGER.warning("Can not get input types of `%s`: %s", node_details.get("class_type"), e)
+            continue
+        node_plan = {}
+        for input_name, input_value in node_details.get("inputs", {}).items():
+            input_info = input_types.get("required", {}).get(
+                input_name, input_types.get("optional", {}).get(input_name)
+            )
+            if not input_info or __is_link(input_value):
+                continue
+            extra_info = input_info[1] if len(input_info) > 1 and isinstance(input_info[1], dict) else {}
+            if input_info[0] == "STRING" and isinstance(input_value, str):
+                node_plan[input_name] = None
+            elif input_info[0] in ("INT", "FLOAT") and __is_number(input_value):
+                node_plan[input_name] = (extra_info.get("min"), extra_info.get("max"))
+        if node_plan:
+            validation_plan[node_id] = node_plan
+    return validation_plan
+
+
+def get_prompt_validation_key(
+    structure_key: str, validation_plan: dict, flow_comfy: dict, input_files_names: list[str]
+) -> tuple[str, bool]:
+    """Returns hash of the values that ComfyUI checks, and whether the numbers excluded from it are within limits.
+
+    Input files of the task are replaced with their indexes: their names are unique, but they always exist.
+    """
+    values = []
+    limits_passed = True
+    for node_id, node_details in sorted(flow_comfy.items()):
+        node_plan = validation_plan.get(node_id, {})
+        for input_name, input_value in sorted(node_details.get("inputs", {}).items()):
+            if __is_link(input_value):
+                continue
+            if input_name in node_plan and node_plan[input_name] is None and isinstance(input_value, str):
+                continue
+            if input_name in node_plan and node_plan[input_name] is not None and __is_number(input_value):
+                min_value, max_value = node_plan[input_name]
+                if (min_value is not None and input_value < min_value) or (
+                    max_value is not None and input_value > max_value
+                ):
+                    limits_passed = False
+                continue
+            if isinstance(input_value, str) and input_value in input_files_names:
+                input_value = f"<input file {input_files_names.index(input_value)}>"
+            values.append([node_id, input_name, input_value])
+    data = json.dumps([structure_key, values], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest(), limits_passed
+
+
+def __get_cached(cache: dict, key: str) -> typing.Any:
+    cached = cache.get(key)
+    if cached is None or time.monotonic() > cached[0] + SECONDS_TO_CACHE_PROMPT_VALIDATION:
+        return None
+    return cached[1]
+
+
+def __set_cached(cache: dict, key: str, value: typing.Any) -> None:
+    if len(cache) >= PROMPT_VALIDATION_CACHE_MAX_SIZE:
+        expired_time = time.monotonic() - SECONDS_TO_CACHE_PROMPT_VALIDATION
+        for k in [k for k, v in cache.items() if v[0] < expired_time]:
+            del cache[k]
+        if len(cache) >= PROMPT_VALIDATION_CACHE_MAX_SIZE:
+            cache.clear()
+    cache[key] = (time.monotonic(), value)
+
+
+def __is_link(input_value: typing.Any) -> bool:
+    return isinstance(input_value, list) and len(input_value) == 2 and isinstance(input_value[1], int)
+
+
+def __is_number(input_value: typing.Any) -> bool:
+    return isinstance(input_value, int | float) and not isinstance(input_value, bool)
@@ -92,6 +92,9 @@ class Flow(BaseModel):
     is_translations_supported: bool = Field(
         False, description="Flag that determines whether Flow supports prompt translations."
     )
+    required_memory_gb: float = Field(
+        0.0, description="Memory (VRAM, or RAM for the CPU workers) in GB required to execute the flow, 0 if unknown."
+    )
 
     def __hash__(self):
         return hash(self.name)
@@ -163,6 +166,8 @@ class TaskDetailsShort(BaseModel):
     translated_input_params: dict | None = Field(
         None, description="If auto-translation feature is enabled, contains translations for input values."
     )
+    created_at: datetime = Field(..., description="Task creation time.")
+    updated_at: datetime | None = Field(None, description="Last task update time.")
 
     @model_validator(mode="after")
     def adjust_priority(self) -> Self:
@@ -177,13 +182,27 @@ class TaskDetailsShort(BaseModel):
 class TaskDetails(TaskDetailsShort):
     """Detailed information about the Task."""
 
-    created_at: datetime = Field(..., description="Task creation time.")
-    updated_at: datetime | None = Field(None, description="Last task update time.")
     finished_at: datetime | None = Field(None, description="Finish time of the task.")
     flow_comfy: dict = Field(..., description="The final generated ComfyUI workflow.")
     user_id: str = Field(..., description="User ID to whom the task belongs.")
     webhook_url: str | None = Field(None, description="The URL that will be called when the task state changes.")
     webhook_headers: dict | None = Field(None, description="Headers to send to webhook.")
+    max_execution_time: float | None = Field(
+        None, description="Time in seconds after which the task execution is interrupted and the task is failed."
+    )
+
+
+class TasksChanges(BaseModel):
+    """Changes of the tasks since the previous request."""
+
+    cursor: datetime = Field(..., description="Value of the `since` parameter for the next request.")
+    reset: bool = Field(
+        ..., description="`tasks` contain all the tasks, and the tasks missing from them should be discarded."
+    )
+    tasks: dict[int, TaskDetailsShort] = Field(
+        ..., description="Created or changed tasks, including the child tasks. `child_tasks` are always empty."
+    )
+    removed_tasks: list[int] = Field(..., description="IDs of the removed tasks.")
 
 
 class WorkerDetailsSystemRequest(BaseModel):
@@ -276,6 +295,32 @@ class OrphanModel(BaseModel):
     possible_flows: list[Flow] = Field([], description="List of possible flows that could potentially use this model.")
 
 
+class TaskCreateRequest(BaseModel):
+    """
+    Represents the task(s) to create with the batch endpoint.
+
+    Fields have the same meaning as the form fields of the `/tasks/create` endpoint.
+    """
+
+    name: str = Field(..., description="Name of the flow from which the task should be created.")
+    count: int = Field(1, ge=1, description="Number of tasks to be created.")
+    input_params: dict = Field({}, description="Input parameters of the flow.")
+    webhook_url: str | None = Field(None, description="URL to call when task state changes.")
+    webhook_headers: dict | None = Field(None, description="Headers for webhook url.")
+    child_task: bool = Field(False, description="Whether to create a relation between the tasks.")
+    group_scope: int = Field(1, ge=1, le=255, description="Group number to which task should be assigned.")
+    priority: int = Field(0, le=15, description="Task execution priority. Higher numbers indicate higher priority.")
+    translate: bool = Field(False, description="Should the prompt be translated if auto-translation is enabled.")
+    max_execution_time: float = Field(
+        0.0, ge=0.0, description="Time in seconds after which the task execution is interrupted and the task is failed."
+    )
+    files: list[dict] = Field(
+        [],
+        description="Input files of the flow. Only files of the other tasks can be used, "
+        "e.g. `{'task_id': 1, 'input_index': 0}` or `{'task_id': 1, 'node_id': 9}`.",
+    )
+
+
 class TaskUpdateRequest(BaseModel):
     """
     Represents the fields that can be updated for a task that has not yet started execution.
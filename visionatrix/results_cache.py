@@ -0,0 +1,149 @@
+"""Cache of the tasks results, used to complete the new tasks that repeat already finished ones without executing."""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import shutil
+from copy import deepcopy
+from datetime import datetime, timezone
+
+from . import options
+from .db_queries import add_results_cache_entry, get_results_cache_entry
+from .db_queries_async import (
+    add_results_cache_entry_async,
+    get_results_cache_entry_async,
+)
+from .etc import get_file_hash, link_or_copy_file
+from .flows import get_google_nodes, get_ollama_nodes
+from .metrics import increment_metric
+
+LOGGER = logging.getLogger("visionatrix")
+
+
+def fill_task_from_results_cache(task_details: dict) -> bool:
+    """Marks the new task as finished with the results of the same earlier task, if they are in the cache."""
+    if not options.TASKS_RESULTS_CACHE_SIZE or not (cache_key := get_results_cache_key(task_details)):
+        return False
+    return __fill_task_from_results_cache(task_details, cache_key, get_results_cache_entry(cache_key))
+
+
+async def fill_task_from_results_cache_async(task_details: dict) -> bool:
+    if not options.TASKS_RESULTS_CACHE_SIZE or not (cache_key := get_results_cache_key(task_details)):
+        return False
+    return __fill_task_from_results_cache(task_details, cache_key, await get_results_cache_entry_async(cache_key))
+
+
+def add_task_results_to_cache(task_details: dict) -> None:
+    """Stores the results of the finished task in the cache, evicting the old results if needed."""
+    if not options.TASKS_RESULTS_CACHE_SIZE or not (cache_key := get_results_cache_key(task_details)):
+        return
+    if get_results_cache_entry(cache_key, touch=False) is None and (
+        size := save_task_results_to_cache_dir(task_details, cache_key)
+    ):
+        for i in add_results_cache_entry(cache_key, task_details["outputs"], size):
+            remove_results_cache_dir(i)
+
+
+async def add_task_results_to_cache_async(task_details: dict) -> None:
+    if not options.TASKS_RESULTS_CACHE_SIZE or not (cache_key := get_results_cache_key(task_details)):
+        return
+    if await get_results_cache_entry_async(cache_key, touch=False) is None and (
+        size := save_task_results_to_cache_dir(task_details, cache_key)
+    ):
+        for i in await add_results_cache_entry_async(cache_key, task_details["outputs"], size):
+            remove_results_cache_dir(i)
+
+
+def get_results_cache_key(task_details: dict) -> str:
+    """Hash of the prepared flow with the task-specific file names replaced by the hashes of the input files.
+
+    Returns an empty string for the tasks which results can not be cached.
+    """
+    flow_comfy = task_details["flow_comfy"]
+    if get_ollama_nodes(flow_comfy) or get_google_nodes(flow_comfy):
+        return ""  # results of these nodes are not reproducible
+    input_files = {}
+    try:
+        for i in task_details["input_files"]:
+            input_files[i["file_name"]] = get_file_hash(os.path.join(options.TASKS_FILES_DIR, "input", i["file_name"]))
+    except OSError as e:
+        LOGGER.warning("Task %s: can not hash the input files: %s", task_details["task_id"], e)
+        return ""
+    outputs_nodes_ids = [str(i["comfy_node_id"]) for i in task_details["outputs"]]
+    nodes = {}
+    for node_id, node_details in flow_comfy.items():
+        nodes[node_id] = {
+            "class_type": node_details["class_type"],
+            "inputs": {
+                k: input_files.get(v, v) if isinstance(v, str) else v
+                for k, v in node_details.get("inputs", {}).items()
+                if not (k == "filename_prefix" and node_id in outputs_nodes_ids)
+            },
+        }
+    data = json.dumps([task_details["user_id"], task_details["name"], nodes], sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def get_results_cache_dir(cache_key: str) -> str:
+    return os.path.join(options.TASKS_FILES_DIR, "results_cache", cache_key)
+
+
+def save_task_results_to_cache_dir(task_details: dict, cache_key: str) -> int:
+    """Links the result files of the task into the cache directory. Returns their size, or 0 on failure."""
+    cache_dir = get_results_cache_dir(cache_key)
+    output_dir = os.path.join(options.TASKS_FILES_DIR, "output")
+    task_file_prefix = f"{task_details['task_id']}_"
+    size = 0
+    try:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.makedirs(cache_dir)
+        for filename in os.listdir(output_dir):
+            if filename.startswith(task_file_prefix):
+                cached_file = os.path.join(cache_dir, filename[len(task_file_prefix) :])
+                link_or_copy_file(os.path.join(output_dir, filename), cached_file)
+                size += os.path.getsize(cached_file)
+    except OSError as e:
+        LOGGER.warning("Task %s: can not save results to the cache: %s", task_details["task_id"], e)
+        size = 0
+    if not size:
+        remove_results_cache_dir(cache_key)
+    return size
+
+
+def remove_results_cache_dir(cache_key: str) -> None:
+    shutil.rmtree(get_results_cache_dir(cache_key), ignore_errors=True)
+
+
+def __fill_task_from_results_cache(task_details: dict, cache_key: str, outputs: list[dict] | None) -> bool:
+    task_id = task_details["task_id"]
+    if outputs is not None:
+        output_dir = os.path.join(options.TASKS_FILES_DIR, "output")
+        cache_dir = get_results_cache_dir(cache_key)
+        try:
+            for filename in os.listdir(cache_dir):
+                link_or_copy_file(os.path.join(cache_dir, filename), os.path.join(output_dir, f"{task_id}_{filename}"))
+        except OSError as e:
+            LOGGER.warning("Task %s: can not use the cached results `%s`: %s", task_id, cache_key, e)
+            for filename in os.listdir(output_dir):
+                if filename.startswith(f"{task_id}_"):
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(os.path.join(output_dir, filename))
+            outputs = None
+    if outputs is None:
+        increment_metric("results_cache_misses")
+        return False
+    increment_metric("results_cache_hits")
+    LOGGER.info("Task %s: completed with the cached results.", task_id)
+    finished_at = datetime.now(timezone.utc)
+    task_details.update(
+        {
+            "outputs": deepcopy(outputs),
+            "progress": 100.0,
+            "state": "finished",
+            "updated_at": finished_at,
+            "finished_at": finished_at,
+        }
+    )
+    return True
@@ -13,6 +13,7 @@ from fastapi import (
 )
 
 from .. import comfyui, options
+from ..metrics import get_metrics
 from ..prompt_translation import (
     translate_prompt_with_gemini,
     translate_prompt_with_ollama,
@@ -78,6 +79,33 @@ async def shutdown_server(request: Request, b_tasks: BackgroundTasks):
     b_tasks.add_task(__shutdown_vix)
 
 
+@ROUTER.get(
+    "/metrics",
+    responses={
+        200: {
+            "description": "Counters of the current process",
+            "content": {"application/json": {"example": {"tasks_preempted": 2, "tasks_preempted_lost_seconds": 31.5}}},
+        },
+        401: {
+            "description": "Unauthorized - Admin privilege required",
+            "content": {"application/json": {"example": {"detail": "Admin privilege required"}}},
+        },
+    },
+)
+async def metrics(request: Request) -> dict[str, float]:
+    """
+    Returns the internal counters of the tasks engine, accumulated since the start of the process.
+    In the SERVER mode with multiple `VIX_SERVER_WORKERS`, each process has its own counters.
+
+    * `tasks_preempted` - number of running tasks returned to the queue for tasks with a higher priority.
+    * `tasks_preempted_lost_seconds` - execution time of the preempted tasks, that will have to be redone.
+
+    Counters that have not yet been incremented are absent. Requires administrative privileges.
+    """
+    require_admin(request)
+    return get_metrics()
+
+
 @ROUTER.get("/whoami")
 async def whoami(request: Request) -> UserInfo:
     """Returns information about the currently authenticated user."""
@@ -2,16 +2,13 @@ import builtins
 import json
 import logging
 import os
-import shutil
 import typing
+from datetime import datetime, timezone
 from io import BytesIO
-from pathlib import Path
 from zipfile import ZipFile
 
-import httpx
 from fastapi import (
     APIRouter,
-    BackgroundTasks,
     Body,
     Form,
     HTTPException,
@@ -21,6 +18,7 @@ from fastapi import (
     responses,
     status,
 )
+from pydantic import ValidationError
 
 from .. import etc, options
 from ..db_queries import get_setting
@@ -38,107 +36,148 @@ from ..prompt_translation import (
     translate_prompt_with_ollama,
     translate_prompt_with_ollama_async,
 )
+from ..prompt_validation import validate_prompt_async
 from ..pydantic_models import (
+    TaskCreateRequest,
     TaskRunResults,
+    TasksChanges,
     TaskUpdateRequest,
     TranslatePromptRequest,
     UserInfo,
-    WorkerDetailsRequest,
+)
+from ..results_cache import (
+    fill_task_from_results_cache,
+    fill_task_from_results_cache_async,
 )
 from ..tasks_engine import (
     TaskDetails,
     TaskDetailsShort,
-    collect_child_task_ids,
-    create_new_task,
-    get_incomplete_task_without_error_database,
+    create_new_tasks,
     get_task,
     get_task_files,
     get_tasks,
+    get_tasks_changes,
     get_tasks_short,
-    put_task_in_queue,
+    put_tasks_in_queue,
+    remove_finished_tasks_by_name_and_group,
     remove_task_by_id_database,
-    remove_task_files,
     remove_task_lock_database,
+    remove_tasks_files,
     remove_unfinished_task_by_id,
     remove_unfinished_tasks_by_name_and_group,
     task_restart_database,
     update_task_info_database,
-    update_task_outputs,
-    update_task_progress_database,
 )
 from ..tasks_engine_async import (
-    create_new_task_async,
-    get_incomplete_task_without_error_database_async,
+    create_new_tasks_async,
     get_task_async,
     get_tasks_async,
+    get_tasks_changes_async,
     get_tasks_short_async,
-    put_task_in_queue_async,
+    put_tasks_in_queue_async,
     task_restart_database_async,
     update_task_info_database_async,
-    update_task_outputs_async,
-    update_task_progress_database_async,
 )
+from ..tasks_engine_etc import (
+    TASK_DETAILS_COLUMNS_FILES,
+    TASK_DETAILS_COLUMNS_OWNER,
+    TASK_DETAILS_OPTIONAL_FIELDS,
+    init_new_task_details,
+)
+from ..webhooks import enqueue_task_webhook
 
 LOGGER = logging.getLogger("visionatrix")
 ROUTER = APIRouter(prefix="/tasks", tags=["tasks"])
-VALIDATE_PROMPT: typing.Callable[[dict], tuple[bool, dict, list, list]] | None = None
 
 
-async def __task_run(
-    name: str,
-    input_params: dict,
-    translated_input_params: dict,
+async def __prepare_tasks(
+    tasks_ids: list[int],
+    task_create: TaskCreateRequest,
     in_files: list[UploadFile | dict],
     flow: Flow,
     flow_comfy: dict,
+    translated_input_params: dict,
     user_info: UserInfo,
-    webhook_url: str | None,
-    webhook_headers: dict | None,
-    child_task: bool,
-    group_scope: int,
-    priority: int,
-):
-    if options.VIX_MODE == "SERVER":
-        task_details = await create_new_task_async(name, input_params, user_info)
-    else:
-        task_details = create_new_task(name, input_params, user_info)
-    input_params_copy = input_params.copy()
-    for i, v in translated_input_params.items():
-        input_params_copy[i] = v
-    try:
-        flow_comfy = prepare_flow_comfy(flow, flow_comfy, input_params_copy, in_files, task_details)
-    except RuntimeError as e:
-        remove_task_files(task_details["task_id"], ["input"])
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)) from None
-
-    flow_validation: [bool, dict, list, list] = VALIDATE_PROMPT(flow_comfy)
-    if not flow_validation[0]:
-        remove_task_files(task_details["task_id"], ["input"])
-        LOGGER.error("Flow validation error: %s\n%s", flow_validation[1], flow_validation[3])
+) -> list[dict]:
+    """Prepares the details of the tasks that differ only in the seed, the graph is validated only once."""
+    if task_create.child_task and (not in_files or not isinstance(in_files[0], dict)):
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail=f"Bad Flow: `{flow_validation[1]}`"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No input file provided. A child task can only be created from the node ID of the parent task.",
         ) from None
-    task_details["flow_comfy"] = flow_comfy
-    task_details["webhook_url"] = webhook_url
-    task_details["webhook_headers"] = webhook_headers
-    if child_task:
-        if not in_files or not isinstance(in_files[0], dict):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="No input file provided. A child task can only be created from the node ID of the parent task.",
-            ) from None
-        task_details["parent_task_id"] = in_files[0]["task_id"]
-        task_details["parent_task_node_id"] = in_files[0]["node_id"]
-    task_details["group_scope"] = group_scope
-    task_details["priority"] = ((group_scope - 1) << 4) + priority
-    if translated_input_params:
-        task_details["translated_input_params"] = translated_input_params
-    flow_prepare_output_params(flow_validation[2], task_details["task_id"], task_details, flow_comfy)
+    input_params = task_create.input_params.copy()
+    if "seed" in input_params:
+        input_params["seed"] = int(input_params["seed"])
+    flow_validation: [bool, dict, list, list] | None = None
+    tasks_details = []
+    for task_id in tasks_ids:
+        task_details = init_new_task_details(task_id, task_create.name, input_params.copy(), user_info)
+        input_params_copy = input_params.copy()
+        for i, v in translated_input_params.items():
+            input_params_copy[i] = v
+        try:
+            task_flow_comfy = prepare_flow_comfy(flow, flow_comfy, input_params_copy, in_files, task_details)
+        except RuntimeError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)) from None
+        if flow_validation is None:
+            flow_validation = await validate_prompt_async(
+                flow, task_flow_comfy, [i["file_name"] for i in task_details["input_files"]]
+            )
+            if not flow_validation[0]:
+                LOGGER.error("Flow validation error: %s\n%s", flow_validation[1], flow_validation[3])
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST, detail=f"Bad Flow: `{flow_validation[1]}`"
+                ) from None
+            # the next tasks use the same files, already saved for the first task
+            in_files = [
+                i if isinstance(i, dict) else {"task_id": task_id, "input_index": j} for j, i in enumerate(in_files)
+            ]
+        task_details["flow_comfy"] = task_flow_comfy
+        task_details["webhook_url"] = task_create.webhook_url
+        task_details["webhook_headers"] = task_create.webhook_headers
+        if task_create.child_task:
+            task_details["parent_task_id"] = in_files[0]["task_id"]
+            task_details["parent_task_node_id"] = in_files[0]["node_id"]
+        task_details["group_scope"] = task_create.group_scope
+        task_details["priority"] = ((task_create.group_scope - 1) << 4) + task_create.priority
+        task_details["max_execution_time"] = task_create.max_execution_time or None
+        if translated_input_params:
+            task_details["translated_input_params"] = translated_input_params
+        flow_prepare_output_params(flow_validation[2], task_id, task_details, task_flow_comfy)
+        tasks_details.append(task_details)
+        if "seed" in input_params:
+            input_params["seed"] = input_params["seed"] + 1
+    return tasks_details
+
+
+async def __create_new_tasks(count: int) -> list[int]:
+    if options.VIX_MODE == "SERVER":
+        return await create_new_tasks_async(count)
+    return create_new_tasks(count)
+
+
+async def __put_tasks_in_queue(tasks_details: list[dict]) -> None:
     if options.VIX_MODE == "SERVER":
-        await put_task_in_queue_async(task_details)
+        from_cache = [await fill_task_from_results_cache_async(i) for i in tasks_details]
+        await put_tasks_in_queue_async(tasks_details)
     else:
-        put_task_in_queue(task_details)
-    return task_details
+        from_cache = [fill_task_from_results_cache(i) for i in tasks_details]
+        put_tasks_in_queue(tasks_details)
+    for task_details, is_from_cache in zip(tasks_details, from_cache, strict=True):
+        if is_from_cache and task_details["webhook_url"]:
+            enqueue_task_webhook(
+                task_details["webhook_url"], task_details["webhook_headers"], task_details["task_id"], 100.0, 0.0, ""
+            )
+
+
+def __check_input_file_reference(input_file_info: dict, user_id: str) -> None:
+    if "task_id" not in input_file_info:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Missing `task_id` parameter") from None
+    if not get_task(int(input_file_info["task_id"]), user_id, columns=TASK_DETAILS_COLUMNS_OWNER):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Missing task with id={input_file_info['task_id']}",
+        ) from None
 
 
 async def __get_translated_input_params(
@@ -202,11 +241,20 @@ async def create_task(
         description="Task execution priority. Higher numbers indicate higher priority. Maximum value is 15.",
     ),
     translate: int = Form(0, description="Should the prompt be translated if auto-translation option is enabled."),
+    max_execution_time: float = Form(
+        0.0,
+        description="Time in seconds after which the task execution is interrupted and the task is failed. "
+        "When not set, and `TASKS_MAX_EXECUTION_TIME_FACTOR` is enabled, the limit is calculated from "
+        "the execution time of the previous tasks of the flow.",
+    ),
     files: list[UploadFile | str] = Form(None, description="List of input files for flow"),  # noqa
 ) -> TaskRunResults:
     """
     Endpoint to initiate the creation and execution of tasks within the Vix workflow environment,
     handling both file inputs and task-related parameters.
+
+    When the results cache is enabled and the same task of the user was already finished, the task is created
+    as finished with the cached results.
     """
 
     if group_scope < 1 or group_scope > 255:
@@ -217,6 +265,9 @@ async def create_task(
     if priority > 15:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Priority cannot be greater than 15.")
 
+    if max_execution_time < 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Max execution time cannot be negative.")
+
     user_id = request.scope["user_info"].user_id
     is_user_admin = request.scope["user_info"].is_admin
     in_files = []
@@ -228,15 +279,7 @@ async def create_task(
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid files input:{i}"
                 ) from None
-            if "task_id" not in input_file_info:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST, detail="Missing `task_id` parameter"
-                ) from None
-            if not get_task(int(input_file_info["task_id"]), user_id):
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Missing task with id={input_file_info['task_id']}",
-                ) from None
+            __check_input_file_reference(input_file_info, user_id)
             in_files.append(input_file_info)
         else:
             in_files.append(i)
@@ -244,8 +287,21 @@ async def create_task(
         input_params_dict = json.loads(input_params) if input_params else {}
     except json.JSONDecodeError:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid JSON format for params") from None
-    if "seed" in input_params_dict:
-        input_params_dict["seed"] = int(input_params_dict["seed"])
+    try:
+        task_create = TaskCreateRequest(
+            name=name,
+            count=count,
+            input_params=input_params_dict,
+            webhook_url=webhook_url,
+            webhook_headers=json.loads(webhook_headers) if webhook_headers else None,
+            child_task=bool(child_task),
+            group_scope=group_scope,
+            priority=priority,
+            translate=bool(translate),
+            max_execution_time=max_execution_time,
+        )
+    except ValidationError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Data validation error: {e}") from None
 
     flow_comfy = {}
     flow = get_installed_flow(name, flow_comfy)
@@ -255,30 +311,88 @@ async def create_task(
     translated_input_params_dict = await __get_translated_input_params(
         bool(translate), flow, input_params_dict, flow_comfy, user_id, is_user_admin
     )
-    tasks_ids = []
-    webhook_headers_dict = json.loads(webhook_headers) if webhook_headers else None
-    for _ in range(count):
-        task_details = await __task_run(
-            name,
-            input_params_dict,
-            translated_input_params_dict,
+    tasks_ids = await __create_new_tasks(count)
+    try:
+        tasks_details = await __prepare_tasks(
+            tasks_ids,
+            task_create,
             in_files,
             flow,
             flow_comfy,
+            translated_input_params_dict,
             request.scope["user_info"],
-            webhook_url,
-            webhook_headers_dict,
-            bool(child_task),
-            group_scope,
-            priority,
         )
-        tasks_ids.append(task_details["task_id"])
-        if "seed" in input_params_dict:
-            input_params_dict["seed"] = input_params_dict["seed"] + 1
+    except HTTPException:
+        remove_tasks_files(tasks_ids, ["input"])
+        raise
+    await __put_tasks_in_queue(tasks_details)
+    return TaskRunResults(tasks_ids=tasks_ids)
+
+
+@ROUTER.put("/create-batch")
+async def create_tasks_batch(
+    request: Request,
+    tasks: list[TaskCreateRequest] = Body(..., description="List of the tasks to create"),
+) -> TaskRunResults:
+    """
+    Creates tasks of different flows or with different parameters with a single request.
+
+    Tasks are added to the queue in one transaction: either all of them are created or none.
+    Only files of the other tasks can be used as input files. IDs of the tasks are returned in the order of the
+    requested tasks, each repeated `count` times.
+    """
+    user_info = request.scope["user_info"]
+    tasks_to_prepare = []
+    for task_create in tasks:
+        for input_file_info in task_create.files:
+            __check_input_file_reference(input_file_info, user_info.user_id)
+        flow_comfy = {}
+        flow = get_installed_flow(task_create.name, flow_comfy)
+        if not flow:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail=f"Flow `{task_create.name}` is not installed."
+            ) from None
+        translated_input_params_dict = await __get_translated_input_params(
+            task_create.translate, flow, task_create.input_params, flow_comfy, user_info.user_id, user_info.is_admin
+        )
+        tasks_to_prepare.append((task_create, flow, flow_comfy, translated_input_params_dict))
+    tasks_ids = await __create_new_tasks(sum(i.count for i in tasks))
+    tasks_details = []
     try:
-        return TaskRunResults.model_validate({"tasks_ids": tasks_ids})
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Data validation error: {e}") from None
+        for task_create, flow, flow_comfy, translated_input_params_dict in tasks_to_prepare:
+            tasks_details += await __prepare_tasks(
+                tasks_ids[len(tasks_details) : len(tasks_details) + task_create.count],
+                task_create,
+                task_create.files,
+                flow,
+                flow_comfy,
+                translated_input_params_dict,
+                user_info,
+            )
+    except HTTPException:
+        remove_tasks_files(tasks_ids, ["input"])
+        raise
+    await __put_tasks_in_queue(tasks_details)
+    return TaskRunResults(tasks_ids=tasks_ids)
+
+
+def __get_tasks_order(
+    order_by: str, descending: bool, last_task_id: int | None, last_updated_at: datetime | None
+) -> tuple[str, tuple | None]:
+    """Returns the sort order and the keyset cursor for the `get_tasks_query`."""
+    order = ("-" if descending else "") + order_by
+    if last_task_id is None:
+        return order, None
+    if order_by != "updated_at":
+        return order, (last_task_id,)
+    if last_updated_at is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="`last_updated_at` of the last task should be set when sorting by `updated_at`.",
+        )
+    if last_updated_at.tzinfo is not None:
+        last_updated_at = last_updated_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return order, (last_updated_at, last_task_id)
 
 
 @ROUTER.get("/progress")
@@ -287,11 +401,30 @@ async def get_tasks_progress(
     name: str = Query(None, description="Optional name to filter tasks by their name"),
     group_scope: int = Query(1, description="Optional parameter to filter tasks by their group number"),
     only_parent: bool = Query(False, description="Fetch only parent tasks"),
+    finished: bool | None = Query(None, description="Optional filter: only finished or only unfinished tasks"),
+    state: typing.Literal["queued", "running", "finished", "failed"] | None = Query(
+        None, description="Optional filter by the state of the tasks"
+    ),
+    order_by: typing.Literal["task_id", "updated_at"] = Query("task_id", description="Field to sort the tasks by"),
+    descending: bool = Query(False, description="Return the newest(or the most recently updated) tasks first"),
+    last_task_id: int | None = Query(None, description="ID of the last task of the previous page"),
+    last_updated_at: datetime | None = Query(
+        None, description="`updated_at`(or `created_at` if not set) of the last task of the previous page"
+    ),
+    limit: int = Query(0, ge=0, description="Maximum number of tasks to return, `0` for no limit"),
+    fields: list[typing.Literal[TASK_DETAILS_OPTIONAL_FIELDS]] | None = Query(
+        None, description="Large JSON fields to return, others are returned empty. By default all fields are returned"
+    ),
 ) -> dict[int, TaskDetails]:
     """
     Retrieves the full tasks details information for a specific user.
-    Optionally filter tasks by their name or a group number.
+    Optionally filter tasks by their name, a group number, or the state.
+
+    Tasks are sorted by their ID, or by the time of their last change. To get the tasks page by page, set `limit`
+    and pass the ID of the last task of the previous page in `last_task_id`, and when sorted by `updated_at`,
+    also its `updated_at`(or `created_at` if the task was not updated) in `last_updated_at`.
     """
+    order_by, cursor = __get_tasks_order(order_by, descending, last_task_id, last_updated_at)
     if options.VIX_MODE == "SERVER":
         r = await get_tasks_async(
             name=name,
@@ -299,6 +432,12 @@ async def get_tasks_progress(
             user_id=request.scope["user_info"].user_id,
             fetch_child=True,
             only_parent=only_parent,
+            finished=finished,
+            state=state,
+            cursor=cursor,
+            limit=limit,
+            order_by=order_by,
+            fields=fields,
         )
     else:
         r = get_tasks(
@@ -307,6 +446,12 @@ async def get_tasks_progress(
             user_id=request.scope["user_info"].user_id,
             fetch_child=True,
             only_parent=only_parent,
+            finished=finished,
+            state=state,
+            cursor=cursor,
+            limit=limit,
+            order_by=order_by,
+            fields=fields,
         )
     return r
 
@@ -317,11 +462,28 @@ async def get_tasks_progress_summary(
     name: str = Query(None, description="Optional name to filter tasks by their name"),
     group_scope: int = Query(1, description="Optional parameter to filter tasks by their group number"),
     only_parent: bool = Query(False, description="Fetch only parent tasks"),
+    finished: bool | None = Query(None, description="Optional filter: only finished or only unfinished tasks"),
+    state: typing.Literal["queued", "running", "finished", "failed"] | None = Query(
+        None, description="Optional filter by the state of the tasks"
+    ),
+    order_by: typing.Literal["task_id", "updated_at"] = Query("task_id", description="Field to sort the tasks by"),
+    descending: bool = Query(False, description="Return the newest(or the most recently updated) tasks first"),
+    last_task_id: int | None = Query(None, description="ID of the last task of the previous page"),
+    last_updated_at: datetime | None = Query(
+        None, description="`updated_at`(or `created_at` if not set) of the last task of the previous page"
+    ),
+    limit: int = Query(0, ge=0, description="Maximum number of tasks to return, `0` for no limit"),
+    fields: list[typing.Literal[TASK_DETAILS_OPTIONAL_FIELDS]] | None = Query(
+        None, description="Large JSON fields to return, others are returned empty. By default all fields are returned"
+    ),
 ) -> dict[int, TaskDetailsShort]:
     """
     Retrieves summary of the tasks progress details for a specific user.
-    Optionally filter tasks by their name or a group number.
+    Optionally filter tasks by their name, a group number, or the state.
+
+    Tasks are sorted and paginated the same way as by `/progress`.
     """
+    order_by, cursor = __get_tasks_order(order_by, descending, last_task_id, last_updated_at)
     if options.VIX_MODE == "SERVER":
         r = await get_tasks_short_async(
             name=name,
@@ -329,6 +491,12 @@ async def get_tasks_progress_summary(
             user_id=request.scope["user_info"].user_id,
             fetch_child=True,
             only_parent=only_parent,
+            finished=finished,
+            state=state,
+            cursor=cursor,
+            limit=limit,
+            order_by=order_by,
+            fields=fields,
         )
     else:
         r = get_tasks_short(
@@ -337,10 +505,37 @@ async def get_tasks_progress_summary(
             user_id=request.scope["user_info"].user_id,
             fetch_child=True,
             only_parent=only_parent,
+            finished=finished,
+            state=state,
+            cursor=cursor,
+            limit=limit,
+            order_by=order_by,
+            fields=fields,
         )
     return r
 
 
+@ROUTER.get("/progress-changes")
+async def get_tasks_progress_changes(
+    request: Request,
+    since: datetime | None = Query(None, description="`cursor` from the previous response, UTC if without timezone"),
+    name: str = Query(None, description="Optional name to filter tasks by their name"),
+    group_scope: int = Query(1, description="Optional parameter to filter tasks by their group number"),
+) -> TasksChanges:
+    """
+    Retrieves the tasks of a specific user that were created, changed or removed since the previous request.
+    Optionally filter tasks by their name or a group number.
+
+    Without `since`, or when `since` is older than TASKS_TOMBSTONES_MAX_AGE, all tasks are returned with `reset`
+    set. Child tasks are returned as separate tasks. A task can be returned by two consecutive requests.
+    """
+    if since is not None and since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    if options.VIX_MODE == "SERVER":
+        return await get_tasks_changes_async(request.scope["user_info"].user_id, since, name, group_scope)
+    return get_tasks_changes(request.scope["user_info"].user_id, since, name, group_scope)
+
+
 @ROUTER.get("/progress/{task_id}")
 async def get_task_progress(request: Request, task_id: int) -> TaskDetails:
     """
@@ -401,9 +596,9 @@ async def restart_task(
     Access to this action is restricted to the task's owner or an administrator.
     """
     if options.VIX_MODE == "SERVER":
-        r = await get_task_async(task_id, request.scope["user_info"].user_id)
+        r = await get_task_async(task_id, request.scope["user_info"].user_id, columns=TASK_DETAILS_COLUMNS_OWNER)
     else:
-        r = get_task(task_id, request.scope["user_info"].user_id)
+        r = get_task(task_id, request.scope["user_info"].user_id, columns=TASK_DETAILS_COLUMNS_OWNER)
     if r is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
     if r["progress"] == 100.0:
@@ -437,16 +632,14 @@ async def delete_task(request: Request, task_id: int = Query(..., description="I
     Also removes any child tasks associated with the specified task.
     """
     if options.VIX_MODE == "SERVER":
-        r = await get_task_async(task_id, fetch_child=True)
+        r = await get_task_async(task_id, columns=TASK_DETAILS_COLUMNS_OWNER)
     else:
-        r = get_task(task_id, fetch_child=True)
+        r = get_task(task_id, columns=TASK_DETAILS_COLUMNS_OWNER)
     if r is None:
         raise HTTPException(status_code=404, detail=f"Task `{task_id}` was not found.")
     if r["user_id"] != request.scope["user_info"].user_id and not request.scope["user_info"].is_admin:
         raise HTTPException(status_code=404, detail=f"Task `{task_id}` was not found.")
-    task_ids_to_remove = [task_id]
-    collect_child_task_ids(r, task_ids_to_remove)
-    remove_task_by_id_database(task_ids_to_remove)
+    remove_task_by_id_database([task_id])
 
 
 @ROUTER.delete(
@@ -469,29 +662,7 @@ async def clear_tasks(
     scoped to the requesting user and group scope.
     All child tasks associated with the parent tasks will also be deleted.
     """
-    if options.VIX_MODE == "SERVER":
-        r = await get_tasks_async(
-            name,
-            group_scope,
-            True,
-            request.scope["user_info"].user_id,
-            fetch_child=True,
-            only_parent=True,
-        )
-    else:
-        r = get_tasks(
-            name,
-            group_scope,
-            True,
-            request.scope["user_info"].user_id,
-            fetch_child=True,
-            only_parent=True,
-        )
-    task_ids_to_remove = []
-    for task_id, task_details in r.items():
-        task_ids_to_remove.append(task_id)
-        collect_child_task_ids(task_details, task_ids_to_remove)
-    remove_task_by_id_database(task_ids_to_remove)
+    remove_finished_tasks_by_name_and_group(name, request.scope["user_info"].user_id, group_scope)
 
 
 @ROUTER.get(
@@ -521,9 +692,9 @@ async def get_task_inputs(
     Administrators can access inputs of any task, while regular users can only access inputs of their own tasks.
     """
     if options.VIX_MODE == "SERVER":
-        r = await get_task_async(task_id)
+        r = await get_task_async(task_id, columns=TASK_DETAILS_COLUMNS_FILES)
     else:
-        r = get_task(task_id)
+        r = get_task(task_id, columns=TASK_DETAILS_COLUMNS_FILES)
     if r is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
     if r["user_id"] != request.scope["user_info"].user_id and not request.scope["user_info"].is_admin:
@@ -582,9 +753,9 @@ async def get_task_results(
     - HTTPException: If the task or result file is not found.
     """
     if options.VIX_MODE == "SERVER":
-        r = await get_task_async(task_id, request.scope["user_info"].user_id)
+        r = await get_task_async(task_id, request.scope["user_info"].user_id, columns=TASK_DETAILS_COLUMNS_FILES)
     else:
-        r = get_task(task_id, request.scope["user_info"].user_id)
+        r = get_task(task_id, request.scope["user_info"].user_id, columns=TASK_DETAILS_COLUMNS_FILES)
     if r is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
     result_prefix = f"{task_id}_{node_id}_"
@@ -667,216 +838,11 @@ async def remove_task_from_queue(request: Request, task_id: int):
     """
     Removes a specific unfinished task from the queue using the task ID.
     """
-    if get_task(task_id, request.scope["user_info"].user_id) is None:
+    if get_task(task_id, request.scope["user_info"].user_id, columns=TASK_DETAILS_COLUMNS_OWNER) is None:
         raise HTTPException(status_code=404, detail=f"Task `{task_id}` was not found.")
     remove_unfinished_task_by_id(task_id)
 
 
-@ROUTER.post(
-    "/next",
-    responses={
-        200: {
-            "description": "Successfully retrieved the task for the worker",
-        },
-        204: {
-            "description": "No incomplete tasks available for the worker",
-        },
-    },
-)
-async def get_next_task(
-    request: Request,
-    worker_details: WorkerDetailsRequest = Body(...),
-    tasks_names: list[str] = Body(..., description="List of task names the worker can handle"),
-    last_task_name: str = Body("", description="Optional name of the last task the worker was working on"),
-):
-    """
-    Retrieves an incomplete task for a `worker` to process. Workers provide a list of tasks names they can handle
-    and optionally the name of the last task they were working on to prioritize similar types of tasks. If a
-    worker is associated with an admin account, it can retrieve tasks regardless of user assignment; otherwise,
-    it retrieves only those assigned to the user.
-    """
-    user_id = None if request.scope["user_info"].is_admin else request.scope["user_info"].user_id
-    if options.VIX_MODE == "SERVER":
-        task = await get_incomplete_task_without_error_database_async(
-            request.scope["user_info"].user_id, worker_details, tasks_names, last_task_name, user_id
-        )
-    else:
-        task = get_incomplete_task_without_error_database(
-            request.scope["user_info"].user_id, worker_details, tasks_names, last_task_name, user_id
-        )
-    if not task:
-        return responses.Response(status_code=status.HTTP_204_NO_CONTENT)
-    return task
-
-
-async def __webhook_task_progress(
-    url: str, headers: dict | None, task_id: int, progress: float, execution_time: float, error: str
-) -> None:
-    try:
-        async with httpx.AsyncClient(base_url=url, timeout=3.0) as client:
-            await client.post(
-                url="task-progress",
-                json={
-                    "task_id": task_id,
-                    "progress": progress,
-                    "execution_time": execution_time,
-                    "error": error,
-                },
-                headers=headers,
-            )
-    except httpx.RequestError as e:
-        LOGGER.exception("Exception during calling webhook %s, progress=%s: %s", url, progress, e)
-
-
-@ROUTER.put(
-    "/progress",
-    response_class=responses.Response,
-    status_code=status.HTTP_204_NO_CONTENT,
-    responses={
-        204: {
-            "description": "Task progress updated successfully",
-        },
-        400: {
-            "description": "Failed to update task progress",
-            "content": {"application/json": {"example": {"detail": "Failed to update task progress."}}},
-        },
-        404: {
-            "description": "Task not found or not authorized",
-            "content": {"application/json": {"example": {"detail": "Task `{task_id}` was not found."}}},
-        },
-    },
-)
-async def update_task_progress(
-    b_tasks: BackgroundTasks,
-    request: Request,
-    worker_details: WorkerDetailsRequest = Body(...),
-    task_id: int = Body(..., description="ID of the task to update progress for"),
-    progress: float = Body(..., description="Progress percentage of the task"),
-    execution_time: float = Body(..., description="Execution time of the task in seconds"),
-    error: str = Body("", description="Error message if any"),
-):
-    """
-    Updates the progress of a specific task identified by `task_id`. This endpoint checks if the task exists
-    and if the requester is authorized to update its progress. If the task is not found or unauthorized,
-    a 404 HTTP error is raised, and `worker` should stop and consider the task canceled.
-    """
-    if options.VIX_MODE == "SERVER":
-        r = await get_task_async(task_id)
-    else:
-        r = get_task(task_id)
-    if r is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
-    if r["user_id"] != request.scope["user_info"].user_id and not request.scope["user_info"].is_admin:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
-    if options.VIX_MODE == "SERVER":
-        update_success = await update_task_progress_database_async(
-            task_id, progress, error, execution_time, request.scope["user_info"].user_id, worker_details
-        )
-    else:
-        update_success = update_task_progress_database(
-            task_id, progress, error, execution_time, request.scope["user_info"].user_id, worker_details
-        )
-    if not update_success:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Failed to update task progress.")
-    if r["webhook_url"]:
-        b_tasks.add_task(
-            __webhook_task_progress, r["webhook_url"], r["webhook_headers"], task_id, progress, execution_time, error
-        )
-
-
-@ROUTER.put(
-    "/results",
-    response_class=responses.Response,
-    status_code=status.HTTP_204_NO_CONTENT,
-    responses={
-        204: {"description": "Successfully saved task results"},
-        404: {
-            "description": "Task not found",
-            "content": {"application/json": {"example": {"detail": "Task `{task_id}` was not found."}}},
-        },
-        400: {
-            "description": "Bad request",
-            "content": {"application/json": {"example": {"detail": "result_file.filename does not belong to task."}}},
-        },
-    },
-)
-async def set_task_results(
-    request: Request,
-    task_id: int = Query(..., description="The ID of the task to save results for"),
-    files: list[UploadFile] = Form(..., description="List of result files to save"),  # noqa
-):
-    """
-    Saves the result files for a specific task on the server. This endpoint checks if the task exists
-    and if the `worker` making the request has the authorization to upload results.
-    If the task is not found or unauthorized, a 404 HTTP error is raised.
-    """
-    if options.VIX_MODE == "SERVER":
-        task_details = await get_task_async(task_id)
-    else:
-        task_details = get_task(task_id)
-    if task_details is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
-    if task_details["user_id"] != request.scope["user_info"].user_id and not request.scope["user_info"].is_admin:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
-    output_directory = os.path.join(options.TASKS_FILES_DIR, "output")
-    for task_output in task_details["outputs"]:
-        task_file_prefix = f"{task_id}_{task_output['comfy_node_id']}_"
-        relevant_files = [file_info for file_info in files if file_info.filename.startswith(task_file_prefix)]
-        if not relevant_files:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"No results found for: {task_file_prefix}",
-            )
-        file_size = 0
-        batch_size = 0
-        for i in relevant_files:
-            file_size += i.size
-            batch_size += 1
-            try:
-                file_path = Path(output_directory).joinpath(i.filename)
-                with builtins.open(file_path, mode="wb") as out_file:
-                    shutil.copyfileobj(i.file, out_file)
-            finally:
-                i.file.close()
-        task_output["file_size"] = file_size
-        task_output["batch_size"] = batch_size
-    if options.VIX_MODE == "SERVER":
-        await update_task_outputs_async(task_id, task_details["outputs"])
-    else:
-        update_task_outputs(task_id, task_details["outputs"])
-
-
-@ROUTER.delete(
-    "/lock",
-    response_class=responses.Response,
-    status_code=status.HTTP_204_NO_CONTENT,
-    responses={
-        204: {"description": "Successfully removed task lock"},
-        404: {
-            "description": "Task not found",
-            "content": {"application/json": {"example": {"detail": "Task `{task_id}` was not found."}}},
-        },
-    },
-)
-async def remove_task_lock(
-    request: Request, task_id: int = Query(..., description="The ID of the task to remove the lock from")
-):
-    """
-    Unlocks a task specified by the `task_id`. This endpoint checks if the task exists
-    and if the `worker` making the request has the authorization to unlock it.
-    If the task is not found or unauthorized, a 404 HTTP error is raised.
-    """
-    if options.VIX_MODE == "SERVER":
-        r = await get_task_async(task_id)
-    else:
-        r = get_task(task_id)
-    if r is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
-    if r["user_id"] != request.scope["user_info"].user_id and not request.scope["user_info"].is_admin:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
-    remove_task_lock_database(task_id)
-
-
 @ROUTER.put(
     "/update",
     response_class=responses.Response,
@@ -924,9 +890,9 @@ async def update_task_info(
     Access is restricted to the task owner or an administrator.
     """
     if options.VIX_MODE == "SERVER":
-        task = await get_task_async(task_id)
+        task = await get_task_async(task_id, columns=TASK_DETAILS_COLUMNS_OWNER)
     else:
-        task = get_task(task_id)
+        task = get_task(task_id, columns=TASK_DETAILS_COLUMNS_OWNER)
     if task is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
 
@@ -947,6 +913,7 @@ async def update_task_info(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Priority cannot be greater than 15.")
 
     update_fields["priority"] = ((task["group_scope"] - 1) << 4) + update_fields["priority"]
+    update_fields["aged_priority"] = update_fields["priority"]
 
     if options.VIX_MODE == "SERVER":
         success = await update_task_info_database_async(task_id, update_fields)
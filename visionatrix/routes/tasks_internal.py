@@ -0,0 +1,287 @@
+import builtins
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Body,
+    Form,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+    responses,
+    status,
+)
+
+from .. import options
+from ..db_queries import set_flow_vram_peak
+from ..db_queries_async import set_flow_vram_peak_async
+from ..pydantic_models import WorkerDetailsRequest
+from ..results_cache import add_task_results_to_cache, add_task_results_to_cache_async
+from ..tasks_engine import (
+    extend_tasks_locks_database,
+    get_incomplete_task_without_error_database,
+    get_task,
+    remove_task_lock_database,
+    update_task_outputs,
+    update_task_progress_database,
+)
+from ..tasks_engine_async import (
+    extend_tasks_locks_database_async,
+    get_incomplete_task_without_error_database_async,
+    get_task_async,
+    update_task_outputs_async,
+    update_task_progress_database_async,
+)
+from ..tasks_engine_etc import TASK_DETAILS_COLUMNS_FILES, TASK_DETAILS_COLUMNS_OWNER
+from ..tasks_events import get_queued_version, wait_for_queued_tasks_async
+from ..webhooks import enqueue_task_webhook
+
+LOGGER = logging.getLogger("visionatrix")
+ROUTER = APIRouter(prefix="/tasks", tags=["tasks"])
+
+
+@ROUTER.post(
+    "/next",
+    responses={
+        200: {
+            "description": "Successfully retrieved the task for the worker",
+        },
+        204: {
+            "description": "No incomplete tasks available for the worker",
+        },
+    },
+)
+async def get_next_task(
+    request: Request,
+    worker_details: WorkerDetailsRequest = Body(...),
+    tasks_names: list[str] = Body(..., description="List of task names the worker can handle"),
+    last_task_name: str = Body("", description="Optional name of the last task the worker was working on"),
+    wait_timeout: float = Body(
+        0.0, ge=0.0, le=60.0, description="Maximum time in seconds to wait for a task to appear, if there are none"
+    ),
+    loaded_models: list[str] = Body([], description="Names of the models that the worker currently holds in memory"),
+):
+    """
+    Retrieves an incomplete task for a `worker` to process. Workers provide a list of tasks names they can handle
+    and optionally the name of the last task they were working on to prioritize similar types of tasks. If a
+    worker is associated with an admin account, it can retrieve tasks regardless of user assignment; otherwise,
+    it retrieves only those assigned to the user.
+
+    When `wait_timeout` is specified and there is no task available, the request is held until a suitable
+    task is queued or the timeout expires (long polling), instead of returning `204` immediately.
+
+    Among the tasks with the same priority, tasks of flows that need the fewest models not listed
+    in `loaded_models` are given first, to reduce the time spent on loading models.
+    """
+    user_id = None if request.scope["user_info"].is_admin else request.scope["user_info"].user_id
+    wait_deadline = time.monotonic() + wait_timeout
+    claim_args = (worker_details, tasks_names, last_task_name, user_id, loaded_models)
+    while True:
+        queued_version = get_queued_version()
+        if options.VIX_MODE == "SERVER":
+            task = await get_incomplete_task_without_error_database_async(
+                request.scope["user_info"].user_id, *claim_args
+            )
+        else:
+            task = get_incomplete_task_without_error_database(request.scope["user_info"].user_id, *claim_args)
+        if task:
+            return task
+        time_left = wait_deadline - time.monotonic()
+        if time_left <= 0:
+            break
+        await wait_for_queued_tasks_async(queued_version, min(time_left, options.TASKS_NEXT_RECHECK_INTERVAL))
+        if await request.is_disconnected():
+            break
+    return responses.Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@ROUTER.put(
+    "/progress",
+    response_class=responses.Response,
+    status_code=status.HTTP_204_NO_CONTENT,
+    responses={
+        204: {
+            "description": "Task progress updated successfully",
+        },
+        400: {
+            "description": "Failed to update task progress",
+            "content": {"application/json": {"example": {"detail": "Failed to update task progress."}}},
+        },
+        404: {
+            "description": "Task not found or not authorized",
+            "content": {"application/json": {"example": {"detail": "Task `{task_id}` was not found."}}},
+        },
+    },
+)
+async def update_task_progress(
+    b_tasks: BackgroundTasks,
+    request: Request,
+    worker_details: WorkerDetailsRequest = Body(...),
+    task_id: int = Body(..., description="ID of the task to update progress for"),
+    progress: float = Body(..., description="Progress percentage of the task"),
+    execution_time: float = Body(..., description="Execution time of the task in seconds"),
+    error: str = Body("", description="Error message if any"),
+    vram_peak: int = Body(0, description="Peak VRAM usage in bytes measured during the task execution"),
+):
+    """
+    Updates the progress of a specific task identified by `task_id`. This endpoint checks if the task exists
+    and if the requester is authorized to update its progress. If the task is not found or unauthorized,
+    a 404 HTTP error is raised, and `worker` should stop and consider the task canceled.
+
+    The `vram_peak` of the finished task is remembered for its flow and used to give the flow's tasks
+    only to the workers with enough memory.
+    """
+    if options.VIX_MODE == "SERVER":
+        r = await get_task_async(task_id, columns=TASK_DETAILS_COLUMNS_OWNER)
+    else:
+        r = get_task(task_id, columns=TASK_DETAILS_COLUMNS_OWNER)
+    if r is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
+    if r["user_id"] != request.scope["user_info"].user_id and not request.scope["user_info"].is_admin:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
+    if options.VIX_MODE == "SERVER":
+        update_success = await update_task_progress_database_async(
+            task_id, progress, error, execution_time, request.scope["user_info"].user_id, worker_details
+        )
+    else:
+        update_success = update_task_progress_database(
+            task_id, progress, error, execution_time, request.scope["user_info"].user_id, worker_details
+        )
+    if not update_success:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Failed to update task progress.")
+    if progress == 100.0 and vram_peak:
+        if options.VIX_MODE == "SERVER":
+            await set_flow_vram_peak_async(r["name"], vram_peak)
+        else:
+            set_flow_vram_peak(r["name"], vram_peak)
+    if progress == 100.0 and not error and options.TASKS_RESULTS_CACHE_SIZE:
+        if options.VIX_MODE == "SERVER":
+            if finished_task_details := await get_task_async(task_id):
+                b_tasks.add_task(add_task_results_to_cache_async, finished_task_details)
+        elif finished_task_details := get_task(task_id):
+            b_tasks.add_task(add_task_results_to_cache, finished_task_details)
+    if r["webhook_url"]:
+        enqueue_task_webhook(r["webhook_url"], r["webhook_headers"], task_id, progress, execution_time, error)
+
+
+@ROUTER.put(
+    "/results",
+    response_class=responses.Response,
+    status_code=status.HTTP_204_NO_CONTENT,
+    responses={
+        204: {"description": "Successfully saved task results"},
+        404: {
+            "description": "Task not found",
+            "content": {"application/json": {"example": {"detail": "Task `{task_id}` was not found."}}},
+        },
+        400: {
+            "description": "Bad request",
+            "content": {"application/json": {"example": {"detail": "result_file.filename does not belong to task."}}},
+        },
+    },
+)
+async def set_task_results(
+    request: Request,
+    task_id: int = Query(..., description="The ID of the task to save results for"),
+    files: list[UploadFile] = Form(..., description="List of result files to save"),  # noqa
+):
+    """
+    Saves the result files for a specific task on the server. This endpoint checks if the task exists
+    and if the `worker` making the request has the authorization to upload results.
+    If the task is not found or unauthorized, a 404 HTTP error is raised.
+    """
+    if options.VIX_MODE == "SERVER":
+        task_details = await get_task_async(task_id, columns=TASK_DETAILS_COLUMNS_FILES)
+    else:
+        task_details = get_task(task_id, columns=TASK_DETAILS_COLUMNS_FILES)
+    if task_details is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
+    if task_details["user_id"] != request.scope["user_info"].user_id and not request.scope["user_info"].is_admin:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
+    output_directory = os.path.join(options.TASKS_FILES_DIR, "output")
+    for task_output in task_details["outputs"]:
+        task_file_prefix = f"{task_id}_{task_output['comfy_node_id']}_"
+        relevant_files = [file_info for file_info in files if file_info.filename.startswith(task_file_prefix)]
+        if not relevant_files:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"No results found for: {task_file_prefix}",
+            )
+        file_size = 0
+        batch_size = 0
+        for i in relevant_files:
+            file_size += i.size
+            batch_size += 1
+            try:
+                file_path = Path(output_directory).joinpath(i.filename)
+                with builtins.open(file_path, mode="wb") as out_file:
+                    shutil.copyfileobj(i.file, out_file)
+            finally:
+                i.file.close()
+        task_output["file_size"] = file_size
+        task_output["batch_size"] = batch_size
+    if options.VIX_MODE == "SERVER":
+        await update_task_outputs_async(task_id, task_details["outputs"])
+    else:
+        update_task_outputs(task_id, task_details["outputs"])
+
+
+@ROUTER.put(
+    "/lock",
+    responses={
+        200: {
+            "description": "IDs of the tasks which locks are still held by the worker",
+            "content": {"application/json": {"example": [1, 2]}},
+        },
+    },
+)
+async def extend_tasks_locks(
+    request: Request,
+    worker_details: WorkerDetailsRequest = Body(...),
+    task_ids: list[int] = Body(..., description="IDs of the tasks claimed by the worker"),
+) -> list[int]:
+    """
+    Extends the lock leases of the tasks claimed by the `worker` but not yet started, such as prefetched ones.
+    Unlike the progress update, the tasks themselves are not changed. Tasks missing in the response are no longer
+    locked by the `worker` (the lease expired or they were removed), and should not be executed by it.
+    """
+    if options.VIX_MODE == "SERVER":
+        return await extend_tasks_locks_database_async(task_ids, request.scope["user_info"].user_id, worker_details)
+    return extend_tasks_locks_database(task_ids, request.scope["user_info"].user_id, worker_details)
+
+
+@ROUTER.delete(
+    "/lock",
+    response_class=responses.Response,
+    status_code=status.HTTP_204_NO_CONTENT,
+    responses={
+        204: {"description": "Successfully removed task lock"},
+        404: {
+            "description": "Task not found",
+            "content": {"application/json": {"example": {"detail": "Task `{task_id}` was not found."}}},
+        },
+    },
+)
+async def remove_task_lock(
+    request: Request, task_id: int = Query(..., description="The ID of the task to remove the lock from")
+):
+    """
+    Unlocks a task specified by the `task_id`. This endpoint checks if the task exists
+    and if the `worker` making the request has the authorization to unlock it.
+    If the task is not found or unauthorized, a 404 HTTP error is raised.
+    """
+    if options.VIX_MODE == "SERVER":
+        r = await get_task_async(task_id, columns=TASK_DETAILS_COLUMNS_OWNER)
+    else:
+        r = get_task(task_id, columns=TASK_DETAILS_COLUMNS_OWNER)
+    if r is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
+    if r["user_id"] != request.scope["user_info"].user_id and not request.scope["user_info"].is_admin:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task `{task_id}` was not found.")
+    remove_task_lock_database(task_id)
@@ -0,0 +1,132 @@
+import asyncio
+import json
+import math
+import time
+import typing
+from datetime import datetime, timezone
+
+from fastapi import APIRouter, Header, Query, Request, responses
+
+from .. import options
+from ..pydantic_models import TaskDetailsShort
+from ..tasks_engine import get_tasks_changes
+from ..tasks_engine_async import get_tasks_changes_async
+from ..tasks_engine_etc import get_task_state
+from ..tasks_events import tasks_progress_subscription
+
+ROUTER = APIRouter(prefix="/tasks", tags=["tasks"])
+
+PROGRESS_STREAM_KEEPALIVE = 15.0
+"""Interval (in seconds) at which comments are sent to keep the idle stream open."""
+PROGRESS_STREAM_MAX_DURATION = 300.0
+"""Time (in seconds) after which the stream is closed, clients reconnect and continue from the `Last-Event-ID`."""
+PROGRESS_EVENT_FIELDS = ("task_id", "parent_task_id", "progress", "error", "execution_time", "state")
+
+
+@ROUTER.get(
+    "/progress-stream",
+    response_class=responses.StreamingResponse,
+    responses={
+        200: {
+            "description": "Stream of the tasks progress events",
+            "content": {"text/event-stream": {}},
+        },
+    },
+)
+async def get_tasks_progress_stream(
+    request: Request,
+    name: str = Query(None, description="Optional name to filter tasks by their name"),
+    group_scope: int = Query(1, description="Optional parameter to filter tasks by their group number"),
+    tasks_ids: list[int] | None = Query(None, description="Optional IDs of the tasks to receive the events for"),
+    since: datetime | None = Query(
+        None, description="`cursor` from the `/progress-changes`, the changes made after it are sent first"
+    ),
+    last_event_id: datetime | None = Header(
+        None, description="Set by the `EventSource` on reconnect, replaces `since`"
+    ),
+):
+    """
+    Streams the progress of the tasks of a specific user as Server-Sent Events, as soon as the tasks engine
+    records it. Optionally filter tasks by their name, a group number, or their IDs.
+
+    Events:
+    - `progress`: `task_id`, `parent_task_id`, `progress`, `error`, `execution_time` and `state` of the task.
+    - `removed`: `task_id` of the removed task, sent only for the changes made before the stream was opened
+      and in the SERVER mode.
+    - `reset`: `since` is older than TASKS_TOMBSTONES_MAX_AGE, the following `progress` events contain all tasks.
+
+    The event ID is the cursor, so the `EventSource` that reconnects does not lose the events. The stream is
+    closed after PROGRESS_STREAM_MAX_DURATION seconds. In the SERVER mode the changes made by other
+    Server instances(processes) are received with the delay of up to TASKS_NEXT_RECHECK_INTERVAL seconds.
+    """
+    since = last_event_id or since
+    if since is not None and since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return responses.StreamingResponse(
+        __progress_stream(request.scope["user_info"].user_id, name, group_scope, tasks_ids, since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def __progress_stream(
+    user_id: str, name: str | None, group_scope: int, tasks_ids: list[int] | None, since: datetime | None
+) -> typing.AsyncIterator[str]:
+    with tasks_progress_subscription() as queue:
+        cursor = since or datetime.utcnow()
+        check_changes = since is not None or options.VIX_MODE == "SERVER"
+        next_check = time.monotonic() + (0.0 if since is not None else options.TASKS_NEXT_RECHECK_INTERVAL)
+        stream_end = time.monotonic() + PROGRESS_STREAM_MAX_DURATION
+        while (time_left := stream_end - time.monotonic()) > 0:
+            if check_changes and time.monotonic() >= next_check:
+                if options.VIX_MODE == "SERVER":
+                    changes = await get_tasks_changes_async(user_id, cursor, name, group_scope)
+                else:
+                    changes = await asyncio.to_thread(get_tasks_changes, user_id, cursor, name, group_scope)
+                cursor = changes.cursor
+                if changes.reset:
+                    yield __sse_event("reset", {}, cursor)
+                for task in changes.tasks.values():
+                    if not tasks_ids or task.task_id in tasks_ids:
+                        yield __sse_event("progress", __task_to_progress_event(task), cursor)
+                for task_id in changes.removed_tasks:
+                    if not tasks_ids or task_id in tasks_ids:
+                        yield __sse_event("removed", {"task_id": task_id}, cursor)
+                check_changes = options.VIX_MODE == "SERVER"
+                next_check = time.monotonic() + options.TASKS_NEXT_RECHECK_INTERVAL
+            timeout = min(
+                time_left, PROGRESS_STREAM_KEEPALIVE, next_check - time.monotonic() if check_changes else math.inf
+            )
+            try:
+                event = await asyncio.wait_for(queue.get(), max(timeout, 0.0))
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if __is_subscribed(event, user_id, name, group_scope, tasks_ids):
+                # while the changes are checked, only they can give the cursor that does not skip the changes
+                event_id = cursor if check_changes else datetime.utcnow()
+                yield __sse_event("progress", {k: event[k] for k in PROGRESS_EVENT_FIELDS}, event_id)
+
+
+def __is_subscribed(event: dict, user_id: str, name: str | None, group_scope: int, tasks_ids: list[int] | None) -> bool:
+    if event["user_id"] != user_id or (name is not None and event["name"] != name):
+        return False
+    if group_scope and event["group_scope"] != group_scope:
+        return False
+    return not tasks_ids or event["task_id"] in tasks_ids
+
+
+def __task_to_progress_event(task: TaskDetailsShort) -> dict:
+    state = get_task_state(task.progress, task.error)
+    return {
+        "task_id": task.task_id,
+        "parent_task_id": task.parent_task_id,
+        "progress": task.progress,
+        "error": task.error,
+        "execution_time": task.execution_time,
+        "state": "queued" if state == "running" and task.locked_at is None else state,
+    }
+
+
+def __sse_event(event: str, data: dict, event_id: datetime) -> str:
+    return f"id: {event_id.isoformat()}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
@@ -1,128 +1,133 @@
-import builtins
 import contextlib
-import gc
 import json
 import logging
 import os
-import threading
 import time
 import typing
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 import httpx
-import torch
-from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy import and_, delete, insert, or_, select, update
 from sqlalchemy.exc import IntegrityError
 
 from . import database, options
-from .comfyui import (
-    cleanup_models,
-    get_worker_details,
-    interrupt_processing,
-    soft_empty_cache,
+from .comfyui import get_worker_details_request, interrupt_processing
+from .db_queries import (
+    get_fair_share_weights,
+    get_flow_max_execution_time,
+    get_flows_vram_peaks,
+    get_global_setting,
+    get_setting,
+    set_flow_vram_peak,
 )
-from .db_queries import get_global_setting, get_setting
-from .flows import get_google_nodes, get_installed_flows, get_ollama_nodes
+from .fair_share import get_record_task_dispatched_query, get_remove_passed_tags_query
+from .flows import get_google_nodes, get_ollama_nodes
+from .metrics import increment_metric
 from .pydantic_models import (
     TaskDetails,
     TaskDetailsShort,
-    UserInfo,
+    TasksChanges,
     WorkerDetailsRequest,
 )
+from .results_cache import add_task_results_to_cache
 from .tasks_engine_etc import (
-    TASK_DETAILS_COLUMNS,
-    TASK_DETAILS_COLUMNS_SHORT,
+    PREEMPTED_FOR_TASKS,
+    TASK_PROGRESS_EVENT_COLUMNS,
+    TASK_TOMBSTONE_COLUMNS,
+    child_tasks_to_tree,
+    get_age_queued_tasks_queries,
+    get_child_tasks_query,
+    get_claim_incomplete_task_without_error_query,
+    get_expired_task_locks_condition,
+    get_expired_tombstones_condition,
+    get_extend_task_lock_query,
+    get_extend_tasks_locks_query,
+    get_flows_reload_cost,
     get_get_incomplete_task_without_error_query,
-    init_new_task_details,
+    get_insert_tasks_queue_query,
+    get_preemption_victim_query,
+    get_removed_tasks_query,
+    get_task_lock_expires_at,
+    get_task_progress_event,
+    get_task_query,
+    get_task_state,
+    get_tasks_changed_condition,
+    get_tasks_fitting_worker_memory,
+    get_tasks_query,
+    get_tasks_tombstones_values,
+    get_tasks_trees_cte,
+    get_urgent_tasks_query,
+    get_worker_memory,
     prepare_worker_info_update,
+    should_preempt_for_task,
     task_details_from_dict,
     task_details_short_to_dict,
     task_details_to_dict,
 )
+from .tasks_events import (
+    get_queued_version,
+    notify_tasks_queued,
+    publish_task_progress,
+    wait_for_queued_tasks,
+)
+from .webhooks import enqueue_task_webhook
+from .worker_client import server_request
+from .workers_heartbeats import (
+    record_worker_heartbeat,
+    set_worker_memory,
+    set_worker_tasks_to_give_cache,
+)
 
 LOGGER = logging.getLogger("visionatrix")
 
-ACTIVE_TASK: dict = {}
-
 
-def create_new_task(name: str, input_params: dict, user_info: UserInfo) -> dict:
+def create_new_tasks(count: int) -> list[int]:
+    """Allocates IDs for the new tasks with a single INSERT."""
     with database.SESSION() as session:
         try:
-            new_task_queue = database.TaskQueue()
-            session.add(new_task_queue)
+            query = get_insert_tasks_queue_query(session.get_bind().dialect.name, count)
+            tasks_ids = sorted(session.execute(query).scalars().all())
             session.commit()
         except Exception:
             session.rollback()
-            LOGGER.exception("Failed to add `%s` to TaskQueue(%s)", name, user_info.user_id)
+            LOGGER.exception("Failed to add %s tasks to TaskQueue", count)
             raise
-    remove_task_files(new_task_queue.id, ["output", "input"])
-    return init_new_task_details(new_task_queue.id, name, input_params, user_info)
+    remove_tasks_files(tasks_ids, ["output", "input"])
+    return tasks_ids
 
 
-def put_task_in_queue(task_details: dict) -> None:
-    LOGGER.debug("Put flow in queue: %s", task_details)
+def put_tasks_in_queue(tasks_details: list[dict]) -> None:
+    LOGGER.debug("Put flows in queue: %s", [i["task_id"] for i in tasks_details])
     with database.SESSION() as session:
         try:
-            session.add(task_details_from_dict(task_details))
+            session.add_all([task_details_from_dict(i) for i in tasks_details])
             session.commit()
         except Exception:
             session.rollback()
-            LOGGER.exception("Failed to put task in queue: %s", task_details["task_id"])
-            remove_task_files(task_details["task_id"], ["input"])
+            LOGGER.exception("Failed to put tasks in queue: %s", [i["task_id"] for i in tasks_details])
+            remove_tasks_files([i["task_id"] for i in tasks_details], ["input"])
             raise
+    notify_tasks_queued()
 
 
-def __get_task_query(task_id: int, user_id: str | None):
-    query = (
-        select(*TASK_DETAILS_COLUMNS)
-        .outerjoin(database.TaskLock, database.TaskLock.task_id == database.TaskDetails.task_id)
-        .filter(database.TaskDetails.task_id == task_id)
-    )
-    if user_id is not None:
-        query = query.filter(database.TaskDetails.user_id == user_id)
-    return query
-
-
-def collect_child_task_ids(task: dict | TaskDetailsShort, output_ids: list) -> None:
-    if isinstance(task, dict):
-        for child in task["child_tasks"]:
-            output_ids.append(child["task_id"])
-            collect_child_task_ids(child, output_ids)
-    else:
-        for child in task.child_tasks:
-            output_ids.append(child.task_id)
-            collect_child_task_ids(child, output_ids)
-
-
-def fetch_child_tasks(session, parent_task_ids: list[int]) -> dict[int, list[TaskDetailsShort]]:
+def fetch_child_tasks(
+    session, parent_task_ids: list[int], fields: list[str] | None = None
+) -> dict[int, list[TaskDetailsShort]]:
     if not parent_task_ids:
         return {}
+    return child_tasks_to_tree(session.execute(get_child_tasks_query(parent_task_ids, fields)).all(), parent_task_ids)
 
-    query = (
-        select(*TASK_DETAILS_COLUMNS_SHORT)
-        .outerjoin(database.TaskLock, database.TaskLock.task_id == database.TaskDetails.task_id)
-        .filter(database.TaskDetails.parent_task_id.in_(parent_task_ids))
-    )
-    child_tasks = session.execute(query).all()
-
-    parent_to_children = {}
-    for task in child_tasks:
-        task_details = task_details_short_to_dict(task)
-        parent_to_children.setdefault(task.parent_task_id, []).append(task_details)
-
-    next_level_parent_ids = [task.task_id for task in child_tasks]
-    next_level_children = fetch_child_tasks(session, next_level_parent_ids)
-    for children in parent_to_children.values():
-        for child in children:
-            child["child_tasks"] = next_level_children.get(child["task_id"], [])
-    return parent_to_children
 
-
-def get_task(task_id: int, user_id: str | None = None, fetch_child: bool = False) -> dict | None:
+def get_task(
+    task_id: int, user_id: str | None = None, fetch_child: bool = False, columns: list | None = None
+) -> dict | None:
+    """Returns the task details, or only the `columns` of the task if they are specified."""
     with database.SESSION() as session:
         try:
-            query = __get_task_query(task_id, user_id)
+            query = get_task_query(task_id, user_id, columns)
             task = session.execute(query).one_or_none()
+            if task and columns is not None:
+                return dict(zip((i.key for i in columns), task, strict=True))
             if task:
                 task_dict = task_details_to_dict(task)
                 if fetch_child:
@@ -135,16 +140,30 @@ def get_task(task_id: int, user_id: str | None = None, fetch_child: bool = False
             raise
 
 
-def get_incomplete_task_without_error(tasks_to_ask: list[str], last_task_name: str) -> dict:
+def get_incomplete_task_without_error(
+    tasks_to_ask: list[str], last_task_name: str, wait_timeout: float = 0.0, loaded_models: list[str] | None = None
+) -> dict:
     if options.VIX_MODE == "WORKER" and options.VIX_SERVER:
-        task_to_exec = get_incomplete_task_without_error_server(tasks_to_ask, last_task_name)
+        task_to_exec = get_incomplete_task_without_error_server(
+            tasks_to_ask, last_task_name, wait_timeout, loaded_models
+        )
     else:
+        queued_version = get_queued_version()
         task_to_exec = get_incomplete_task_without_error_database(
             database.DEFAULT_USER.user_id,
-            WorkerDetailsRequest.model_validate(get_worker_details()),
+            get_worker_details_request(),
             tasks_to_ask,
             last_task_name,
+            loaded_models=loaded_models,
         )
+        if not task_to_exec and wait_timeout and wait_for_queued_tasks(queued_version, wait_timeout):
+            task_to_exec = get_incomplete_task_without_error_database(
+                database.DEFAULT_USER.user_id,
+                get_worker_details_request(),
+                tasks_to_ask,
+                last_task_name,
+                loaded_models=loaded_models,
+            )
     if not task_to_exec:
         return {}
 
@@ -178,12 +197,7 @@ def get_worker_value(key_name: str, user_id: str = "") -> str:
     if key_value:
         return key_value
     if options.VIX_MODE == "WORKER" and options.VIX_SERVER:
-        r = httpx.get(
-            options.VIX_SERVER.rstrip("/") + "/api/settings/get",
-            params={"key": key_name.lower()},
-            auth=options.worker_auth(),
-            timeout=float(options.WORKER_NET_TIMEOUT),
-        )
+        r = server_request("GET", "/api/settings/get", params={"key": key_name.lower()})
         if httpx.codes.is_error(r.status_code):
             LOGGER.error("Can not fetch `%s` from the server: %s", key_name, r.status_code)
         else:
@@ -195,17 +209,21 @@ def get_worker_value(key_name: str, user_id: str = "") -> str:
     return key_value
 
 
-def get_incomplete_task_without_error_server(tasks_to_ask: list[str], last_task_name: str) -> dict:
+def get_incomplete_task_without_error_server(
+    tasks_to_ask: list[str], last_task_name: str, wait_timeout: float, loaded_models: list[str] | None
+) -> dict:
     try:
-        r = httpx.post(
-            options.VIX_SERVER.rstrip("/") + "/api/tasks/next",
+        r = server_request(
+            "POST",
+            "/api/tasks/next",
             json={
-                "worker_details": get_worker_details(),
+                "worker_details": get_worker_details_request().model_dump(exclude={"last_seen"}),
                 "tasks_names": tasks_to_ask,
                 "last_task_name": last_task_name,
+                "wait_timeout": wait_timeout,
+                "loaded_models": loaded_models or [],
             },
-            auth=options.worker_auth(),
-            timeout=float(options.WORKER_NET_TIMEOUT),
+            timeout=float(options.WORKER_NET_TIMEOUT) + wait_timeout,
         )
         if r.status_code == httpx.codes.NO_CONTENT:
             return {}
@@ -225,34 +243,60 @@ def get_incomplete_task_without_error_database(
     tasks_to_ask: list[str],
     last_task_name: str,
     user_id: str | None = None,
+    loaded_models: list[str] | None = None,
 ) -> dict:
     if not tasks_to_ask:
         return {}
+    flows_reload_cost = get_flows_reload_cost(tasks_to_ask, loaded_models)
     session = database.SESSION()
     try:
         worker_id, worker_device_name, worker_info_values = prepare_worker_info_update(worker_user_id, worker_details)
-        result = session.execute(
-            update(database.Worker).where(database.Worker.worker_id == worker_id).values(**worker_info_values)
-        )
-        tasks_to_give = []
-        if result.rowcount == 0:
-            session.add(
-                database.Worker(
-                    user_id=worker_user_id,
-                    worker_id=worker_id,
-                    device_name=worker_device_name,
-                    **worker_info_values,
-                )
+        tasks_to_give = record_worker_heartbeat(worker_id, worker_info_values)
+        if tasks_to_give is None:
+            result = session.execute(
+                update(database.Worker).where(database.Worker.worker_id == worker_id).values(**worker_info_values)
             )
-        else:
-            query = select(database.Worker).filter(database.Worker.worker_id == worker_id)
-            tasks_to_give = session.execute(query).scalar().tasks_to_give
-        query = get_get_incomplete_task_without_error_query(tasks_to_ask, tasks_to_give, last_task_name, user_id)
-        task = session.execute(query).scalar()
-        if not task:
+            tasks_to_give = []
+            if result.rowcount == 0:
+                session.add(
+                    database.Worker(
+                        user_id=worker_user_id,
+                        worker_id=worker_id,
+                        device_name=worker_device_name,
+                        **worker_info_values,
+                    )
+                )
+            else:
+                query = select(database.Worker.tasks_to_give).filter(database.Worker.worker_id == worker_id)
+                tasks_to_give = session.execute(query).scalar()
             session.commit()
+            set_worker_tasks_to_give_cache(worker_id, tasks_to_give, flushed=True)
+        worker_memory = get_worker_memory(worker_info_values)
+        set_worker_memory(worker_id, worker_memory)
+        tasks_to_ask = get_tasks_fitting_worker_memory(tasks_to_ask, worker_memory, get_flows_vram_peaks())
+        if not tasks_to_ask:
             return {}
-        return lock_task_and_return_details(session, task)
+        if session.get_bind().dialect.name == "postgresql":
+            query = get_claim_incomplete_task_without_error_query(
+                tasks_to_ask, tasks_to_give, last_task_name, user_id, flows_reload_cost, worker_id
+            )
+            task = session.execute(query).scalar()
+            session.commit()
+            task_details = __lock_task_and_return_details(task) if task else {}
+        else:
+            query = get_get_incomplete_task_without_error_query(
+                tasks_to_ask, tasks_to_give, last_task_name, user_id, flows_reload_cost
+            )
+            task = session.execute(query).scalar()
+            if not task:
+                session.commit()
+                return {}
+            task_details = lock_task_and_return_details(session, task, worker_id)
+        if task_details:
+            record_tasks_dispatched(session, [task_details])
+            if not task_details["max_execution_time"]:
+                task_details["max_execution_time"] = get_flow_max_execution_time(task_details["name"])
+        return task_details
     except Exception as e:
         session.rollback()
         LOGGER.exception("Failed to retrieve task for processing: %s", e)
@@ -272,51 +316,52 @@ def __lock_task_and_return_details(task: type[database.TaskDetails] | database.T
         "input_files": task.input_files,
         "flow_comfy": task.flow_comfy,
         "user_id": task.user_id,
+        "group_scope": task.group_scope,
         "execution_time": 0.0,
         "webhook_url": task.webhook_url,
         "webhook_headers": task.webhook_headers,
+        "max_execution_time": task.max_execution_time,
     }
 
 
-def lock_task_and_return_details(session, task: type[database.TaskDetails] | database.TaskDetails) -> dict:
+def record_tasks_dispatched(session, tasks: list[dict]) -> None:
+    """Advances the fair share tags of the users of the dispatched tasks, see `fair_share`."""
     try:
-        session.add(database.TaskLock(task_id=task.task_id, locked_at=datetime.utcnow()))
+        fair_share_weights = get_fair_share_weights()
+        dialect_name = session.get_bind().dialect.name
+        for i in tasks:
+            session.execute(
+                get_record_task_dispatched_query(
+                    dialect_name, i["user_id"], i["group_scope"], fair_share_weights.get(i["user_id"], 1.0)
+                )
+            )
+        session.execute(get_remove_passed_tags_query())
         session.commit()
-        return __lock_task_and_return_details(task)
-    except IntegrityError:
+    except Exception as e:
         session.rollback()
-        return {}
+        LOGGER.exception("Failed to record the dispatched tasks %s: %s", [i["task_id"] for i in tasks], e)
 
 
-def __get_tasks_query(
-    name: str | None,
-    group_scope: int,
-    finished: bool | None,
-    user_id: str | None,
-    full_info=True,
-    only_parent=False,
-):
-    query = select(*(TASK_DETAILS_COLUMNS if full_info else TASK_DETAILS_COLUMNS_SHORT)).outerjoin(
-        database.TaskLock, database.TaskLock.task_id == database.TaskDetails.task_id
-    )
-
-    if user_id is not None:
-        query = query.filter(database.TaskDetails.user_id == user_id)
-    if name is not None:
-        query = query.filter(database.TaskDetails.name == name)
-    if finished is not None:
-        if finished:
-            query = query.filter(database.TaskDetails.progress == 100.0)
-        else:
-            query = query.filter(database.TaskDetails.progress < 100.0)
-    if only_parent:
-        query = query.filter(
-            (database.TaskDetails.parent_task_id == None)  # noqa # pylint: disable=singleton-comparison
-            | (database.TaskDetails.parent_task_id == 0)
+def lock_task_and_return_details(
+    session, task: type[database.TaskDetails] | database.TaskDetails, worker_id: str
+) -> dict:
+    try:
+        session.add(
+            database.TaskLock(
+                task_id=task.task_id,
+                locked_at=datetime.utcnow(),
+                expires_at=get_task_lock_expires_at(),
+                worker_id=worker_id,
+            )
         )
-    if group_scope:
-        query = query.filter(database.TaskDetails.group_scope == group_scope)
-    return query
+        session.execute(
+            update(database.TaskDetails).where(database.TaskDetails.task_id == task.task_id).values(state="running")
+        )
+        session.commit()
+        return __lock_task_and_return_details(task)
+    except IntegrityError:
+        session.rollback()
+        return {}
 
 
 def get_tasks(
@@ -326,14 +371,21 @@ def get_tasks(
     user_id: str | None = None,
     fetch_child: bool = False,
     only_parent: bool = False,
+    state: str | None = None,
+    cursor: tuple | None = None,
+    limit: int = 0,
+    order_by: str = "task_id",
+    fields: list[str] | None = None,
 ) -> dict[int, TaskDetails]:
     with database.SESSION() as session:
         try:
-            query = __get_tasks_query(name, group_scope, finished, user_id, only_parent=only_parent)
+            query = get_tasks_query(
+                name, group_scope, finished, user_id, only_parent, state, cursor, limit, order_by, fields=fields
+            )
             results = session.execute(query).all()
             tasks = {}
             task_ids = [task.task_id for task in results]
-            child_tasks = fetch_child_tasks(session, task_ids) if fetch_child else {}
+            child_tasks = fetch_child_tasks(session, task_ids, fields) if fetch_child else {}
             for task in results:
                 task_details = task_details_to_dict(task)
                 task_details["child_tasks"] = child_tasks.get(task.task_id, [])
@@ -351,14 +403,21 @@ def get_tasks_short(
     finished: bool | None = None,
     fetch_child: bool = False,
     only_parent: bool = False,
+    state: str | None = None,
+    cursor: tuple | None = None,
+    limit: int = 0,
+    order_by: str = "task_id",
+    fields: list[str] | None = None,
 ) -> dict[int, TaskDetailsShort]:
     with database.SESSION() as session:
         try:
-            query = __get_tasks_query(name, group_scope, finished, user_id, full_info=False, only_parent=only_parent)
+            query = get_tasks_query(
+                name, group_scope, finished, user_id, only_parent, state, cursor, limit, order_by, False, fields
+            )
             results = session.execute(query).all()
             tasks = {}
             task_ids = [task.task_id for task in results]
-            child_tasks = fetch_child_tasks(session, task_ids) if fetch_child else {}
+            child_tasks = fetch_child_tasks(session, task_ids, fields) if fetch_child else {}
             for task in results:
                 task_details = task_details_short_to_dict(task)
                 task_details["child_tasks"] = child_tasks.get(task.task_id, [])
@@ -369,6 +428,33 @@ def get_tasks_short(
             raise
 
 
+def get_tasks_changes(
+    user_id: str, since: datetime | None, name: str | None = None, group_scope: int = 1
+) -> TasksChanges:
+    """Tasks changed and removed after `since`(naive UTC). All tasks are returned when `since` is too old."""
+    cursor = datetime.utcnow()
+    reset = since is None or since < cursor - timedelta(seconds=options.TASKS_TOMBSTONES_MAX_AGE)
+    with database.SESSION() as session:
+        try:
+            query = get_tasks_query(name, group_scope, None, user_id, full_info=False)
+            removed_tasks = []
+            if not reset:
+                query = query.filter(get_tasks_changed_condition(since))
+                removed_tasks = session.execute(get_removed_tasks_query(user_id, since, name, group_scope)).scalars()
+            tasks = {i.task_id: task_details_short_to_dict(i) for i in session.execute(query).all()}
+            return TasksChanges(cursor=cursor, reset=reset, tasks=tasks, removed_tasks=list(removed_tasks))
+        except Exception:
+            LOGGER.exception("Failed to retrieve changes of the tasks: `%s`, since=%s", name, since)
+            raise
+
+
+def __add_tasks_tombstones(session, removed_tasks: list) -> None:
+    """Remembers the removed tasks for the changes feed, and forgets the expired ones."""
+    session.execute(delete(database.TaskTombstone).where(get_expired_tombstones_condition()))
+    if removed_tasks:
+        session.execute(insert(database.TaskTombstone), get_tasks_tombstones_values(removed_tasks))
+
+
 def remove_task_by_id(task_id: int) -> bool:
     if options.VIX_MODE == "WORKER" and options.VIX_SERVER:
         return remove_task_by_id_server(task_id)
@@ -376,32 +462,55 @@ def remove_task_by_id(task_id: int) -> bool:
 
 
 def remove_task_by_id_database(task_ids: list[int]) -> bool:
+    """Removes the tasks together with all their child tasks."""
+    return __remove_tasks_trees(database.TaskDetails.task_id.in_(task_ids), task_ids)
+
+
+def remove_finished_tasks_by_name_and_group(name: str, user_id: str, group_scope: int) -> bool:
+    """Removes the finished parent tasks together with all their child tasks."""
+    return __remove_tasks_trees(
+        and_(
+            database.TaskDetails.progress == 100.0,
+            database.TaskDetails.name == name,
+            database.TaskDetails.user_id == user_id,
+            (database.TaskDetails.group_scope == group_scope if group_scope else True),
+            or_(
+                database.TaskDetails.parent_task_id == None,  # noqa # pylint: disable=singleton-comparison
+                database.TaskDetails.parent_task_id == 0,
+            ),
+        )
+    )
+
+
+def __remove_tasks_trees(roots_condition, task_ids: list[int] | None = None) -> bool:
+    removed_task_ids = list(task_ids or [])
     session = database.SESSION()
     try:
-        lock_result = session.execute(delete(database.TaskLock).where(database.TaskLock.task_id.in_(task_ids)))
-        details_result = session.execute(delete(database.TaskDetails).where(database.TaskDetails.task_id.in_(task_ids)))
-        if lock_result.rowcount + details_result.rowcount > 0:
+        tasks_trees = select(get_tasks_trees_cte(roots_condition).c.task_id)
+        lock_result = session.execute(delete(database.TaskLock).where(database.TaskLock.task_id.in_(tasks_trees)))
+        removed_tasks = session.execute(
+            delete(database.TaskDetails)
+            .where(database.TaskDetails.task_id.in_(tasks_trees))
+            .returning(*TASK_TOMBSTONE_COLUMNS)
+        ).all()
+        removed_task_ids += [i.task_id for i in removed_tasks]
+        __add_tasks_tombstones(session, removed_tasks)
+        if lock_result.rowcount > 0 or removed_tasks:
             session.commit()
             return True
     except Exception:
         session.rollback()
-        LOGGER.exception("Failed to remove tasks: %s", task_ids)
+        LOGGER.exception("Failed to remove tasks: %s", task_ids or removed_task_ids)
         raise
     finally:
         session.close()
-        for i in task_ids:
-            remove_task_files(i, ["output", "input"])
+        remove_tasks_files(removed_task_ids, ["output", "input"])
     return False
 
 
 def remove_task_by_id_server(task_id: int) -> bool:
     try:
-        r = httpx.delete(
-            options.VIX_SERVER.rstrip("/") + "/api/tasks/task",
-            params={"task_id": task_id},
-            auth=options.worker_auth(),
-            timeout=float(options.WORKER_NET_TIMEOUT),
-        )
+        r = server_request("DELETE", "/api/tasks/task", params={"task_id": task_id})
         if not httpx.codes.is_error(r.status_code):
             return True
         LOGGER.warning("Task %s: server return status: %s", task_id, r.status_code)
@@ -414,12 +523,13 @@ def remove_unfinished_task_by_id(task_id: int) -> bool:
     session = database.SESSION()
     try:
         session.execute(delete(database.TaskLock).where(database.TaskLock.task_id == task_id))
-        details_result = session.execute(
-            delete(database.TaskDetails).where(
-                and_(database.TaskDetails.progress != 100.0, database.TaskDetails.task_id == task_id)
-            )
-        )
-        if details_result.rowcount > 0:
+        removed_tasks = session.execute(
+            delete(database.TaskDetails)
+            .where(and_(database.TaskDetails.progress != 100.0, database.TaskDetails.task_id == task_id))
+            .returning(*TASK_TOMBSTONE_COLUMNS)
+        ).all()
+        if removed_tasks:
+            __add_tasks_tombstones(session, removed_tasks)
             session.commit()
             remove_task_files(task_id, ["output", "input"])
             return True
@@ -435,20 +545,25 @@ def remove_unfinished_task_by_id(task_id: int) -> bool:
 def remove_unfinished_tasks_by_name_and_group(name: str, user_id: str, group_scope: int) -> bool:
     session = database.SESSION()
     try:
-        stmt = delete(database.TaskDetails).where(
-            and_(
-                database.TaskDetails.progress != 100.0,
-                database.TaskDetails.name == name,
-                database.TaskDetails.user_id == user_id,
-                (database.TaskDetails.group_scope == group_scope if group_scope else True),
-                or_(
-                    database.TaskDetails.parent_task_id == None,  # noqa # pylint: disable=singleton-comparison
-                    database.TaskDetails.parent_task_id == 0,
-                ),
+        stmt = (
+            delete(database.TaskDetails)
+            .where(
+                and_(
+                    database.TaskDetails.progress != 100.0,
+                    database.TaskDetails.name == name,
+                    database.TaskDetails.user_id == user_id,
+                    (database.TaskDetails.group_scope == group_scope if group_scope else True),
+                    or_(
+                        database.TaskDetails.parent_task_id == None,  # noqa # pylint: disable=singleton-comparison
+                        database.TaskDetails.parent_task_id == 0,
+                    ),
+                )
             )
+            .returning(*TASK_TOMBSTONE_COLUMNS)
         )
-        result = session.execute(stmt)
-        if result.rowcount > 0:
+        removed_tasks = session.execute(stmt).all()
+        if removed_tasks:
+            __add_tasks_tombstones(session, removed_tasks)
             session.commit()
             return True
     except Exception:
@@ -471,11 +586,16 @@ def get_task_files(task_id: int, directory: typing.Literal["input", "output"]) -
 
 
 def remove_task_files(task_id: int, directories: list[str]) -> None:
+    remove_tasks_files([task_id], directories)
+
+
+def remove_tasks_files(tasks_ids: list[int], directories: list[str]) -> None:
+    tasks_ids_str = {str(i) for i in tasks_ids}
     for directory in directories:
-        result_prefix = f"{task_id}_"
         target_directory = os.path.join(options.TASKS_FILES_DIR, directory)
         for filename in os.listdir(target_directory):
-            if filename.startswith(result_prefix):
+            task_id, separator, _ = filename.partition("_")
+            if separator and task_id in tasks_ids_str:
                 with contextlib.suppress(FileNotFoundError):
                     os.remove(os.path.join(target_directory, filename))
 
@@ -491,7 +611,13 @@ def remove_task_lock_database(task_id: int) -> None:
     try:
         result = session.execute(delete(database.TaskLock).where(database.TaskLock.task_id == task_id))
         if result.rowcount > 0:
+            session.execute(  # unfinished task without an error goes back to the queue
+                update(database.TaskDetails)
+                .where(database.TaskDetails.task_id == task_id, database.TaskDetails.state == "running")
+                .values(state="queued")
+            )
             session.commit()
+            notify_tasks_queued()
     except Exception as e:
         session.rollback()
         LOGGER.exception("Task %s: failed to remove task lock: %s", task_id, e)
@@ -501,18 +627,52 @@ def remove_task_lock_database(task_id: int) -> None:
 
 def remove_task_lock_server(task_id: int) -> None:
     try:
-        r = httpx.delete(
-            options.VIX_SERVER.rstrip("/") + "/api/tasks/lock",
-            params={"task_id": task_id},
-            auth=options.worker_auth(),
-            timeout=float(options.WORKER_NET_TIMEOUT),
-        )
+        r = server_request("DELETE", "/api/tasks/lock", params={"task_id": task_id})
         if httpx.codes.is_error(r.status_code):
             LOGGER.warning("Task %s: server return status: %s", task_id, r.status_code)
     except Exception as e:
         LOGGER.exception("Exception occurred: %s", e)
 
 
+def extend_tasks_locks(task_ids: list[int]) -> list[int]:
+    """Extends the lock leases of the claimed but not yet started tasks, without changing the tasks.
+
+    Returns IDs of the tasks which locks are still held by this worker."""
+    if options.VIX_MODE == "WORKER" and options.VIX_SERVER:
+        return extend_tasks_locks_server(task_ids)
+    return extend_tasks_locks_database(task_ids, database.DEFAULT_USER.user_id, get_worker_details_request())
+
+
+def extend_tasks_locks_database(
+    task_ids: list[int], worker_user_id: str, worker_details: WorkerDetailsRequest
+) -> list[int]:
+    worker_id = prepare_worker_info_update(worker_user_id, worker_details)[0]
+    with database.SESSION() as session:
+        try:
+            r = session.execute(get_extend_tasks_locks_query(task_ids, worker_id)).scalars().all()
+            session.commit()
+            return list(r)
+        except Exception as e:
+            session.rollback()
+            LOGGER.exception("Failed to extend locks of the tasks %s: %s", task_ids, e)
+    return []
+
+
+def extend_tasks_locks_server(task_ids: list[int]) -> list[int]:
+    request_data = {
+        "worker_details": get_worker_details_request().model_dump(exclude={"last_seen"}),
+        "task_ids": task_ids,
+    }
+    try:
+        r = server_request("PUT", "/api/tasks/lock", json=request_data)
+        if not httpx.codes.is_error(r.status_code):
+            return r.json()
+        LOGGER.warning("Tasks %s: server return status: %s", task_ids, r.status_code)
+    except Exception as e:
+        LOGGER.exception("Exception occurred: %s", e)
+    return []
+
+
 def update_task_outputs(task_id: int, outputs: list[dict]) -> bool:
     with database.SESSION() as session:
         try:
@@ -539,28 +699,27 @@ def update_task_progress(task_details: dict) -> bool:
         task_details["error"],
         task_details["execution_time"],
         database.DEFAULT_USER.user_id,
-        WorkerDetailsRequest.model_validate(get_worker_details()),
+        get_worker_details_request(),
     )
+    if r and task_details["progress"] == 100.0 and task_details.get("vram_peak"):
+        set_flow_vram_peak(task_details["name"], task_details["vram_peak"])
+    if (
+        r
+        and task_details["progress"] == 100.0
+        and not task_details["error"]
+        and options.TASKS_RESULTS_CACHE_SIZE
+        and (finished_task_details := get_task(task_details["task_id"]))
+    ):
+        add_task_results_to_cache(finished_task_details)
     if r and task_details["webhook_url"]:
-        try:
-            with httpx.Client(base_url=task_details["webhook_url"], timeout=3.0) as client:
-                client.post(
-                    url="task-progress",
-                    json={
-                        "task_id": task_details["task_id"],
-                        "progress": task_details["progress"],
-                        "execution_time": task_details["execution_time"],
-                        "error": task_details["error"],
-                    },
-                    headers=task_details["webhook_headers"],
-                )
-        except httpx.RequestError as e:
-            LOGGER.exception(
-                "Exception during calling webhook %s, progress=%s: %s",
-                task_details["webhook_url"],
-                task_details["progress"],
-                e,
-            )
+        enqueue_task_webhook(
+            task_details["webhook_url"],
+            task_details["webhook_headers"],
+            task_details["task_id"],
+            task_details["progress"],
+            task_details["execution_time"],
+            task_details["error"],
+        )
     return r
 
 
@@ -581,19 +740,30 @@ def update_task_progress_database(
                 "execution_time": execution_time,
                 "updated_at": datetime.now(timezone.utc),
                 "worker_id": worker_id,
+                "state": get_task_state(progress, error),
             }
+            result = session.execute(get_extend_task_lock_query(task_id, worker_id))
+            if result.rowcount == 0:
+                LOGGER.warning(
+                    "Task %s: progress update rejected, the task is not locked by %s(lease expired or preempted).",
+                    task_id,
+                    worker_id,
+                )
+                return False
             if progress == 100.0:
                 update_values["finished_at"] = datetime.now(timezone.utc)
-            result = session.execute(
-                update(database.TaskDetails).where(database.TaskDetails.task_id == task_id).values(**update_values)
-            )
+            task = session.execute(
+                update(database.TaskDetails)
+                .where(database.TaskDetails.task_id == task_id)
+                .values(**update_values)
+                .returning(*TASK_PROGRESS_EVENT_COLUMNS)
+            ).one_or_none()
             session.commit()
-            if (task_updated := result.rowcount == 1) is True:
-                session.execute(
-                    update(database.Worker).where(database.Worker.worker_id == worker_id).values(**worker_info_values)
-                )
-                session.commit()
-            return task_updated
+            if task is None:
+                return False
+            record_worker_heartbeat(worker_id, worker_info_values)
+            publish_task_progress(get_task_progress_event(task_id, task, update_values))
+            return True
         except Exception as e:
             interrupt_processing()
             session.rollback()
@@ -610,11 +780,13 @@ def task_restart_database(task_id: int) -> bool:
                 "execution_time": 0.0,
                 "updated_at": datetime.now(timezone.utc),
                 "worker_id": None,
+                "state": "queued",
             }
             result = session.execute(
                 update(database.TaskDetails).where(database.TaskDetails.task_id == task_id).values(**update_values)
             )
             session.commit()
+            notify_tasks_queued()
             return result.rowcount == 1
         except Exception as e:
             interrupt_processing()
@@ -623,35 +795,135 @@ def task_restart_database(task_id: int) -> bool:
     return False
 
 
+def age_queued_tasks_database() -> None:
+    if not options.TASKS_PRIORITY_AGING:
+        return
+    with database.SESSION() as session:
+        try:
+            for query in get_age_queued_tasks_queries():
+                session.execute(query)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            LOGGER.exception("Failed to age the queued tasks: %s", e)
+
+
+def reap_expired_task_locks_database() -> None:
+    with database.SESSION() as session:
+        try:
+            expired_tasks = (
+                session.execute(select(database.TaskLock.task_id).filter(get_expired_task_locks_condition()))
+                .scalars()
+                .all()
+            )
+            requeued_tasks = []
+            for task_id in expired_tasks:
+                result = session.execute(
+                    delete(database.TaskLock).where(
+                        database.TaskLock.task_id == task_id, get_expired_task_locks_condition()
+                    )
+                )
+                if result.rowcount == 0:
+                    continue  # lease was extended in the meantime
+                session.execute(
+                    update(database.TaskDetails)
+                    .where(
+                        database.TaskDetails.task_id == task_id,
+                        database.TaskDetails.progress != 100.0,
+                        database.TaskDetails.error == "",
+                    )
+                    .values(
+                        progress=0.0,
+                        execution_time=0.0,
+                        worker_id=None,
+                        state="queued",
+                        updated_at=datetime.now(timezone.utc),
+                    )
+                )
+                requeued_tasks.append(task_id)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            LOGGER.exception("Failed to release expired task locks: %s", e)
+            return
+    for task_id in requeued_tasks:
+        LOGGER.warning("Task %s: lock lease has expired, the task was returned to the queue.", task_id)
+    if requeued_tasks:
+        notify_tasks_queued()
+
+
+def preempt_tasks_database() -> None:
+    if not options.TASKS_PREEMPTION_PRIORITY:
+        return
+    with database.SESSION() as session:
+        try:
+            preempted_tasks = []
+            for urgent_task_id, urgent_task_name, urgent_task_priority in (
+                session.execute(get_urgent_tasks_query())
+            ).all():
+                if not should_preempt_for_task(urgent_task_id):
+                    continue
+                victim = (
+                    session.execute(
+                        get_preemption_victim_query(
+                            urgent_task_name, urgent_task_priority, [i[1] for i in preempted_tasks]
+                        )
+                    )
+                ).one_or_none()
+                if victim is None:
+                    break  # no running tasks with lower priority left
+                result = session.execute(delete(database.TaskLock).where(database.TaskLock.task_id == victim[0]))
+                if result.rowcount == 0:
+                    continue  # task was finished in the meantime
+                session.execute(
+                    update(database.TaskDetails)
+                    .where(database.TaskDetails.task_id == victim[0], database.TaskDetails.state == "running")
+                    .values(
+                        progress=0.0,
+                        execution_time=0.0,
+                        worker_id=None,
+                        state="queued",
+                        updated_at=datetime.now(timezone.utc),
+                    )
+                )
+                preempted_tasks.append((urgent_task_id, victim[0], victim[1]))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            LOGGER.exception("Failed to preempt tasks: %s", e)
+            return
+    for urgent_task_id, task_id, execution_time in preempted_tasks:
+        PREEMPTED_FOR_TASKS[urgent_task_id] = time.monotonic()
+        increment_metric("tasks_preempted")
+        increment_metric("tasks_preempted_lost_seconds", execution_time)
+        LOGGER.info(
+            "Task %s: preempted for the task %s, lost %.1f seconds of work.", task_id, urgent_task_id, execution_time
+        )
+    if preempted_tasks:
+        notify_tasks_queued()
+
+
 def update_task_progress_server(task_details: dict) -> bool:
     task_id = task_details["task_id"]
     request_data = {
-        "worker_details": get_worker_details(),
+        "worker_details": get_worker_details_request().model_dump(exclude={"last_seen"}),
         "task_id": task_id,
         "progress": task_details["progress"],
         "execution_time": task_details["execution_time"],
         "error": task_details["error"],
+        "vram_peak": task_details.get("vram_peak", 0),
     }
-    for i in range(3):
-        try:
-            r = httpx.put(
-                options.VIX_SERVER.rstrip("/") + "/api/tasks/progress",
-                json=request_data,
-                auth=options.worker_auth(),
-                timeout=float(options.WORKER_NET_TIMEOUT),
-            )
-            if not httpx.codes.is_error(r.status_code):
-                return True
-            if r.status_code == 404:
-                LOGGER.info("Task %s: missing on server.", task_id)
-            else:
-                LOGGER.error("Task %s: server return status: %s", task_id, r.status_code)
-            return False
-        except (httpx.TimeoutException, httpx.RemoteProtocolError):
-            if i != 2:
-                LOGGER.warning("Task %s: attempt number %s: timeout or protocol exception occurred", task_id, i)
-                continue
-            LOGGER.error("Task %s: attempt number %s: timeout or protocol exception occurred, task failed.", task_id, i)
+    try:
+        r = server_request("PUT", "/api/tasks/progress", json=request_data)
+    except httpx.TransportError as e:
+        LOGGER.error("Task %s: can not update progress on server, task failed: %s", task_id, e)
+        return False
+    if not httpx.codes.is_error(r.status_code):
+        return True
+    if r.status_code == 404:
+        LOGGER.info("Task %s: missing on server.", task_id)
+    else:
+        LOGGER.error("Task %s: server return status: %s", task_id, r.status_code)
     return False
 
 
@@ -662,244 +934,6 @@ def __update_temporary_execution_time(task_details: dict) -> None:
         task_details["execution_time"] = time.perf_counter() - task_details["execution_start_time"]
 
 
-def remove_active_task_lock():
-    if ACTIVE_TASK:
-        remove_task_lock(ACTIVE_TASK["task_id"])
-
-
-def init_active_task_inputs_from_server() -> bool:
-    if not (options.VIX_MODE == "WORKER" and options.VIX_SERVER):
-        return True
-    task_id = ACTIVE_TASK["task_id"]
-    remove_task_files(task_id, ["output", "input"])
-    input_directory = os.path.join(options.TASKS_FILES_DIR, "input")
-    try:
-        for i, _ in enumerate(ACTIVE_TASK["input_files"]):
-            for k in range(3):
-                try:
-                    r = httpx.get(
-                        options.VIX_SERVER.rstrip("/") + "/api/tasks/inputs",
-                        params={"task_id": task_id, "input_index": i},
-                        auth=options.worker_auth(),
-                        timeout=float(options.WORKER_NET_TIMEOUT),
-                    )
-                    if r.status_code == httpx.codes.NOT_FOUND:
-                        raise RuntimeError(f"Task {task_id}: not found on server")
-                    if httpx.codes.is_error(r.status_code):
-                        raise RuntimeError(f"Task {task_id}: can not get input file, status={r.status_code}")
-                    with builtins.open(
-                        os.path.join(input_directory, ACTIVE_TASK["input_files"][i]["file_name"]), mode="wb"
-                    ) as input_file:
-                        input_file.write(r.content)
-                    break
-                except (httpx.TimeoutException, httpx.RemoteProtocolError):
-                    if k != 2:
-                        LOGGER.warning("Task %s: attempt number %s: timeout or protocol exception occurred", task_id, i)
-                        continue
-                    raise
-        return True
-    except Exception as e:
-        LOGGER.exception("Can not work on task")
-        ACTIVE_TASK["error"] = str(e)
-        update_task_progress(ACTIVE_TASK)
-        remove_task_files(task_id, ["output", "input"])
-        remove_task_lock(task_id)
-        return False
-
-
-def upload_results_to_server(task_details: dict) -> bool:
-    task_id = task_details["task_id"]
-    output_files = get_task_files(task_id, "output")
-    if not (options.VIX_MODE == "WORKER" and options.VIX_SERVER):
-        for task_output in task_details["outputs"]:
-            task_file_prefix = f"{task_id}_{task_output['comfy_node_id']}_"
-            relevant_files = [file_info for file_info in output_files if file_info[0].startswith(task_file_prefix)]
-            file_size = 0
-            batch_size = 0
-            for i in relevant_files:
-                file_size += os.path.getsize(i[1])
-                batch_size += 1
-            task_output["file_size"] = file_size
-            task_output["batch_size"] = batch_size
-        update_task_outputs(task_id, task_details["outputs"])
-        return True
-    files = []
-    try:
-        for output_file in output_files:
-            file_handle = builtins.open(output_file[1], mode="rb")  # noqa pylint: disable=consider-using-with
-            files.append(
-                ("files", (output_file[0], file_handle)),
-            )
-        try:
-            for i in range(3):
-                try:
-                    r = httpx.put(
-                        options.VIX_SERVER.rstrip("/") + "/api/tasks/results",
-                        params={
-                            "task_id": task_id,
-                        },
-                        files=files,
-                        auth=options.worker_auth(),
-                        timeout=float(options.WORKER_NET_TIMEOUT),
-                    )
-                    if r.status_code == httpx.codes.NOT_FOUND:
-                        return False
-                    if not httpx.codes.is_error(r.status_code):
-                        return True
-                    LOGGER.error("Task %s: server return status: %s", task_id, r.status_code)
-                except (httpx.TimeoutException, httpx.RemoteProtocolError):
-                    if i != 2:
-                        LOGGER.warning("Task %s: attempt number %s: timeout or protocol exception occurred", task_id, i)
-                        continue
-                    LOGGER.error(
-                        "Task %s: attempt number %s: timeout or protocol exception occurred, task failed.", task_id, i
-                    )
-        except Exception as e:
-            LOGGER.exception("Task %s: exception occurred: %s", task_id, e)
-    finally:
-        for f in files:
-            f[1][1].close()
-        remove_task_files(task_id, ["output", "input"])
-    return False
-
-
-def increase_current_task_progress(percent_finished: float) -> None:
-    ACTIVE_TASK["progress"] = min(ACTIVE_TASK["progress"] + percent_finished, 99.0)
-
-
-def task_progress_callback(event: str, data: dict, broadcast: bool = False):
-    LOGGER.debug("%s(broadcast=%s): %s", event, broadcast, data)
-    if not ACTIVE_TASK:
-        LOGGER.warning("ACTIVE_TASK is empty, event = %s.", event)
-        return
-    node_percent = 99 / ACTIVE_TASK["nodes_count"]
-
-    if event == "executing":
-        if options.NODES_TIMING:
-            last_node_id_timing = ACTIVE_TASK.get("timing_last_node_id", 0)
-            current_time = time.perf_counter()
-            if last_node_id_timing and last_node_id_timing != data["node"]:
-                LOGGER.log(
-                    LOGGER.getEffectiveLevel(),
-                    "Flow %s, node %s execution time: %s",
-                    ACTIVE_TASK["task_id"],
-                    data["node"],
-                    current_time - ACTIVE_TASK["timing_last_time"],
-                )
-            ACTIVE_TASK["timing_last_node_id"] = data["node"]
-            ACTIVE_TASK["timing_last_time"] = current_time
-        if not ACTIVE_TASK["current_node"]:
-            ACTIVE_TASK["current_node"] = data["node"]
-        if ACTIVE_TASK["current_node"] != data["node"]:
-            increase_current_task_progress(node_percent)
-            ACTIVE_TASK["current_node"] = data["node"]
-    elif event == "progress" and "max" in data and "value" in data:
-        ACTIVE_TASK["current_node"] = ""
-        increase_current_task_progress(node_percent / int(data["max"]))
-    elif event == "execution_error":
-        ACTIVE_TASK["error"] = data["exception_message"]
-        LOGGER.error(
-            "Exception occurred during executing task:\n%s\n%s",
-            data["exception_message"],
-            data["traceback"],
-        )
-    elif event == "execution_cached" and len(data["nodes"]) > 1:
-        increase_current_task_progress((len(data["nodes"]) - 1) * node_percent)
-    elif event == "execution_interrupted":
-        ACTIVE_TASK["interrupted"] = True
-
-
-def background_prompt_executor(prompt_executor, exit_event: threading.Event):
-    global ACTIVE_TASK
-    reply_count_no_tasks = 0
-    last_task_name = ""
-    last_gc_collect = 0
-    need_gc = False
-
-    while True:
-        if need_gc:
-            current_time = time.perf_counter()
-            if (current_time - last_gc_collect) > options.GC_COLLECT_INTERVAL:
-                LOGGER.debug("cleanup_models")
-                cleanup_models()
-                LOGGER.debug("gc.collect")
-                gc.collect()
-                LOGGER.debug("soft_empty_cache")
-                soft_empty_cache(True)
-                last_gc_collect = current_time
-                need_gc = False
-
-        if exit_event.wait(
-            min(
-                options.MIN_PAUSE_INTERVAL + reply_count_no_tasks * options.MAX_PAUSE_INTERVAL / 10,
-                options.MAX_PAUSE_INTERVAL,
-            ),
-        ):
-            break
-
-        ACTIVE_TASK = get_incomplete_task_without_error(list(get_installed_flows()), last_task_name)
-        if not ACTIVE_TASK:
-            reply_count_no_tasks = min(reply_count_no_tasks + 1, 10)
-            continue
-        if init_active_task_inputs_from_server() is False:
-            ACTIVE_TASK = {}
-            continue
-        last_task_name = ACTIVE_TASK["name"]
-        ACTIVE_TASK["nodes_count"] = len(list(ACTIVE_TASK["flow_comfy"].keys()))
-        ACTIVE_TASK["current_node"] = ""
-        prompt_executor.server.last_prompt_id = str(ACTIVE_TASK["task_id"])
-        if options.GPU_MEM_TRACKING and torch.cuda.is_available():
-            torch.cuda.reset_peak_memory_stats()
-        execution_start_time = time.perf_counter()
-        ACTIVE_TASK["execution_start_time"] = execution_start_time
-        threading.Thread(target=update_task_progress_thread, args=(ACTIVE_TASK,), daemon=True).start()
-        prompt_executor.execute(
-            ACTIVE_TASK["flow_comfy"],
-            str(ACTIVE_TASK["task_id"]),
-            {"client_id": "vix"},
-            [str(i["comfy_node_id"]) for i in ACTIVE_TASK["outputs"]],
-        )
-        current_time = time.perf_counter()
-        if ACTIVE_TASK.get("interrupted", False) is False and not ACTIVE_TASK["error"]:
-            ACTIVE_TASK["execution_time"] = current_time - execution_start_time
-            if options.GPU_MEM_TRACKING and torch.cuda.is_available():
-                max_mem = torch.cuda.max_memory_allocated() / 1024**2
-                LOGGER.log(
-                    LOGGER.getEffectiveLevel(),
-                    "Flow %s with id=%s consumed a maximum of %.2f MB",
-                    ACTIVE_TASK["name"],
-                    ACTIVE_TASK["task_id"],
-                    max_mem,
-                )
-            ACTIVE_TASK["progress"] = 100.0
-        ACTIVE_TASK = {}
-        LOGGER.info("Prompt executed in %f seconds", current_time - execution_start_time)
-        need_gc = True
-
-
-def update_task_progress_thread(active_task: dict) -> None:
-    last_info = active_task.copy()
-    try:
-        while True:
-            if last_info != active_task:
-                last_info = active_task.copy()
-                if last_info["progress"] == 100.0:
-                    if upload_results_to_server(last_info):
-                        update_task_progress(last_info)
-                    break
-                if not update_task_progress(last_info):
-                    active_task["interrupted"] = True
-                    interrupt_processing()
-                    break
-                if last_info["error"]:
-                    break
-                active_task["execution_time"] = last_info["execution_time"]
-            else:
-                time.sleep(0.1)
-    finally:
-        remove_task_lock(last_info["task_id"])
-
-
 def update_task_info_database(task_id: int, update_fields: dict) -> bool:
     with database.SESSION() as session:
         try:
@@ -1,96 +1,127 @@
 import asyncio
 import logging
 import threading
+import time
 import typing
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
-from sqlalchemy import select, update
+from sqlalchemy import delete, select, update
 from sqlalchemy.exc import IntegrityError
 
 from . import database, options
 from .comfyui import interrupt_processing
+from .db_queries import flush_workers_heartbeats
+from .db_queries_async import (
+    flush_workers_heartbeats_async,
+    get_fair_share_weights_async,
+    get_flow_max_execution_time_async,
+    get_flows_vram_peaks_async,
+)
+from .fair_share import get_record_task_dispatched_query, get_remove_passed_tags_query
+from .metrics import increment_metric
 from .pydantic_models import (
     TaskDetails,
     TaskDetailsShort,
-    UserInfo,
+    TasksChanges,
     WorkerDetailsRequest,
 )
 from .tasks_engine import (
-    __get_task_query,
-    __get_tasks_query,
     __lock_task_and_return_details,
-    background_prompt_executor,
-    remove_task_files,
+    age_queued_tasks_database,
+    preempt_tasks_database,
+    reap_expired_task_locks_database,
+    remove_tasks_files,
 )
 from .tasks_engine_etc import (
-    TASK_DETAILS_COLUMNS_SHORT,
+    PREEMPTED_FOR_TASKS,
+    TASK_PROGRESS_EVENT_COLUMNS,
+    child_tasks_to_tree,
+    get_age_queued_tasks_queries,
+    get_child_tasks_query,
+    get_claim_incomplete_task_without_error_query,
+    get_expired_task_locks_condition,
+    get_extend_task_lock_query,
+    get_extend_tasks_locks_query,
+    get_flows_reload_cost,
     get_get_incomplete_task_without_error_query,
-    init_new_task_details,
+    get_insert_tasks_queue_query,
+    get_preemption_victim_query,
+    get_removed_tasks_query,
+    get_task_lock_expires_at,
+    get_task_progress_event,
+    get_task_query,
+    get_task_state,
+    get_tasks_changed_condition,
+    get_tasks_fitting_worker_memory,
+    get_tasks_query,
+    get_urgent_tasks_query,
+    get_worker_memory,
     prepare_worker_info_update,
+    should_preempt_for_task,
     task_details_from_dict,
     task_details_short_to_dict,
     task_details_to_dict,
 )
+from .tasks_events import notify_tasks_queued, publish_task_progress
+from .tasks_worker import background_prompt_executor
+from .webhooks import webhooks_dispatcher
+from .workers_heartbeats import (
+    record_worker_heartbeat,
+    set_worker_memory,
+    set_worker_tasks_to_give_cache,
+)
 
 LOGGER = logging.getLogger("visionatrix")
 
 
-async def create_new_task_async(name: str, input_params: dict, user_info: UserInfo) -> dict:
+async def create_new_tasks_async(count: int) -> list[int]:
     async with database.SESSION_ASYNC() as session:
         try:
-            new_task_queue = database.TaskQueue()
-            session.add(new_task_queue)
+            query = get_insert_tasks_queue_query(session.get_bind().dialect.name, count)
+            tasks_ids = sorted((await session.execute(query)).scalars().all())
             await session.commit()
         except Exception:
             await session.rollback()
-            LOGGER.exception("Failed to add `%s` to TaskQueue(%s)", name, user_info.user_id)
+            LOGGER.exception("Failed to add %s tasks to TaskQueue", count)
             raise
-    remove_task_files(new_task_queue.id, ["output", "input"])
-    return init_new_task_details(new_task_queue.id, name, input_params, user_info)
+    remove_tasks_files(tasks_ids, ["output", "input"])
+    return tasks_ids
 
 
-async def put_task_in_queue_async(task_details: dict) -> None:
-    LOGGER.debug("Put flow in queue: %s", task_details)
+async def put_tasks_in_queue_async(tasks_details: list[dict]) -> None:
+    LOGGER.debug("Put flows in queue: %s", [i["task_id"] for i in tasks_details])
     async with database.SESSION_ASYNC() as session:
         try:
-            session.add(task_details_from_dict(task_details))
+            session.add_all([task_details_from_dict(i) for i in tasks_details])
             await session.commit()
         except Exception:
             await session.rollback()
-            LOGGER.exception("Failed to put task in queue: %s", task_details["task_id"])
-            remove_task_files(task_details["task_id"], ["input"])
+            LOGGER.exception("Failed to put tasks in queue: %s", [i["task_id"] for i in tasks_details])
+            remove_tasks_files([i["task_id"] for i in tasks_details], ["input"])
             raise
+    notify_tasks_queued()
 
 
-async def fetch_child_tasks_async(session, parent_task_ids: list[int]) -> dict[int, list[TaskDetailsShort]]:
+async def fetch_child_tasks_async(
+    session, parent_task_ids: list[int], fields: list[str] | None = None
+) -> dict[int, list[TaskDetailsShort]]:
     if not parent_task_ids:
         return {}
-
-    query = (
-        select(*TASK_DETAILS_COLUMNS_SHORT)
-        .outerjoin(database.TaskLock, database.TaskLock.task_id == database.TaskDetails.task_id)
-        .filter(database.TaskDetails.parent_task_id.in_(parent_task_ids))
+    return child_tasks_to_tree(
+        (await session.execute(get_child_tasks_query(parent_task_ids, fields))).all(), parent_task_ids
     )
-    child_tasks = (await session.execute(query)).all()
 
-    parent_to_children = {}
-    for task in child_tasks:
-        task_details = task_details_short_to_dict(task)
-        parent_to_children.setdefault(task.parent_task_id, []).append(task_details)
 
-    next_level_parent_ids = [task.task_id for task in child_tasks]
-    next_level_children = await fetch_child_tasks_async(session, next_level_parent_ids)
-    for children in parent_to_children.values():
-        for child in children:
-            child["child_tasks"] = next_level_children.get(child["task_id"], [])
-    return parent_to_children
-
-
-async def get_task_async(task_id: int, user_id: str | None = None, fetch_child: bool = False) -> dict | None:
+async def get_task_async(
+    task_id: int, user_id: str | None = None, fetch_child: bool = False, columns: list | None = None
+) -> dict | None:
+    """Returns the task details, or only the `columns` of the task if they are specified."""
     async with database.SESSION_ASYNC() as session:
         try:
-            query = __get_task_query(task_id, user_id)
+            query = get_task_query(task_id, user_id, columns)
             task = (await session.execute(query)).one_or_none()
+            if task and columns is not None:
+                return dict(zip((i.key for i in columns), task, strict=True))
             if task:
                 task_dict = task_details_to_dict(task)
                 if fetch_child:
@@ -110,14 +141,21 @@ async def get_tasks_async(
     user_id: str | None = None,
     fetch_child: bool = False,
     only_parent: bool = False,
+    state: str | None = None,
+    cursor: tuple | None = None,
+    limit: int = 0,
+    order_by: str = "task_id",
+    fields: list[str] | None = None,
 ) -> dict[int, TaskDetails]:
     async with database.SESSION_ASYNC() as session:
         try:
-            query = __get_tasks_query(name, group_scope, finished, user_id, only_parent=only_parent)
+            query = get_tasks_query(
+                name, group_scope, finished, user_id, only_parent, state, cursor, limit, order_by, fields=fields
+            )
             results = (await session.execute(query)).all()
             tasks = {}
             task_ids = [task.task_id for task in results]
-            child_tasks = await fetch_child_tasks_async(session, task_ids) if fetch_child else {}
+            child_tasks = await fetch_child_tasks_async(session, task_ids, fields) if fetch_child else {}
             for task in results:
                 task_details = task_details_to_dict(task)
                 task_details["child_tasks"] = child_tasks.get(task.task_id, [])
@@ -135,14 +173,21 @@ async def get_tasks_short_async(
     finished: bool | None = None,
     fetch_child: bool = False,
     only_parent: bool = False,
+    state: str | None = None,
+    cursor: tuple | None = None,
+    limit: int = 0,
+    order_by: str = "task_id",
+    fields: list[str] | None = None,
 ) -> dict[int, TaskDetailsShort]:
     async with database.SESSION_ASYNC() as session:
         try:
-            query = __get_tasks_query(name, group_scope, finished, user_id, full_info=False, only_parent=only_parent)
+            query = get_tasks_query(
+                name, group_scope, finished, user_id, only_parent, state, cursor, limit, order_by, False, fields
+            )
             results = (await session.execute(query)).all()
             tasks = {}
             task_ids = [task.task_id for task in results]
-            child_tasks = await fetch_child_tasks_async(session, task_ids) if fetch_child else {}
+            child_tasks = await fetch_child_tasks_async(session, task_ids, fields) if fetch_child else {}
             for task in results:
                 task_details = task_details_short_to_dict(task)
                 task_details["child_tasks"] = child_tasks.get(task.task_id, [])
@@ -153,6 +198,42 @@ async def get_tasks_short_async(
             raise
 
 
+async def get_tasks_changes_async(
+    user_id: str, since: datetime | None, name: str | None = None, group_scope: int = 1
+) -> TasksChanges:
+    cursor = datetime.utcnow()
+    reset = since is None or since < cursor - timedelta(seconds=options.TASKS_TOMBSTONES_MAX_AGE)
+    async with database.SESSION_ASYNC() as session:
+        try:
+            query = get_tasks_query(name, group_scope, None, user_id, full_info=False)
+            removed_tasks = []
+            if not reset:
+                query = query.filter(get_tasks_changed_condition(since))
+                removed_tasks = (
+                    await session.execute(get_removed_tasks_query(user_id, since, name, group_scope))
+                ).scalars()
+            tasks = {i.task_id: task_details_short_to_dict(i) for i in (await session.execute(query)).all()}
+            return TasksChanges(cursor=cursor, reset=reset, tasks=tasks, removed_tasks=list(removed_tasks))
+        except Exception:
+            LOGGER.exception("Failed to retrieve changes of the tasks: `%s`, since=%s", name, since)
+            raise
+
+
+async def extend_tasks_locks_database_async(
+    task_ids: list[int], worker_user_id: str, worker_details: WorkerDetailsRequest
+) -> list[int]:
+    worker_id = prepare_worker_info_update(worker_user_id, worker_details)[0]
+    async with database.SESSION_ASYNC() as session:
+        try:
+            r = (await session.execute(get_extend_tasks_locks_query(task_ids, worker_id))).scalars().all()
+            await session.commit()
+            return list(r)
+        except Exception as e:
+            await session.rollback()
+            LOGGER.exception("Failed to extend locks of the tasks %s: %s", task_ids, e)
+    return []
+
+
 async def update_task_outputs_async(task_id: int, outputs: list[dict]) -> bool:
     async with database.SESSION_ASYNC() as session:
         try:
@@ -175,36 +256,64 @@ async def get_incomplete_task_without_error_database_async(
     tasks_to_ask: list[str],
     last_task_name: str,
     user_id: str | None = None,
+    loaded_models: list[str] | None = None,
 ) -> dict:
     if not tasks_to_ask:
         return {}
+    flows_reload_cost = get_flows_reload_cost(tasks_to_ask, loaded_models)
     async with database.SESSION_ASYNC() as session:
         try:
             worker_id, worker_device_name, worker_info_values = prepare_worker_info_update(
                 worker_user_id, worker_details
             )
-            result = await session.execute(
-                update(database.Worker).where(database.Worker.worker_id == worker_id).values(**worker_info_values)
-            )
-            tasks_to_give = []
-            if result.rowcount == 0:
-                session.add(
-                    database.Worker(
-                        user_id=worker_user_id,
-                        worker_id=worker_id,
-                        device_name=worker_device_name,
-                        **worker_info_values,
-                    )
+            tasks_to_give = record_worker_heartbeat(worker_id, worker_info_values)
+            if tasks_to_give is None:
+                result = await session.execute(
+                    update(database.Worker).where(database.Worker.worker_id == worker_id).values(**worker_info_values)
                 )
-            else:
-                query = select(database.Worker).filter(database.Worker.worker_id == worker_id)
-                tasks_to_give = (await session.execute(query)).scalar().tasks_to_give
-            query = get_get_incomplete_task_without_error_query(tasks_to_ask, tasks_to_give, last_task_name, user_id)
-            task = (await session.execute(query)).scalar()
-            if not task:
+                tasks_to_give = []
+                if result.rowcount == 0:
+                    session.add(
+                        database.Worker(
+                            user_id=worker_user_id,
+                            worker_id=worker_id,
+                            device_name=worker_device_name,
+                            **worker_info_values,
+                        )
+                    )
+                else:
+                    query = select(database.Worker.tasks_to_give).filter(database.Worker.worker_id == worker_id)
+                    tasks_to_give = (await session.execute(query)).scalar()
                 await session.commit()
+                set_worker_tasks_to_give_cache(worker_id, tasks_to_give, flushed=True)
+            worker_memory = get_worker_memory(worker_info_values)
+            set_worker_memory(worker_id, worker_memory)
+            tasks_to_ask = get_tasks_fitting_worker_memory(
+                tasks_to_ask, worker_memory, await get_flows_vram_peaks_async()
+            )
+            if not tasks_to_ask:
                 return {}
-            return await lock_task_and_return_details_async(session, task)
+            if session.get_bind().dialect.name == "postgresql":
+                query = get_claim_incomplete_task_without_error_query(
+                    tasks_to_ask, tasks_to_give, last_task_name, user_id, flows_reload_cost, worker_id
+                )
+                task = (await session.execute(query)).scalar()
+                await session.commit()
+                task_details = __lock_task_and_return_details(task) if task else {}
+            else:
+                query = get_get_incomplete_task_without_error_query(
+                    tasks_to_ask, tasks_to_give, last_task_name, user_id, flows_reload_cost
+                )
+                task = (await session.execute(query)).scalar()
+                if not task:
+                    await session.commit()
+                    return {}
+                task_details = await lock_task_and_return_details_async(session, task, worker_id)
+            if task_details:
+                await record_tasks_dispatched_async(session, [task_details])
+                if not task_details["max_execution_time"]:
+                    task_details["max_execution_time"] = await get_flow_max_execution_time_async(task_details["name"])
+            return task_details
         except Exception as e:
             await session.rollback()
             LOGGER.exception("Failed to retrieve task for processing: %s", e)
@@ -213,9 +322,39 @@ async def get_incomplete_task_without_error_database_async(
             await session.close()
 
 
-async def lock_task_and_return_details_async(session, task: type[database.TaskDetails] | database.TaskDetails) -> dict:
+async def record_tasks_dispatched_async(session, tasks: list[dict]) -> None:
+    """Advances the fair share tags of the users of the dispatched tasks, see `fair_share`."""
     try:
-        session.add(database.TaskLock(task_id=task.task_id, locked_at=datetime.utcnow()))
+        fair_share_weights = await get_fair_share_weights_async()
+        dialect_name = session.get_bind().dialect.name
+        for i in tasks:
+            await session.execute(
+                get_record_task_dispatched_query(
+                    dialect_name, i["user_id"], i["group_scope"], fair_share_weights.get(i["user_id"], 1.0)
+                )
+            )
+        await session.execute(get_remove_passed_tags_query())
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        LOGGER.exception("Failed to record the dispatched tasks %s: %s", [i["task_id"] for i in tasks], e)
+
+
+async def lock_task_and_return_details_async(
+    session, task: type[database.TaskDetails] | database.TaskDetails, worker_id: str
+) -> dict:
+    try:
+        session.add(
+            database.TaskLock(
+                task_id=task.task_id,
+                locked_at=datetime.utcnow(),
+                expires_at=get_task_lock_expires_at(),
+                worker_id=worker_id,
+            )
+        )
+        await session.execute(
+            update(database.TaskDetails).where(database.TaskDetails.task_id == task.task_id).values(state="running")
+        )
         await session.commit()
         return __lock_task_and_return_details(task)
     except IntegrityError:
@@ -240,19 +379,32 @@ async def update_task_progress_database_async(
                 "execution_time": execution_time,
                 "updated_at": datetime.now(timezone.utc),
                 "worker_id": worker_id,
+                "state": get_task_state(progress, error),
             }
+            result = await session.execute(get_extend_task_lock_query(task_id, worker_id))
+            if result.rowcount == 0:
+                LOGGER.warning(
+                    "Task %s: progress update rejected, the task is not locked by %s(lease expired or preempted).",
+                    task_id,
+                    worker_id,
+                )
+                return False
             if progress == 100.0:
                 update_values["finished_at"] = datetime.now(timezone.utc)
-            result = await session.execute(
-                update(database.TaskDetails).where(database.TaskDetails.task_id == task_id).values(**update_values)
-            )
-            await session.commit()
-            if (task_updated := result.rowcount == 1) is True:
+            task = (
                 await session.execute(
-                    update(database.Worker).where(database.Worker.worker_id == worker_id).values(**worker_info_values)
+                    update(database.TaskDetails)
+                    .where(database.TaskDetails.task_id == task_id)
+                    .values(**update_values)
+                    .returning(*TASK_PROGRESS_EVENT_COLUMNS)
                 )
-                await session.commit()
-            return task_updated
+            ).one_or_none()
+            await session.commit()
+            if task is None:
+                return False
+            record_worker_heartbeat(worker_id, worker_info_values)
+            publish_task_progress(get_task_progress_event(task_id, task, update_values))
+            return True
         except Exception as e:
             interrupt_processing()
             await session.rollback()
@@ -269,11 +421,13 @@ async def task_restart_database_async(task_id: int) -> bool:
                 "execution_time": 0.0,
                 "updated_at": datetime.now(timezone.utc),
                 "worker_id": None,
+                "state": "queued",
             }
             result = await session.execute(
                 update(database.TaskDetails).where(database.TaskDetails.task_id == task_id).values(**update_values)
             )
             await session.commit()
+            notify_tasks_queued()
             return result.rowcount == 1
         except Exception as e:
             interrupt_processing()
@@ -282,13 +436,145 @@ async def task_restart_database_async(task_id: int) -> bool:
     return False
 
 
+async def age_queued_tasks_database_async() -> None:
+    if not options.TASKS_PRIORITY_AGING:
+        return
+    async with database.SESSION_ASYNC() as session:
+        try:
+            for query in get_age_queued_tasks_queries():
+                await session.execute(query)
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            LOGGER.exception("Failed to age the queued tasks: %s", e)
+
+
+async def reap_expired_task_locks_database_async() -> None:
+    async with database.SESSION_ASYNC() as session:
+        try:
+            expired_tasks = (
+                (await session.execute(select(database.TaskLock.task_id).filter(get_expired_task_locks_condition())))
+                .scalars()
+                .all()
+            )
+            requeued_tasks = []
+            for task_id in expired_tasks:
+                result = await session.execute(
+                    delete(database.TaskLock).where(
+                        database.TaskLock.task_id == task_id, get_expired_task_locks_condition()
+                    )
+                )
+                if result.rowcount == 0:
+                    continue  # lease was extended in the meantime
+                await session.execute(
+                    update(database.TaskDetails)
+                    .where(
+                        database.TaskDetails.task_id == task_id,
+                        database.TaskDetails.progress != 100.0,
+                        database.TaskDetails.error == "",
+                    )
+                    .values(
+                        progress=0.0,
+                        execution_time=0.0,
+                        worker_id=None,
+                        state="queued",
+                        updated_at=datetime.now(timezone.utc),
+                    )
+                )
+                requeued_tasks.append(task_id)
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            LOGGER.exception("Failed to release expired task locks: %s", e)
+            return
+    for task_id in requeued_tasks:
+        LOGGER.warning("Task %s: lock lease has expired, the task was returned to the queue.", task_id)
+    if requeued_tasks:
+        notify_tasks_queued()
+
+
+async def preempt_tasks_database_async() -> None:
+    if not options.TASKS_PREEMPTION_PRIORITY:
+        return
+    async with database.SESSION_ASYNC() as session:
+        try:
+            preempted_tasks = []
+            for urgent_task_id, urgent_task_name, urgent_task_priority in (
+                await session.execute(get_urgent_tasks_query())
+            ).all():
+                if not should_preempt_for_task(urgent_task_id):
+                    continue
+                victim = (
+                    await session.execute(
+                        get_preemption_victim_query(
+                            urgent_task_name, urgent_task_priority, [i[1] for i in preempted_tasks]
+                        )
+                    )
+                ).one_or_none()
+                if victim is None:
+                    break  # no running tasks with lower priority left
+                result = await session.execute(delete(database.TaskLock).where(database.TaskLock.task_id == victim[0]))
+                if result.rowcount == 0:
+                    continue  # task was finished in the meantime
+                await session.execute(
+                    update(database.TaskDetails)
+                    .where(database.TaskDetails.task_id == victim[0], database.TaskDetails.state == "running")
+                    .values(
+                        progress=0.0,
+                        execution_time=0.0,
+                        worker_id=None,
+                        state="queued",
+                        updated_at=datetime.now(timezone.utc),
+                    )
+                )
+                preempted_tasks.append((urgent_task_id, victim[0], victim[1]))
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            LOGGER.exception("Failed to preempt tasks: %s", e)
+            return
+    for urgent_task_id, task_id, execution_time in preempted_tasks:
+        PREEMPTED_FOR_TASKS[urgent_task_id] = time.monotonic()
+        increment_metric("tasks_preempted")
+        increment_metric("tasks_preempted_lost_seconds", execution_time)
+        LOGGER.info(
+            "Task %s: preempted for the task %s, lost %.1f seconds of work.", task_id, urgent_task_id, execution_time
+        )
+    if preempted_tasks:
+        notify_tasks_queued()
+
+
 async def start_tasks_engine(comfy_queue: typing.Any, exit_event: threading.Event) -> None:
     async def start_background_tasks_engine(prompt_executor):
         await asyncio.to_thread(background_prompt_executor, prompt_executor, exit_event)
 
+    async def start_task_locks_reaper():
+        while not exit_event.is_set():
+            if options.VIX_MODE == "SERVER":
+                await reap_expired_task_locks_database_async()
+                await age_queued_tasks_database_async()
+                await preempt_tasks_database_async()
+            else:
+                await asyncio.to_thread(reap_expired_task_locks_database)
+                await asyncio.to_thread(age_queued_tasks_database)
+                await asyncio.to_thread(preempt_tasks_database)
+            await asyncio.sleep(min(options.TASK_LOCK_LEASE / 3, 5.0))
+
+    async def start_workers_heartbeats_flusher():
+        while not exit_event.is_set():
+            await asyncio.sleep(options.WORKERS_HEARTBEAT_INTERVAL)
+            if options.VIX_MODE == "SERVER":
+                await flush_workers_heartbeats_async()
+            else:
+                await asyncio.to_thread(flush_workers_heartbeats)
+
     database.init_database_engine()
     if options.VIX_MODE != "SERVER":
         _ = asyncio.create_task(start_background_tasks_engine(comfy_queue))  # noqa
+    if not (options.VIX_MODE == "WORKER" and options.VIX_SERVER):
+        _ = asyncio.create_task(start_task_locks_reaper())  # noqa
+        _ = asyncio.create_task(start_workers_heartbeats_flusher())  # noqa
+        _ = asyncio.create_task(webhooks_dispatcher(exit_event))  # noqa
 
 
 async def update_task_info_database_async(task_id: int, update_fields: dict) -> bool:
@@ -1,9 +1,33 @@
-from datetime import datetime, timezone
+import time
+from datetime import datetime, timedelta, timezone
 
-from sqlalchemy import Row, desc, select
+from sqlalchemy import (
+    Integer,
+    Row,
+    and_,
+    case,
+    cast,
+    desc,
+    extract,
+    func,
+    literal,
+    null,
+    or_,
+    select,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import aliased
 
-from . import database
+from . import database, options
+from .fair_share import order_by_fair_share
+from .flows import get_installed_flows
 from .pydantic_models import UserInfo, WorkerDetailsRequest
+from .workers_heartbeats import get_max_workers_memory
+
+PREEMPTED_FOR_TASKS: dict[int, float] = {}
+"""Queued tasks for which a running task was preempted by this process, with the time of the preemption."""
 
 TASK_DETAILS_COLUMNS_SHORT = [
     database.TaskDetails.task_id,
@@ -21,18 +45,67 @@ TASK_DETAILS_COLUMNS_SHORT = [
     database.TaskDetails.parent_task_id,
     database.TaskDetails.parent_task_node_id,
     database.TaskDetails.translated_input_params,
+    database.TaskDetails.created_at,
+    database.TaskDetails.updated_at,
 ]
 
 TASK_DETAILS_COLUMNS = [
     *TASK_DETAILS_COLUMNS_SHORT,
     database.TaskDetails.flow_comfy,
     database.TaskDetails.user_id,
-    database.TaskDetails.created_at,
-    database.TaskDetails.updated_at,
     database.TaskDetails.finished_at,
     database.TaskDetails.webhook_url,
     database.TaskDetails.webhook_headers,
+    database.TaskDetails.max_execution_time,
+]
+
+TASK_TOMBSTONE_COLUMNS = [
+    database.TaskDetails.task_id,
+    database.TaskDetails.user_id,
+    database.TaskDetails.name,
+    database.TaskDetails.group_scope,
+]
+
+TASK_PROGRESS_EVENT_COLUMNS = [
+    database.TaskDetails.user_id,
+    database.TaskDetails.name,
+    database.TaskDetails.group_scope,
+    database.TaskDetails.parent_task_id,
+]
+
+TASKS_CHANGES_OVERLAP = 3.0
+"""Seconds by which the changes feed looks back before the cursor, for the changes committed after the previous
+request with the earlier time. Such tasks can be returned twice."""
+
+TASK_DETAILS_OPTIONAL_FIELDS = (
+    "input_params",
+    "outputs",
+    "input_files",
+    "translated_input_params",
+    "flow_comfy",
+    "webhook_headers",
+)
+"""Large JSON columns that the tasks listing reads only when they are requested."""
+
+TASK_DETAILS_COLUMNS_OWNER = [
+    database.TaskDetails.task_id,
+    database.TaskDetails.user_id,
+    database.TaskDetails.name,
+    database.TaskDetails.progress,
+    database.TaskDetails.error,
+    database.TaskDetails.group_scope,
+    database.TaskDetails.webhook_url,
+    database.TaskDetails.webhook_headers,
 ]
+"""Columns for the ownership checks and the progress updates."""
+
+TASK_DETAILS_COLUMNS_FILES = [
+    database.TaskDetails.task_id,
+    database.TaskDetails.user_id,
+    database.TaskDetails.input_files,
+    database.TaskDetails.outputs,
+]
+"""Columns for the access to the input and result files of the task."""
 
 
 def init_new_task_details(task_id: int, name: str, input_params: dict, user_info: UserInfo) -> dict:
@@ -58,6 +131,7 @@ def task_details_from_dict(task_details: dict) -> database.TaskDetails:
         priority=task_details["priority"],
         progress=task_details["progress"],
         error=task_details["error"],
+        state=task_details.get("state", "queued"),
         outputs=task_details["outputs"],
         input_files=task_details["input_files"],
         flow_comfy=task_details["flow_comfy"],
@@ -72,6 +146,7 @@ def task_details_from_dict(task_details: dict) -> database.TaskDetails:
         parent_task_id=task_details.get("parent_task_id"),
         parent_task_node_id=task_details.get("parent_task_node_id"),
         translated_input_params=task_details.get("translated_input_params"),
+        max_execution_time=task_details.get("max_execution_time"),
     )
 
 
@@ -80,13 +155,12 @@ def task_details_to_dict(task_details: Row) -> dict:
     r.update(
         {
             "task_id": task_details.task_id,
-            "flow_comfy": task_details.flow_comfy,
+            "flow_comfy": task_details.flow_comfy or {},
             "user_id": task_details.user_id,
-            "created_at": task_details.created_at,
-            "updated_at": task_details.updated_at,
             "finished_at": task_details.finished_at,
             "webhook_url": task_details.webhook_url,
             "webhook_headers": task_details.webhook_headers,
+            "max_execution_time": task_details.max_execution_time,
         }
     )
     return r
@@ -99,9 +173,9 @@ def task_details_short_to_dict(task_details: Row) -> dict:
         "progress": task_details.progress,
         "error": task_details.error,
         "name": task_details.name,
-        "input_params": task_details.input_params,
-        "outputs": task_details.outputs,
-        "input_files": task_details.input_files,
+        "input_params": task_details.input_params or {},
+        "outputs": task_details.outputs or [],
+        "input_files": task_details.input_files or [],
         "execution_time": task_details.execution_time,
         "group_scope": task_details.group_scope,
         "locked_at": task_details.locked_at,
@@ -110,9 +184,122 @@ def task_details_short_to_dict(task_details: Row) -> dict:
         "parent_task_node_id": task_details.parent_task_node_id,
         "child_tasks": [],
         "translated_input_params": task_details.translated_input_params,
+        "created_at": task_details.created_at,
+        "updated_at": task_details.updated_at,
     }
 
 
+def project_task_details_columns(columns: list, fields: list[str] | None) -> list:
+    """Replaces optional columns missing in `fields` with NULL, so they are not read. `None` selects all columns."""
+    if fields is None:
+        return columns
+    return [
+        null().label(i.key) if i.key in TASK_DETAILS_OPTIONAL_FIELDS and i.key not in fields else i for i in columns
+    ]
+
+
+def get_task_query(task_id: int, user_id: str | None, columns: list | None = None):
+    query = select(*(TASK_DETAILS_COLUMNS if columns is None else columns)).filter(
+        database.TaskDetails.task_id == task_id
+    )
+    if columns is None:
+        query = query.outerjoin(database.TaskLock, database.TaskLock.task_id == database.TaskDetails.task_id)
+    if user_id is not None:
+        query = query.filter(database.TaskDetails.user_id == user_id)
+    return query
+
+
+def get_tasks_query(
+    name: str | None,
+    group_scope: int,
+    finished: bool | None,
+    user_id: str | None,
+    only_parent: bool = False,
+    state: str | None = None,
+    cursor: tuple | None = None,
+    limit: int = 0,
+    order_by: str = "task_id",
+    full_info: bool = True,
+    fields: list[str] | None = None,
+):
+    """Tasks matching the filters, sorted by `order_by`: "task_id" or "updated_at", with "-" prefix for descending.
+
+    Pages are selected with the keyset `cursor`, the sort key of the last task of the previous page: `(task_id,)`,
+    or `(updated_at, task_id)` when sorted by "updated_at" (the creation time for the never updated tasks).
+    """
+    columns = project_task_details_columns(TASK_DETAILS_COLUMNS if full_info else TASK_DETAILS_COLUMNS_SHORT, fields)
+    query = select(*columns).outerjoin(database.TaskLock, database.TaskLock.task_id == database.TaskDetails.task_id)
+
+    if user_id is not None:
+        query = query.filter(database.TaskDetails.user_id == user_id)
+    if name is not None:
+        query = query.filter(database.TaskDetails.name == name)
+    if finished is not None:
+        if finished:
+            query = query.filter(database.TaskDetails.progress == 100.0)
+        else:
+            query = query.filter(database.TaskDetails.progress < 100.0)
+    if state is not None:
+        query = query.filter(database.TaskDetails.state == state)
+    if only_parent:
+        query = query.filter(
+            (database.TaskDetails.parent_task_id == None)  # noqa # pylint: disable=singleton-comparison
+            | (database.TaskDetails.parent_task_id == 0)
+        )
+    if group_scope:
+        query = query.filter(database.TaskDetails.group_scope == group_scope)
+    descending = order_by.startswith("-")
+    if order_by.lstrip("-") == "updated_at":
+        sort_key = (get_task_updated_at(), database.TaskDetails.task_id)
+    else:
+        sort_key = (database.TaskDetails.task_id,)
+    if cursor is not None:
+        query = query.filter(tuple_(*sort_key) < tuple_(*cursor) if descending else tuple_(*sort_key) > tuple_(*cursor))
+    query = query.order_by(*[i.desc() if descending else i for i in sort_key])
+    if limit:
+        query = query.limit(limit)
+    return query
+
+
+def get_task_updated_at():
+    """Time of the last change of the task, `updated_at` is not set until the task is changed after its creation.
+
+    The same expression is indexed by `ix_tasks_details_user_group_changed`."""
+    return func.coalesce(database.TaskDetails.updated_at, database.TaskDetails.created_at)
+
+
+def get_tasks_trees_cte(roots_condition):
+    """Recursive CTE with IDs of the tasks matching the condition and of all their child tasks at any depth."""
+    tasks_trees = select(database.TaskDetails.task_id).filter(roots_condition).cte("tasks_trees", recursive=True)
+    return tasks_trees.union(  # UNION (not UNION ALL) stops the recursion even if the links form a cycle
+        select(database.TaskDetails.task_id).join(
+            tasks_trees, database.TaskDetails.parent_task_id == tasks_trees.c.task_id
+        )
+    )
+
+
+def get_child_tasks_query(parent_task_ids: list[int], fields: list[str] | None = None):
+    """All descendants of the tasks with a single query."""
+    child_tasks = get_tasks_trees_cte(database.TaskDetails.parent_task_id.in_(parent_task_ids))
+    return (
+        select(*project_task_details_columns(TASK_DETAILS_COLUMNS_SHORT, fields))
+        .outerjoin(database.TaskLock, database.TaskLock.task_id == database.TaskDetails.task_id)
+        .filter(database.TaskDetails.task_id.in_(select(child_tasks.c.task_id)))
+        .order_by(database.TaskDetails.task_id)
+    )
+
+
+def child_tasks_to_tree(child_tasks: list[Row], parent_task_ids: list[int]) -> dict[int, list[dict]]:
+    """Groups descendants returned by `get_child_tasks_query` under their parents."""
+    parent_to_children = {}
+    for task in child_tasks:
+        parent_to_children.setdefault(task.parent_task_id, []).append(task_details_short_to_dict(task))
+    for children in parent_to_children.values():
+        for child in children:
+            child["child_tasks"] = parent_to_children.get(child["task_id"], [])
+    return {i: parent_to_children[i] for i in parent_task_ids if i in parent_to_children}
+
+
 def prepare_worker_info_update(worker_user_id: str, worker_details: WorkerDetailsRequest) -> tuple[str, str, dict]:
     worker_device = worker_details.devices[0]
     return (
@@ -141,22 +328,327 @@ def get_get_incomplete_task_without_error_query(
     tasks_to_give: list[str],
     last_task_name: str,
     user_id: str | None = None,
+    flows_reload_cost: dict[str, int] | None = None,
 ):
-    query = select(database.TaskDetails).outerjoin(
-        database.TaskLock, database.TaskDetails.task_id == database.TaskLock.task_id
-    )
-    query = query.filter(
-        database.TaskDetails.error == "",
-        database.TaskDetails.progress != 100.0,
-        database.TaskLock.id.is_(None),
+    """Queued tasks in the order they should be dispatched.
+
+    The filtering and the first ORDER BY column use the index (`ix_tasks_details_queued`), the following expressions
+    (fair share, models reload cost) can not, so the queued tasks of the requested flows are sorted on each claim."""
+    query = select(database.TaskDetails).filter(
+        database.TaskDetails.state == "queued",
         database.TaskDetails.name.in_(tasks_to_ask),
     )
     if tasks_to_give:
         query = query.filter(database.TaskDetails.name.in_(tasks_to_give))
     if user_id is not None:
         query = query.filter(database.TaskDetails.user_id == user_id)
+    query = query.order_by(desc(database.TaskDetails.aged_priority))
+    # within the same priority, prefer tasks of the users that received less than their fair share
+    query = order_by_fair_share(query)
+    if flows_reload_cost and len(set(flows_reload_cost.values())) > 1:
+        # within the same priority, prefer tasks for which the worker has to load the fewest models
+        query = query.order_by(
+            case(flows_reload_cost, value=database.TaskDetails.name, else_=max(flows_reload_cost.values()))
+        )
     if last_task_name and last_task_name in tasks_to_ask:
-        query = query.order_by(desc(database.TaskDetails.priority), desc(database.TaskDetails.name == last_task_name))
+        query = query.order_by(desc(database.TaskDetails.name == last_task_name))
+    return query.order_by(database.TaskDetails.task_id)
+
+
+def get_age_queued_tasks_queries() -> list:
+    """UPDATEs that set the `aged_priority` of the queued tasks to their `priority` increased by the time they have been
+    waiting in the queue, see TASKS_PRIORITY_AGING. One query per aged priority level.
+
+    Aging is applied periodically, so the dispatch query orders by the indexed column instead of calculating
+    the increase for each queued task. Only tasks that waited at least one aging interval and did not reach
+    the maximum increase are selected (`created_at` is indexed), and only changed rows are written.
+    """
+    now = datetime.now(timezone.utc)
+    waiting_time = cast(
+        literal(int(now.timestamp())) - extract("epoch", database.TaskDetails.created_at),
+        Integer,
+    )
+    queries = []
+    for level, aging_interval in options.TASKS_PRIORITY_AGING.items():
+        aging_interval = max(int(aging_interval), 1)
+        max_increase = max(15 - level, 0)
+        if not max_increase:
+            continue
+        aged_priority = database.TaskDetails.priority + case(
+            (waiting_time >= aging_interval * max_increase, max_increase), else_=waiting_time // aging_interval
+        )
+        queries.append(
+            update(database.TaskDetails)
+            .where(
+                database.TaskDetails.state == "queued",
+                database.TaskDetails.created_at <= now - timedelta(seconds=aging_interval),
+                database.TaskDetails.priority.op("&")(15) == level,
+                database.TaskDetails.aged_priority < database.TaskDetails.priority + max_increase,
+                database.TaskDetails.aged_priority != aged_priority,
+            )
+            # aging is not a change of the task, so keep `updated_at` (it is used by the changes feed)
+            .values(aged_priority=aged_priority, updated_at=database.TaskDetails.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+    return queries
+
+
+def get_flows_reload_cost(tasks_to_ask: list[str], loaded_models: list[str] | None) -> dict[str, int]:
+    """Returns the number of models that the worker holding `loaded_models` must load to execute each of the flows."""
+    if not loaded_models:
+        return {}
+    installed_flows = get_installed_flows()
+    return {
+        flow_name: len({i.name for i in installed_flows[flow_name].models}.difference(loaded_models))
+        for flow_name in tasks_to_ask
+        if flow_name in installed_flows
+    }
+
+
+def get_worker_memory(worker_info_values: dict) -> int:
+    """Returns the memory in bytes available for the flows on the worker: VRAM, or RAM for the CPU workers."""
+    if worker_info_values["device_type"] != "cpu" and worker_info_values["vram_total"]:
+        return worker_info_values["vram_total"]
+    return worker_info_values["ram_total"] or 0
+
+
+def get_tasks_fitting_worker_memory(
+    tasks_to_ask: list[str], worker_memory: int, flows_vram_peaks: dict[str, int]
+) -> list[str]:
+    """Removes flows from `tasks_to_ask` that require more memory than the worker has.
+
+    The memory required by the flow is the bigger of the declared in the flow `required_memory_gb` and the
+    measured peak usage. Flows that do not fit any of the recently seen workers are left, to not get stuck forever.
+    """
+    if not worker_memory:
+        return tasks_to_ask
+    installed_flows = get_installed_flows()
+    max_workers_memory = get_max_workers_memory()
+    r = []
+    for flow_name in tasks_to_ask:
+        required_memory = flows_vram_peaks.get(flow_name, 0)
+        if flow_name in installed_flows:
+            required_memory = max(required_memory, int(installed_flows[flow_name].required_memory_gb * 1024**3))
+        if required_memory <= worker_memory or required_memory > max_workers_memory:
+            r.append(flow_name)
+    return r
+
+
+def get_claim_incomplete_task_without_error_query(
+    tasks_to_ask: list[str],
+    tasks_to_give: list[str],
+    last_task_name: str,
+    user_id: str | None = None,
+    flows_reload_cost: dict[str, int] | None = None,
+    worker_id: str | None = None,
+):
+    """PostgreSQL only: selects the task, inserts the TaskLock for it and marks it as running in one statement.
+
+    Rows locked by other concurrent claims are skipped (`FOR UPDATE SKIP LOCKED`),
+    so the concurrent workers get different tasks instead of colliding on the same one.
+    """
+    candidate = (
+        get_get_incomplete_task_without_error_query(
+            tasks_to_ask, tasks_to_give, last_task_name, user_id, flows_reload_cost
+        )
+        .limit(1)
+        .with_for_update(of=database.TaskDetails, skip_locked=True)
+        .cte("candidate")
+    )
+    task_lock = (
+        postgresql.insert(database.TaskLock)
+        .from_select(
+            ["task_id", "locked_at", "expires_at", "worker_id"],
+            select(
+                candidate.c.task_id,
+                literal(datetime.utcnow(), database.TaskLock.locked_at.type),
+                literal(get_task_lock_expires_at(), database.TaskLock.expires_at.type),
+                literal(worker_id, database.TaskLock.worker_id.type),
+            ),
+        )
+        .on_conflict_do_nothing(index_elements=["task_id"])
+        .returning(database.TaskLock.task_id)
+        .cte("task_lock")
+    )
+    task_state = (
+        update(database.TaskDetails)
+        .where(database.TaskDetails.task_id.in_(select(task_lock.c.task_id)))
+        .values(state="running")
+        .returning(database.TaskDetails.task_id)
+        .cte("task_state")
+    )
+    claimed_task = aliased(database.TaskDetails, candidate)
+    return select(claimed_task).join(task_state, task_state.c.task_id == claimed_task.task_id)
+
+
+def get_insert_tasks_queue_query(dialect_name: str, count: int):
+    """INSERT of `count` TaskQueue rows with a single statement, returns IDs of the inserted rows."""
+    numbers = select(literal(1).label("n")).cte("numbers", recursive=True)
+    numbers = numbers.union_all(select(numbers.c.n + 1).where(numbers.c.n < count))
+    if dialect_name == "postgresql":
+        insert = postgresql.insert
+        new_id = func.nextval(func.pg_get_serial_sequence(database.TaskQueue.__tablename__, "id"))
     else:
-        query = query.order_by(desc(database.TaskDetails.priority))
-    return query
+        insert = sqlite.insert
+        new_id = null()  # NULL in the INTEGER PRIMARY KEY column is replaced by the next ROWID
+    return (
+        insert(database.TaskQueue)
+        .from_select(["id"], select(new_id).select_from(numbers))
+        .returning(database.TaskQueue.id)
+    )
+
+
+def get_task_state(progress: float, error: str) -> str:
+    if progress == 100.0:
+        return "finished"
+    return "failed" if error else "running"
+
+
+def get_task_progress_event(task_id: int, task: Row, update_values: dict) -> dict:
+    """Progress update for the subscribers, `task` is returned by the `UPDATE` with `TASK_PROGRESS_EVENT_COLUMNS`."""
+    return {
+        "task_id": task_id,
+        "user_id": task.user_id,
+        "name": task.name,
+        "group_scope": task.group_scope,
+        "parent_task_id": task.parent_task_id,
+        "progress": update_values["progress"],
+        "error": update_values["error"],
+        "execution_time": update_values["execution_time"],
+        "state": update_values["state"],
+    }
+
+
+def get_task_lock_expires_at() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=options.TASK_LOCK_LEASE)
+
+
+def get_extend_task_lock_query(task_id: int, worker_id: str):
+    """Extends the lease of the task lock, only if it is held by the worker(`rowcount` is 0 otherwise).
+
+    Locks taken before the owner was recorded (`worker_id` is NULL) can be extended by any worker."""
+    return (
+        update(database.TaskLock)
+        .where(database.TaskLock.task_id == task_id, get_task_lock_owner_condition(worker_id))
+        .values(expires_at=get_task_lock_expires_at())
+    )
+
+
+def get_extend_tasks_locks_query(task_ids: list[int], worker_id: str):
+    """Same as `get_extend_task_lock_query` for many tasks, returns IDs of the tasks which leases were extended."""
+    return (
+        update(database.TaskLock)
+        .where(database.TaskLock.task_id.in_(task_ids), get_task_lock_owner_condition(worker_id))
+        .values(expires_at=get_task_lock_expires_at())
+        .returning(database.TaskLock.task_id)
+    )
+
+
+def get_task_lock_owner_condition(worker_id: str):
+    return or_(database.TaskLock.worker_id == worker_id, database.TaskLock.worker_id.is_(None))
+
+
+def get_expired_task_locks_condition():
+    """Locks with the expired lease. Locks created before leases were introduced expire `TASK_LOCK_LEASE` after
+    they were taken, unless they are extended by a progress update."""
+    now = datetime.utcnow()
+    return or_(
+        database.TaskLock.expires_at < now,
+        and_(
+            database.TaskLock.expires_at.is_(None),
+            database.TaskLock.locked_at < now - timedelta(seconds=options.TASK_LOCK_LEASE),
+        ),
+    )
+
+
+def get_tasks_changed_condition(since: datetime):
+    """Tasks created or updated after `since`(naive UTC), see TASKS_CHANGES_OVERLAP."""
+    since -= timedelta(seconds=TASKS_CHANGES_OVERLAP)
+    return or_(database.TaskDetails.updated_at > since, database.TaskDetails.created_at > since)
+
+
+def get_removed_tasks_query(user_id: str, since: datetime, name: str | None, group_scope: int):
+    query = select(database.TaskTombstone.task_id).filter(
+        database.TaskTombstone.user_id == user_id,
+        database.TaskTombstone.deleted_at > since - timedelta(seconds=TASKS_CHANGES_OVERLAP),
+    )
+    if name is not None:
+        query = query.filter(database.TaskTombstone.name == name)
+    if group_scope:
+        query = query.filter(database.TaskTombstone.group_scope == group_scope)
+    return query.order_by(database.TaskTombstone.task_id)
+
+
+def get_tasks_tombstones_values(removed_tasks: list[Row]) -> list[dict]:
+    """Rows of the removed tasks, returned by the `DELETE` with `TASK_TOMBSTONE_COLUMNS`."""
+    deleted_at = datetime.utcnow()
+    return [
+        {
+            "task_id": i.task_id,
+            "user_id": i.user_id,
+            "name": i.name,
+            "group_scope": i.group_scope,
+            "deleted_at": deleted_at,
+        }
+        for i in removed_tasks
+    ]
+
+
+def get_expired_tombstones_condition():
+    return database.TaskTombstone.deleted_at < datetime.utcnow() - timedelta(seconds=options.TASKS_TOMBSTONES_MAX_AGE)
+
+
+def get_urgent_tasks_query():
+    """Queued tasks that can preempt the running ones, see TASKS_PREEMPTION_PRIORITY."""
+    return (
+        select(database.TaskDetails.task_id, database.TaskDetails.name, database.TaskDetails.priority)
+        .filter(
+            database.TaskDetails.state == "queued",
+            database.TaskDetails.priority.op("&")(15) >= options.TASKS_PREEMPTION_PRIORITY,
+            database.TaskDetails.created_at
+            < datetime.now(timezone.utc) - timedelta(seconds=options.TASKS_PREEMPTION_DELAY),
+        )
+        .order_by(desc(database.TaskDetails.priority), database.TaskDetails.task_id)
+        .limit(16)
+    )
+
+
+def get_preemption_victim_query(urgent_task_name: str, urgent_task_priority: int, excluded_tasks_ids: list[int]):
+    """Running task with a lower priority that has done the least work.
+
+    Tasks on workers that have already executed the urgent task's flow are preferred, as these workers can take it.
+    Prefetched tasks(not yet started) are never selected, as preempting them does not free any worker.
+    """
+    executed_tasks = aliased(database.TaskDetails)
+    executed_urgent_flow = (
+        select(executed_tasks.task_id)
+        .where(
+            executed_tasks.worker_id == database.TaskDetails.worker_id,
+            executed_tasks.name == urgent_task_name,
+            executed_tasks.state == "finished",
+        )
+        .exists()
+    )
+    return (
+        select(database.TaskDetails.task_id, database.TaskDetails.execution_time)
+        .join(database.TaskLock, database.TaskLock.task_id == database.TaskDetails.task_id)
+        .filter(
+            database.TaskDetails.state == "running",
+            database.TaskDetails.priority < urgent_task_priority,
+            database.TaskDetails.execution_time > 0,
+            database.TaskDetails.task_id.not_in(excluded_tasks_ids),
+        )
+        .order_by(desc(executed_urgent_flow), database.TaskDetails.execution_time)
+        .limit(1)
+    )
+
+
+def should_preempt_for_task(task_id: int) -> bool:
+    """Returns False if a running task was already preempted for the `task_id` during the last `TASK_LOCK_LEASE`.
+
+    Gives the worker time to notice the preemption and take the task, so that workers are not preempted one by one.
+    """
+    min_time = time.monotonic() - options.TASK_LOCK_LEASE
+    for k in [k for k, v in PREEMPTED_FOR_TASKS.items() if v < min_time]:
+        del PREEMPTED_FOR_TASKS[k]
+    return task_id not in PREEMPTED_FOR_TASKS
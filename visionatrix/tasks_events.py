@@ -0,0 +1,90 @@
+import asyncio
+import contextlib
+import threading
+import typing
+
+QUEUED_CONDITION = threading.Condition()
+QUEUED_VERSION = 0
+QUEUED_ASYNC_WAITERS: set[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = set()
+
+PROGRESS_SUBSCRIBERS_LOCK = threading.Lock()
+PROGRESS_SUBSCRIBERS: set[tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = set()
+PROGRESS_SUBSCRIBER_QUEUE_SIZE = 1000
+"""Events for the subscriber that does not read them are dropped, it gets them later from the changes feed."""
+
+
+def get_queued_version() -> int:
+    """Returns the counter that is incremented each time the tasks available for dispatch may have changed.
+
+    Take the value *before* querying the database, and pass it to the `wait_for_queued_tasks` functions,
+    so that tasks queued between the query and the wait are not missed.
+    """
+    return QUEUED_VERSION
+
+
+def notify_tasks_queued() -> None:
+    """Wakes up all parked `/api/tasks/next` requests and the local worker. Safe to call from any thread."""
+    global QUEUED_VERSION
+    with QUEUED_CONDITION:
+        QUEUED_VERSION += 1
+        QUEUED_CONDITION.notify_all()
+        waiters = list(QUEUED_ASYNC_WAITERS)
+        QUEUED_ASYNC_WAITERS.clear()
+    for loop, future in waiters:
+        with contextlib.suppress(RuntimeError):  # event loop is already closed
+            loop.call_soon_threadsafe(__set_future_done, future)
+
+
+def wait_for_queued_tasks(queued_version: int, timeout: float) -> bool:
+    with QUEUED_CONDITION:
+        return QUEUED_CONDITION.wait_for(lambda: queued_version != QUEUED_VERSION, timeout)
+
+
+async def wait_for_queued_tasks_async(queued_version: int, timeout: float) -> bool:
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    waiter = (loop, future)
+    with QUEUED_CONDITION:
+        if queued_version != QUEUED_VERSION:
+            return True
+        QUEUED_ASYNC_WAITERS.add(waiter)
+    try:
+        await asyncio.wait_for(future, timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        with QUEUED_CONDITION:
+            QUEUED_ASYNC_WAITERS.discard(waiter)
+
+
+def publish_task_progress(event: dict) -> None:
+    """Sends the progress update recorded by the tasks engine to all subscribers. Safe to call from any thread."""
+    with PROGRESS_SUBSCRIBERS_LOCK:
+        subscribers = list(PROGRESS_SUBSCRIBERS)
+    for loop, queue in subscribers:
+        with contextlib.suppress(RuntimeError):  # event loop is already closed
+            loop.call_soon_threadsafe(__put_event, queue, event)
+
+
+@contextlib.contextmanager
+def tasks_progress_subscription() -> typing.Iterator[asyncio.Queue]:
+    """Subscribes to the progress updates of all tasks of this process, should be used in the event loop."""
+    subscriber = (asyncio.get_running_loop(), asyncio.Queue(PROGRESS_SUBSCRIBER_QUEUE_SIZE))
+    with PROGRESS_SUBSCRIBERS_LOCK:
+        PROGRESS_SUBSCRIBERS.add(subscriber)
+    try:
+        yield subscriber[1]
+    finally:
+        with PROGRESS_SUBSCRIBERS_LOCK:
+            PROGRESS_SUBSCRIBERS.discard(subscriber)
+
+
+def __put_event(queue: asyncio.Queue, event: dict) -> None:
+    with contextlib.suppress(asyncio.QueueFull):
+        queue.put_nowait(event)
+
+
+def __set_future_done(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
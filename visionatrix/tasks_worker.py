@@ -0,0 +1,427 @@
+import builtins
+import gc
+import logging
+import os
+import threading
+import time
+
+import httpx
+import torch
+
+from . import options
+from .comfyui import cleanup_models, interrupt_processing, soft_empty_cache
+from .flows import get_installed_flows
+from .tasks_engine import (
+    extend_tasks_locks,
+    get_incomplete_task_without_error,
+    get_task_files,
+    remove_task_files,
+    remove_task_lock,
+    update_task_outputs,
+    update_task_progress,
+)
+from .worker_client import server_request
+
+LOGGER = logging.getLogger("visionatrix")
+
+ACTIVE_TASK: dict = {}
+"""Details of the executing task. Its progress is in the ACTIVE_TASK_PROGRESS."""
+PREFETCHED_TASKS: list[dict] = []
+"""Tasks claimed in advance with already downloaded inputs, in the order they should be executed."""
+PREFETCHED_TASKS_LOCK = threading.Lock()
+
+
+class TaskProgressState:
+    """Progress of the executing task, changed by the ComfyUI callbacks and sent by the `update_task_progress_thread`.
+
+    Each change increments the `version` and wakes up the thread waiting for the changes."""
+
+    def __init__(self, progress: float = 0.0, error: str = "", execution_time: float = 0.0):
+        self.condition = threading.Condition()
+        self.version = 0
+        self.progress = progress
+        self.error = error
+        self.execution_time = execution_time
+        self.interrupted = False
+
+    def update(self, **values) -> None:
+        with self.condition:
+            for k, v in values.items():
+                setattr(self, k, v)
+            self.version += 1
+            self.condition.notify_all()
+
+    def add_progress(self, percent_finished: float) -> None:
+        with self.condition:
+            self.update(progress=min(self.progress + percent_finished, 99.0))
+
+    def is_final(self) -> bool:
+        return self.progress == 100.0 or bool(self.error) or self.interrupted
+
+    def wait(self, version: int, timeout: float, only_final: bool = False) -> None:
+        """Waits for the change from the `version`, or only for the final state, for `timeout` seconds at most."""
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.is_final() or (not only_final and self.version != version), max(timeout, 0.0)
+            )
+
+    def snapshot(self) -> tuple[int, dict]:
+        with self.condition:
+            return self.version, {
+                "progress": self.progress,
+                "error": self.error,
+                "execution_time": self.execution_time,
+                "interrupted": self.interrupted,
+            }
+
+
+ACTIVE_TASK_PROGRESS = TaskProgressState()
+
+
+def remove_active_task_lock():
+    if ACTIVE_TASK:
+        remove_task_lock(ACTIVE_TASK["task_id"])
+    remove_prefetched_tasks_locks()
+
+
+def remove_prefetched_tasks_locks() -> None:
+    with PREFETCHED_TASKS_LOCK:
+        prefetched_tasks = PREFETCHED_TASKS.copy()
+        PREFETCHED_TASKS.clear()
+    for task in prefetched_tasks:
+        remove_task_files(task["task_id"], ["input"])
+        remove_task_lock(task["task_id"])
+
+
+def pop_prefetched_task() -> dict:
+    with PREFETCHED_TASKS_LOCK:
+        return PREFETCHED_TASKS.pop(0) if PREFETCHED_TASKS else {}
+
+
+def prefetch_tasks_thread(exit_event: threading.Event) -> None:
+    """Claims the next tasks and downloads their inputs while the current task is executing.
+
+    Lock leases of the prefetched tasks are extended, without changing the tasks, until they are taken for execution.
+    """
+    last_lease_update = time.perf_counter()
+    while not exit_event.wait(options.MAX_PAUSE_INTERVAL):
+        if time.perf_counter() - last_lease_update > options.TASK_LOCK_LEASE / 3:
+            last_lease_update = time.perf_counter()
+            extend_prefetched_tasks_locks()
+        if not ACTIVE_TASK or len(PREFETCHED_TASKS) >= options.WORKER_PREFETCH_TASKS:
+            continue
+        task = get_incomplete_task_without_error(
+            list(get_installed_flows()),
+            ACTIVE_TASK.get("name", ""),
+            min(options.WORKER_LONG_POLL_TIMEOUT, options.TASK_LOCK_LEASE / 3),
+            get_flow_models_names(ACTIVE_TASK.get("name", "")),
+        )
+        if task and init_task_inputs_from_server(task):
+            LOGGER.debug("Task %s: prefetched.", task["task_id"])
+            with PREFETCHED_TASKS_LOCK:
+                PREFETCHED_TASKS.append(task)
+        if exit_event.is_set():
+            break
+    remove_prefetched_tasks_locks()
+
+
+def extend_prefetched_tasks_locks() -> None:
+    """Prefetched tasks which locks were lost are removed, unless already taken for execution."""
+    with PREFETCHED_TASKS_LOCK:
+        prefetched_tasks = PREFETCHED_TASKS.copy()
+    if not prefetched_tasks:
+        return
+    locked_task_ids = set(extend_tasks_locks([i["task_id"] for i in prefetched_tasks]))
+    for task in prefetched_tasks:
+        if task["task_id"] in locked_task_ids:
+            continue
+        with PREFETCHED_TASKS_LOCK:
+            if task not in PREFETCHED_TASKS:
+                continue  # already taken for execution
+            PREFETCHED_TASKS.remove(task)
+        LOGGER.warning("Task %s: prefetched task is no longer available.", task["task_id"])
+        remove_task_files(task["task_id"], ["input"])
+        remove_task_lock(task["task_id"])
+
+
+def get_flow_models_names(flow_name: str) -> list[str]:
+    """Models of the last executed flow are kept by ComfyUI in the cache of the executed nodes."""
+    flow = get_installed_flows().get(flow_name) if flow_name else None
+    return [i.name for i in flow.models] if flow else []
+
+
+def init_task_inputs_from_server(task: dict) -> bool:
+    if not (options.VIX_MODE == "WORKER" and options.VIX_SERVER):
+        return True
+    task_id = task["task_id"]
+    remove_task_files(task_id, ["output", "input"])
+    input_directory = os.path.join(options.TASKS_FILES_DIR, "input")
+    try:
+        for i, _ in enumerate(task["input_files"]):
+            r = server_request("GET", "/api/tasks/inputs", params={"task_id": task_id, "input_index": i})
+            if r.status_code == httpx.codes.NOT_FOUND:
+                raise RuntimeError(f"Task {task_id}: not found on server")
+            if httpx.codes.is_error(r.status_code):
+                raise RuntimeError(f"Task {task_id}: can not get input file, status={r.status_code}")
+            with builtins.open(
+                os.path.join(input_directory, task["input_files"][i]["file_name"]), mode="wb"
+            ) as input_file:
+                input_file.write(r.content)
+        return True
+    except Exception as e:
+        LOGGER.exception("Can not work on task")
+        task["error"] = str(e)
+        update_task_progress(task)
+        remove_task_files(task_id, ["output", "input"])
+        remove_task_lock(task_id)
+        return False
+
+
+def upload_results_to_server(task_details: dict) -> bool:
+    task_id = task_details["task_id"]
+    output_files = get_task_files(task_id, "output")
+    if not (options.VIX_MODE == "WORKER" and options.VIX_SERVER):
+        for task_output in task_details["outputs"]:
+            task_file_prefix = f"{task_id}_{task_output['comfy_node_id']}_"
+            relevant_files = [file_info for file_info in output_files if file_info[0].startswith(task_file_prefix)]
+            file_size = 0
+            batch_size = 0
+            for i in relevant_files:
+                file_size += os.path.getsize(i[1])
+                batch_size += 1
+            task_output["file_size"] = file_size
+            task_output["batch_size"] = batch_size
+        update_task_outputs(task_id, task_details["outputs"])
+        return True
+    files = []
+    try:
+        for output_file in output_files:
+            file_handle = builtins.open(output_file[1], mode="rb")  # noqa pylint: disable=consider-using-with
+            files.append(
+                ("files", (output_file[0], file_handle)),
+            )
+        try:
+            r = server_request("PUT", "/api/tasks/results", params={"task_id": task_id}, files=files)
+            if r.status_code == httpx.codes.NOT_FOUND:
+                return False
+            if not httpx.codes.is_error(r.status_code):
+                return True
+            LOGGER.error("Task %s: server return status: %s", task_id, r.status_code)
+        except Exception as e:
+            LOGGER.exception("Task %s: exception occurred: %s", task_id, e)
+    finally:
+        for f in files:
+            f[1][1].close()
+        remove_task_files(task_id, ["output", "input"])
+    return False
+
+
+def increase_current_task_progress(percent_finished: float) -> None:
+    ACTIVE_TASK_PROGRESS.add_progress(percent_finished)
+
+
+def task_progress_callback(event: str, data: dict, broadcast: bool = False):
+    LOGGER.debug("%s(broadcast=%s): %s", event, broadcast, data)
+    if not ACTIVE_TASK:
+        LOGGER.warning("ACTIVE_TASK is empty, event = %s.", event)
+        return
+    node_percent = 99 / ACTIVE_TASK["nodes_count"]
+
+    if event == "executing":
+        if options.NODES_TIMING:
+            last_node_id_timing = ACTIVE_TASK.get("timing_last_node_id", 0)
+            current_time = time.perf_counter()
+            if last_node_id_timing and last_node_id_timing != data["node"]:
+                LOGGER.log(
+                    LOGGER.getEffectiveLevel(),
+                    "Flow %s, node %s execution time: %s",
+                    ACTIVE_TASK["task_id"],
+                    data["node"],
+                    current_time - ACTIVE_TASK["timing_last_time"],
+                )
+            ACTIVE_TASK["timing_last_node_id"] = data["node"]
+            ACTIVE_TASK["timing_last_time"] = current_time
+        if not ACTIVE_TASK["current_node"]:
+            ACTIVE_TASK["current_node"] = data["node"]
+        if ACTIVE_TASK["current_node"] != data["node"]:
+            increase_current_task_progress(node_percent)
+            ACTIVE_TASK["current_node"] = data["node"]
+    elif event == "progress" and "max" in data and "value" in data:
+        ACTIVE_TASK["current_node"] = ""
+        increase_current_task_progress(node_percent / int(data["max"]))
+    elif event == "execution_error":
+        ACTIVE_TASK_PROGRESS.update(error=data["exception_message"])
+        LOGGER.error(
+            "Exception occurred during executing task:\n%s\n%s",
+            data["exception_message"],
+            data["traceback"],
+        )
+    elif event == "execution_cached" and len(data["nodes"]) > 1:
+        increase_current_task_progress((len(data["nodes"]) - 1) * node_percent)
+    elif event == "execution_interrupted":
+        ACTIVE_TASK_PROGRESS.update(interrupted=True)
+
+
+def background_prompt_executor(prompt_executor, exit_event: threading.Event):
+    global ACTIVE_TASK, ACTIVE_TASK_PROGRESS
+    reply_count_no_tasks = 0
+    last_task_name = ""
+    last_gc_collect = 0
+    need_gc = False
+    # in "WORKER" mode without a Server there is nobody in our process to notify us about new tasks
+    long_poll_timeout = options.WORKER_LONG_POLL_TIMEOUT if options.VIX_MODE != "WORKER" or options.VIX_SERVER else 0.0
+    if options.WORKER_PREFETCH_TASKS > 0 and options.VIX_MODE == "WORKER" and options.VIX_SERVER:
+        threading.Thread(target=prefetch_tasks_thread, args=(exit_event,), daemon=True).start()
+
+    while True:
+        if need_gc:
+            current_time = time.perf_counter()
+            if (current_time - last_gc_collect) > options.GC_COLLECT_INTERVAL:
+                LOGGER.debug("cleanup_models")
+                cleanup_models()
+                LOGGER.debug("gc.collect")
+                gc.collect()
+                LOGGER.debug("soft_empty_cache")
+                soft_empty_cache(True)
+                last_gc_collect = current_time
+                need_gc = False
+
+        if exit_event.wait(
+            min(
+                options.MIN_PAUSE_INTERVAL + reply_count_no_tasks * options.MAX_PAUSE_INTERVAL / 10,
+                options.MAX_PAUSE_INTERVAL,
+            ),
+        ):
+            break
+
+        ACTIVE_TASK = pop_prefetched_task()
+        if not ACTIVE_TASK:
+            poll_start_time = time.perf_counter()
+            ACTIVE_TASK = get_incomplete_task_without_error(
+                list(get_installed_flows()), last_task_name, long_poll_timeout, get_flow_models_names(last_task_name)
+            )
+            if not ACTIVE_TASK:
+                if long_poll_timeout and time.perf_counter() - poll_start_time >= long_poll_timeout:
+                    reply_count_no_tasks = 0  # request was parked for the full timeout, no need to back off
+                else:
+                    reply_count_no_tasks = min(reply_count_no_tasks + 1, 10)
+                continue
+            if init_task_inputs_from_server(ACTIVE_TASK) is False:
+                ACTIVE_TASK = {}
+                continue
+        last_task_name = ACTIVE_TASK["name"]
+        ACTIVE_TASK["nodes_count"] = len(list(ACTIVE_TASK["flow_comfy"].keys()))
+        ACTIVE_TASK["current_node"] = ""
+        prompt_executor.server.last_prompt_id = str(ACTIVE_TASK["task_id"])
+        if options.GPU_MEM_TRACKING and torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        execution_start_time = time.perf_counter()
+        ACTIVE_TASK["execution_start_time"] = execution_start_time
+        ACTIVE_TASK_PROGRESS = TaskProgressState(
+            ACTIVE_TASK["progress"], ACTIVE_TASK["error"], ACTIVE_TASK.get("execution_time", 0.0)
+        )
+        threading.Thread(
+            target=update_task_progress_thread, args=(ACTIVE_TASK, ACTIVE_TASK_PROGRESS), daemon=True
+        ).start()
+        prompt_executor.execute(
+            ACTIVE_TASK["flow_comfy"],
+            str(ACTIVE_TASK["task_id"]),
+            {"client_id": "vix"},
+            [str(i["comfy_node_id"]) for i in ACTIVE_TASK["outputs"]],
+        )
+        current_time = time.perf_counter()
+        if not ACTIVE_TASK_PROGRESS.interrupted and not ACTIVE_TASK_PROGRESS.error:
+            if options.GPU_MEM_TRACKING and torch.cuda.is_available():
+                ACTIVE_TASK["vram_peak"] = torch.cuda.max_memory_allocated()
+                max_mem = ACTIVE_TASK["vram_peak"] / 1024**2
+                LOGGER.log(
+                    LOGGER.getEffectiveLevel(),
+                    "Flow %s with id=%s consumed a maximum of %.2f MB",
+                    ACTIVE_TASK["name"],
+                    ACTIVE_TASK["task_id"],
+                    max_mem,
+                )
+            ACTIVE_TASK_PROGRESS.update(progress=100.0, execution_time=current_time - execution_start_time)
+        ACTIVE_TASK = {}
+        LOGGER.info("Prompt executed in %f seconds", current_time - execution_start_time)
+        need_gc = True
+
+
+def update_task_progress_thread(active_task: dict, progress_state: TaskProgressState) -> None:
+    """Reports the progress of the task, at most WORKER_PROGRESS_MAX_RATE times per second.
+
+    Errors, interruption and completion are reported immediately."""
+    min_interval = 1 / options.WORKER_PROGRESS_MAX_RATE if options.WORKER_PROGRESS_MAX_RATE > 0 else 0.0
+    sent_version = progress_state.version
+    last_info = {**active_task, **progress_state.snapshot()[1]}
+    last_update_time = time.perf_counter()
+    lock_released = False
+    deadline = get_task_execution_deadline(active_task)
+    try:
+        while True:
+            # nodes can run for minutes without reporting progress, so periodically extend the lock lease
+            lease_update_time = last_update_time + options.TASK_LOCK_LEASE / 3
+            wake_up_time = lease_update_time if deadline is None else min(lease_update_time, deadline)
+            progress_state.wait(sent_version, wake_up_time - time.perf_counter())
+            if deadline is not None and time.perf_counter() > deadline and not progress_state.error:
+                LOGGER.warning("Task %s: max execution time exceeded, interrupting.", active_task["task_id"])
+                progress_state.update(error="Max execution time exceeded.")
+                interrupt_processing()
+            if progress_state.version != sent_version:
+                # coalesce the following changes, but do not delay the final state
+                progress_state.wait(sent_version, last_update_time + min_interval - time.perf_counter(), True)
+            elif time.perf_counter() < lease_update_time:
+                continue
+            sent_version, progress_info = progress_state.snapshot()
+            sent_progress = last_info["progress"]
+            last_info = {**active_task, **progress_info}
+            last_update_time = time.perf_counter()
+            if last_info["progress"] == 100.0:
+                upload_results_keeping_lease(last_info, sent_progress)
+                break
+            if not update_task_progress(last_info):
+                # the lock is no longer ours: the task was removed, or returned to the queue (e.g. preempted)
+                lock_released = True
+                # a task with a higher priority may be waiting, so do not execute the prefetched ones first
+                remove_prefetched_tasks_locks()
+                progress_state.update(interrupted=True)
+                interrupt_processing()
+                break
+            if last_info["error"] or last_info["interrupted"]:
+                break
+    finally:
+        if not lock_released:
+            remove_task_lock(last_info["task_id"])
+
+
+def upload_results_keeping_lease(task_info: dict, sent_progress: float) -> None:
+    """Uploads the results of the finished task and reports its completion.
+
+    Uploading can take longer than the lock lease, so until the task is reported as finished,
+    its lease is extended with the last reported(not final) progress."""
+    waiting_task_info = {**task_info, "progress": sent_progress}
+    uploaded = threading.Event()
+    uploaded_lock = threading.Lock()
+
+    def keep_lease():
+        while not uploaded.wait(options.TASK_LOCK_LEASE / 3):
+            with uploaded_lock:  # the final update should not be overwritten by the lease extension
+                if not uploaded.is_set():
+                    update_task_progress(waiting_task_info)
+
+    threading.Thread(target=keep_lease, daemon=True).start()
+    try:
+        uploaded_results = upload_results_to_server(task_info)
+        with uploaded_lock:
+            uploaded.set()
+        if uploaded_results:
+            update_task_progress(task_info)
+    finally:
+        uploaded.set()
+
+
+def get_task_execution_deadline(task_info: dict) -> float | None:
+    """Returns the time(perf_counter) at which the execution should be interrupted, or None if there is no limit."""
+    if not task_info.get("max_execution_time"):
+        return None
+    return task_info["execution_start_time"] + task_info["max_execution_time"]
@@ -0,0 +1,201 @@
+"""Delivery of the tasks progress to their webhooks.
+
+Progress updates are queued, and only the latest not yet sent update of each task is kept. They are sent in the
+background by the `webhooks_dispatcher`, with one pooled client per destination, so a slow webhook does not delay
+the tasks engine. Final updates (completion or error) that could not be delivered are saved to the database and
+retried with backoff, also by other Server instances(processes) or after the restart.
+"""
+
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from . import options
+from .db_queries import (
+    add_webhook_delivery,
+    claim_webhook_deliveries,
+    finish_webhook_delivery,
+)
+from .db_queries_async import (
+    add_webhook_delivery_async,
+    claim_webhook_deliveries_async,
+    finish_webhook_delivery_async,
+)
+from .metrics import increment_metric
+
+LOGGER = logging.getLogger("visionatrix")
+
+WEBHOOKS_LOCK = threading.Lock()
+WEBHOOKS_PENDING: dict[int, tuple[str, dict | None, dict]] = {}
+"""Latest not yet sent progress update (url, headers, payload) of the tasks, keyed by `task_id`."""
+WEBHOOKS_WAKEUP: tuple[asyncio.AbstractEventLoop, asyncio.Event] | None = None
+WEBHOOKS_IN_FLIGHT: set[int] = set()
+"""IDs of the tasks which updates are being sent, the newer updates of them wait until the sending is finished."""
+WEBHOOKS_QUEUE_SIZE = 10000
+"""When so many tasks wait for the delivery, updates of other tasks are dropped. Final updates are always queued."""
+WEBHOOKS_MAX_CONCURRENCY = 32
+
+WEBHOOK_TIMEOUT = 3.0
+WEBHOOK_MAX_CONNECTIONS = 8
+"""Maximum number of connections to one destination."""
+WEBHOOK_CLIENTS: dict[str, httpx.AsyncClient] = {}
+"""Clients of the recently used destinations(scheme, host and port), the least recently used are closed first."""
+WEBHOOK_CLIENTS_MAX = 100
+
+WEBHOOK_MAX_ATTEMPTS = 8
+WEBHOOK_RETRY_BACKOFF = 5.0
+"""Delay (in seconds) before the second attempt of the final update, doubled for each following attempt."""
+WEBHOOK_RETRY_MAX_BACKOFF = 600.0
+WEBHOOKS_RETRY_CHECK_INTERVAL = 5.0
+"""Interval (in seconds) at which the saved final updates are checked for the retry."""
+
+
+def enqueue_task_webhook(
+    url: str, headers: dict | None, task_id: int, progress: float, execution_time: float, error: str
+) -> None:
+    """Queues the progress update to be sent to the webhook of the task. Safe to call from any thread."""
+    payload = {"task_id": task_id, "progress": progress, "execution_time": execution_time, "error": error}
+    with WEBHOOKS_LOCK:
+        if task_id in WEBHOOKS_PENDING:
+            increment_metric("webhooks_coalesced")
+        elif len(WEBHOOKS_PENDING) >= WEBHOOKS_QUEUE_SIZE and not __is_final(payload):
+            increment_metric("webhooks_dropped")
+            return
+        WEBHOOKS_PENDING[task_id] = (url, headers, payload)
+        wakeup = WEBHOOKS_WAKEUP
+    if wakeup is not None:
+        with contextlib.suppress(RuntimeError):  # event loop is already closed
+            wakeup[0].call_soon_threadsafe(wakeup[1].set)
+
+
+async def webhooks_dispatcher(exit_event: threading.Event) -> None:
+    """Sends the queued progress updates and retries the saved final updates until the `exit_event` is set."""
+    global WEBHOOKS_WAKEUP
+    wakeup = asyncio.Event()
+    with WEBHOOKS_LOCK:
+        WEBHOOKS_WAKEUP = (asyncio.get_running_loop(), wakeup)
+    deliveries: set[asyncio.Task] = set()
+    next_retry_check = 0.0
+    try:
+        while not exit_event.is_set():
+            wakeup.clear()
+            if time.monotonic() >= next_retry_check:
+                next_retry_check = time.monotonic() + WEBHOOKS_RETRY_CHECK_INTERVAL
+                for delivery in await __claim_deliveries(WEBHOOKS_MAX_CONCURRENCY - len(deliveries)):
+                    __start_delivery(deliveries, __retry_delivery(delivery))
+            for task_id, (url, headers, payload) in __pop_pending(WEBHOOKS_MAX_CONCURRENCY - len(deliveries)):
+                __start_delivery(deliveries, __deliver(task_id, url, headers, payload, wakeup))
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(wakeup.wait(), max(next_retry_check - time.monotonic(), 0.0))
+    finally:
+        with WEBHOOKS_LOCK:
+            WEBHOOKS_WAKEUP = None
+        for client in WEBHOOK_CLIENTS.values():
+            with contextlib.suppress(Exception):
+                await client.aclose()
+        WEBHOOK_CLIENTS.clear()
+
+
+def __start_delivery(deliveries: set[asyncio.Task], coroutine) -> None:
+    delivery = asyncio.create_task(coroutine)
+    deliveries.add(delivery)
+    delivery.add_done_callback(deliveries.discard)
+
+
+def __pop_pending(limit: int) -> list[tuple[int, tuple[str, dict | None, dict]]]:
+    r = []
+    with WEBHOOKS_LOCK:
+        for task_id in list(WEBHOOKS_PENDING):
+            if len(r) >= limit:
+                break
+            if task_id not in WEBHOOKS_IN_FLIGHT:
+                r.append((task_id, WEBHOOKS_PENDING.pop(task_id)))
+                WEBHOOKS_IN_FLIGHT.add(task_id)
+    return r
+
+
+async def __deliver(task_id: int, url: str, headers: dict | None, payload: dict, wakeup: asyncio.Event) -> None:
+    try:
+        if not await __send_webhook(url, headers, payload) and __is_final(payload):
+            next_attempt_at = datetime.utcnow() + timedelta(seconds=WEBHOOK_RETRY_BACKOFF)
+            if options.VIX_MODE == "SERVER":
+                await add_webhook_delivery_async(task_id, url, headers, payload, next_attempt_at)
+            else:
+                await asyncio.to_thread(add_webhook_delivery, task_id, url, headers, payload, next_attempt_at)
+    finally:
+        with WEBHOOKS_LOCK:
+            WEBHOOKS_IN_FLIGHT.discard(task_id)
+        wakeup.set()  # the newer update of the task may be waiting
+
+
+async def __claim_deliveries(limit: int) -> list[dict]:
+    if limit <= 0:
+        return []
+    lease = WEBHOOK_TIMEOUT * 10
+    if options.VIX_MODE == "SERVER":
+        return await claim_webhook_deliveries_async(limit, lease)
+    return await asyncio.to_thread(claim_webhook_deliveries, limit, lease)
+
+
+async def __retry_delivery(delivery: dict) -> None:
+    increment_metric("webhooks_retries")
+    attempts = delivery["attempts"] + 1
+    next_attempt_at = None
+    if not await __send_webhook(delivery["url"], delivery["headers"], delivery["payload"]):
+        if attempts < WEBHOOK_MAX_ATTEMPTS:
+            backoff = min(WEBHOOK_RETRY_BACKOFF * 2 ** (attempts - 1), WEBHOOK_RETRY_MAX_BACKOFF)
+            next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff)
+        else:
+            LOGGER.error(
+                "Task %s: webhook %s was not delivered after %s attempts, progress=%s",
+                delivery["task_id"],
+                delivery["url"],
+                attempts,
+                delivery["payload"]["progress"],
+            )
+            increment_metric("webhooks_abandoned")
+    if options.VIX_MODE == "SERVER":
+        await finish_webhook_delivery_async(delivery["id"], attempts, next_attempt_at)
+    else:
+        await asyncio.to_thread(finish_webhook_delivery, delivery["id"], attempts, next_attempt_at)
+
+
+async def __send_webhook(url: str, headers: dict | None, payload: dict) -> bool:
+    """Returns False if the update should be sent again."""
+    start_time = time.perf_counter()
+    try:
+        r = await __get_webhook_client(url).post(url.rstrip("/") + "/task-progress", json=payload, headers=headers)
+    except (httpx.RequestError, httpx.InvalidURL) as e:
+        LOGGER.warning("Exception during calling webhook %s, progress=%s: %s", url, payload["progress"], e)
+        increment_metric("webhooks_failed")
+        return False
+    increment_metric("webhooks_delivery_time", time.perf_counter() - start_time)
+    if r.is_server_error or r.status_code in (httpx.codes.REQUEST_TIMEOUT, httpx.codes.TOO_MANY_REQUESTS):
+        LOGGER.warning("Webhook %s, progress=%s: status %s", url, payload["progress"], r.status_code)
+        increment_metric("webhooks_failed")
+        return False
+    increment_metric("webhooks_delivered")
+    return True
+
+
+def __get_webhook_client(url: str) -> httpx.AsyncClient:
+    parsed_url = httpx.URL(url)
+    destination = f"{parsed_url.scheme}://{parsed_url.netloc.decode()}"
+    client = WEBHOOK_CLIENTS.pop(destination, None)
+    if client is None:
+        if len(WEBHOOK_CLIENTS) >= WEBHOOK_CLIENTS_MAX:
+            _ = asyncio.create_task(WEBHOOK_CLIENTS.pop(next(iter(WEBHOOK_CLIENTS))).aclose())  # noqa
+        client = httpx.AsyncClient(
+            timeout=WEBHOOK_TIMEOUT, limits=httpx.Limits(max_connections=WEBHOOK_MAX_CONNECTIONS)
+        )
+    WEBHOOK_CLIENTS[destination] = client
+    return client
+
+
+def __is_final(payload: dict) -> bool:
+    return payload["progress"] == 100.0 or bool(payload["error"])
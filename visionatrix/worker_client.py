@@ -0,0 +1,93 @@
+"""HTTP client of the worker for the requests to the Server.
+
+All requests share one connection pool, so the TCP(and TLS) connections are reused between the requests,
+and one policy of retries: the request is repeated with exponential backoff when the connection to the Server fails,
+or when the proxy in front of it reports that the Server is unavailable.
+Requests that the Server may already have processed (timeouts, dropped connections) are repeated only when they are
+idempotent, as repeating `/api/tasks/next` could claim one more task.
+"""
+
+import logging
+import threading
+import time
+
+import httpx
+
+from . import options
+from .metrics import increment_metric
+
+LOGGER = logging.getLogger("visionatrix")
+
+SERVER_CLIENT: httpx.Client | None = None
+SERVER_CLIENT_LOCK = threading.Lock()
+
+SERVER_REQUEST_ATTEMPTS = 3
+SERVER_REQUEST_BACKOFF = 0.5
+"""Delay (in seconds) before the second attempt of the request, doubled for each following attempt."""
+SERVER_KEEPALIVE_EXPIRY = 4.0
+"""Idle connections are closed before uvicorn (`timeout_keep_alive` is 5 seconds by default) closes them."""
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+RETRY_STATUS_CODES = (httpx.codes.BAD_GATEWAY, httpx.codes.SERVICE_UNAVAILABLE, httpx.codes.GATEWAY_TIMEOUT)
+
+
+def get_server_client() -> httpx.Client:
+    global SERVER_CLIENT
+    with SERVER_CLIENT_LOCK:
+        if SERVER_CLIENT is None:
+            SERVER_CLIENT = httpx.Client(
+                base_url=options.VIX_SERVER.rstrip("/"),
+                auth=options.worker_auth(),
+                timeout=float(options.WORKER_NET_TIMEOUT),
+                limits=httpx.Limits(keepalive_expiry=SERVER_KEEPALIVE_EXPIRY),
+                http2=__is_http2_available(),
+            )
+        return SERVER_CLIENT
+
+
+def server_request(method: str, url: str, **kwargs) -> httpx.Response:
+    """Sends the request to the Server with the shared client, raises the last exception when all attempts fail.
+
+    `url` is relative to the VIX_SERVER, `kwargs` are passed to the `httpx.Client.request`."""
+    method = method.upper()
+    attempt = 1
+    while True:
+        start_time = time.perf_counter()
+        try:
+            r = get_server_client().request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            # after the timeout or the dropped connection the Server may have already processed the request
+            if attempt == SERVER_REQUEST_ATTEMPTS or not (
+                isinstance(e, httpx.ConnectError | httpx.ConnectTimeout | httpx.PoolTimeout)
+                or method in IDEMPOTENT_METHODS
+            ):
+                increment_metric("worker_requests_errors")
+                raise
+            LOGGER.warning("%s %s: attempt number %s: %s: %s", method, url, attempt, type(e).__name__, e)
+            increment_metric("worker_requests_retries")
+            time.sleep(SERVER_REQUEST_BACKOFF * 2 ** (attempt - 1))
+            attempt += 1
+            continue
+        increment_metric("worker_requests")
+        increment_metric("worker_requests_time", time.perf_counter() - start_time)
+        if (
+            r.status_code not in RETRY_STATUS_CODES
+            or method not in IDEMPOTENT_METHODS
+            or attempt == SERVER_REQUEST_ATTEMPTS
+        ):
+            return r
+        LOGGER.warning("%s %s: attempt number %s: server return status: %s", method, url, attempt, r.status_code)
+        increment_metric("worker_requests_retries")
+        time.sleep(SERVER_REQUEST_BACKOFF * 2 ** (attempt - 1))
+        attempt += 1
+
+
+def __is_http2_available() -> bool:
+    if not options.WORKER_HTTP2:
+        return False
+    try:
+        import h2  # noqa pylint: disable=import-outside-toplevel,unused-import
+
+        return True
+    except ImportError:
+        LOGGER.warning("WORKER_HTTP2 is enabled, but the `h2` package is not installed, using HTTP/1.1.")
+        return False
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from . import options
+
+WORKERS_LOCK = threading.Lock()
+WORKERS_HEARTBEATS: dict[str, dict] = {}
+"""Latest not yet flushed worker information, keyed by `worker_id`."""
+WORKERS_TASKS_TO_GIVE: dict[str, tuple[float, list[str]]] = {}
+"""Cached `tasks_to_give` of the workers with the time they were read from the database, keyed by `worker_id`."""
+WORKERS_MEMORY: dict[str, tuple[float, int]] = {}
+"""Memory of the workers (see `get_worker_memory`) with the time they were last seen, keyed by `worker_id`."""
+WORKERS_MEMORY_TTL = 60.0
+
+
+def record_worker_heartbeat(worker_id: str, worker_info_values: dict) -> list[str] | None:
+    """Remembers the latest worker information to be written by `flush_workers_heartbeats_database`.
+
+    Returns the cached `tasks_to_give` of the worker, or None if the worker should be registered(or re-read)
+    in the database by the caller, which then must call `set_worker_tasks_to_give_cache`.
+    """
+    with WORKERS_LOCK:
+        WORKERS_HEARTBEATS[worker_id] = worker_info_values
+        cached = WORKERS_TASKS_TO_GIVE.get(worker_id)
+    if cached is None or time.monotonic() - cached[0] > options.WORKERS_HEARTBEAT_INTERVAL:
+        return None
+    return cached[1]
+
+
+def set_worker_memory(worker_id: str, worker_memory: int) -> None:
+    with WORKERS_LOCK:
+        WORKERS_MEMORY[worker_id] = (time.monotonic(), worker_memory)
+
+
+def get_max_workers_memory() -> int:
+    """Returns the biggest memory among the workers seen during the last `WORKERS_MEMORY_TTL` seconds."""
+    min_time = time.monotonic() - WORKERS_MEMORY_TTL
+    with WORKERS_LOCK:
+        for worker_id in [k for k, v in WORKERS_MEMORY.items() if v[0] < min_time]:
+            del WORKERS_MEMORY[worker_id]
+        return max((v[1] for v in WORKERS_MEMORY.values()), default=0)
+
+
+def set_worker_tasks_to_give_cache(worker_id: str, tasks_to_give: list[str] | None, flushed: bool = False) -> None:
+    with WORKERS_LOCK:
+        WORKERS_TASKS_TO_GIVE[worker_id] = (time.monotonic(), tasks_to_give or [])
+        if flushed:
+            WORKERS_HEARTBEATS.pop(worker_id, None)
+
+
+def pop_workers_heartbeats() -> dict[str, dict]:
+    with WORKERS_LOCK:
+        heartbeats = WORKERS_HEARTBEATS.copy()
+        WORKERS_HEARTBEATS.clear()
+    return heartbeats
+
+
+def restore_workers_heartbeats(heartbeats: dict[str, dict]) -> None:
+    """Puts back the heartbeats that failed to be flushed, unless they were already replaced with the newer ones."""
+    with WORKERS_LOCK:
+        for worker_id, worker_info_values in heartbeats.items():
+            WORKERS_HEARTBEATS.setdefault(worker_id, worker_info_values)